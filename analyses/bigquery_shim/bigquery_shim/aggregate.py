@@ -0,0 +1,92 @@
+"""Single-pass aggregation of counter maps over formatted pings.
+
+Most dashboard exports are a `countByKey()` over some property of a ping,
+optionally restricted to a subset of pings. Rather than scanning the ping RDD
+once per export, declare each count as a `Metric` and compute all of them in a
+single `mapPartitions` pass.
+
+Metrics keyed on a property name and filtered with `where` can also be
+compiled to SQL, see `dashboard.aggregate_metrics`.
+"""
+
+import collections
+
+Metric = collections.namedtuple("Metric", ["name", "key", "filter", "property"])
+
+
+def metric(name, key, filter=None):
+    """Declare a counter map.
+
+    `key` is either a property name on the formatted ping, such as "vendorID",
+    or a function of the ping returning the key to count. `filter` is an
+    optional predicate restricting the pings that are counted.
+    """
+    if callable(key):
+        return Metric(name, key, filter, None)
+    return Metric(name, _property_getter(key), filter, key)
+
+
+class Where(collections.namedtuple("Where", ["values"])):
+    """Predicate accepting pings whose properties equal the given values."""
+
+    __slots__ = ()
+
+    def __call__(self, p):
+        for name, value in self.values:
+            if p[name] != value:
+                return False
+        return True
+
+
+def where(**values):
+    """Declare a filter on property values, e.g. where(OSName="Windows").
+
+    Unlike an arbitrary predicate, it can be compiled to SQL. Returns None,
+    accepting every ping, when no values are given.
+    """
+    if not values:
+        return None
+    return Where(tuple(sorted(values.items())))
+
+
+def _property_getter(name):
+    def get(p):
+        return p[name]
+
+    return get
+
+
+def count_pings(pings, metrics):
+    """Count an iterable of pings into one counter map per metric."""
+    counters = {m.name: collections.Counter() for m in metrics}
+    plan = [(counters[m.name], m.key, m.filter) for m in metrics]
+    for p in pings:
+        for counter, key, accept in plan:
+            if accept is None or accept(p):
+                counter[key(p)] += 1
+    return counters
+
+
+def merge_counters(a, b):
+    """Merge the counter maps of `b` into `a`."""
+    for name, counter in b.items():
+        if name in a:
+            a[name].update(counter)
+        else:
+            a[name] = counter
+    return a
+
+
+def aggregate(pings, metrics):
+    """Compute every metric over an RDD of pings in a single pass.
+
+    Returns a dictionary of metric name to a plain {key: count} dictionary,
+    in the same shape `countByKey()` would produce for each metric.
+    """
+    metrics = list(metrics)
+
+    def count_partition(iterator):
+        yield count_pings(iterator, metrics)
+
+    counters = pings.mapPartitions(count_partition).fold({}, merge_counters)
+    return {m.name: dict(counters.get(m.name, {})) for m in metrics}
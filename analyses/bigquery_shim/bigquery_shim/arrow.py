@@ -0,0 +1,323 @@
+"""Arrow record batch ingestion of fetched pings.
+
+Loading the destination table through the Spark BigQuery connector and
+dropping to `.rdd` turns every row into a pickled `Row` that is then converted
+on its own. Here the table is instead read as Arrow record batches, either
+through the BigQuery Storage Read API or from local Parquet or JSON lines files
+standing in for it, and each batch is converted a column at a time.
+
+Requires `pyarrow`, plus `google-cloud-bigquery-storage` to read from BigQuery.
+"""
+
+import json
+import os
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.json as pj
+import pyarrow.parquet as pq
+
+from . import dashboard, histograms, trends
+from .snake_case import convert_snake_case_dict, snake_case
+
+# Properties derived from each ping by `convert_dashboard_batch`, matching
+# those set by `Validate` in the dashboard notebook.
+DERIVED_PROPERTIES = [
+    "OS",
+    "OSName",
+    "OSVersion",
+    "FxVersion",
+    "vendorID",
+    "deviceID",
+    "driverVersion",
+    "deviceAndDriver",
+    "driverVendor",
+    "valid",
+]
+
+
+def create_read_streams(project_id, dataset_id, table_id, max_streams=0):
+    """Open an Arrow read session on a table and return its stream names."""
+    from google.cloud.bigquery_storage import BigQueryReadClient, types
+
+    client = BigQueryReadClient()
+    session = client.create_read_session(
+        parent="projects/{}".format(project_id),
+        read_session=types.ReadSession(
+            table="projects/{}/datasets/{}/tables/{}".format(
+                project_id, dataset_id, table_id
+            ),
+            data_format=types.DataFormat.ARROW,
+        ),
+        max_stream_count=max_streams,
+    )
+    return [stream.name for stream in session.streams]
+
+
+def read_stream_batches(stream_name):
+    """Yield the record batches of a single read stream."""
+    from google.cloud.bigquery_storage import BigQueryReadClient
+
+    reader = BigQueryReadClient().read_rows(stream_name)
+    for page in reader.rows().pages:
+        yield from page.to_arrow().to_batches()
+
+
+def read_parquet_batches(path, batch_size=65536):
+    """Yield the record batches of a local Parquet file."""
+    yield from pq.ParquetFile(path).iter_batches(batch_size=batch_size)
+
+
+def read_jsonl_batches(path):
+    """Yield the record batches of a local JSON lines file."""
+    # Column types are inferred per block, and a block in which a sparse
+    # column such as a keyed histogram is always empty makes it unreadable;
+    # read_json holds the whole file anyway, so parse it as a single block.
+    block_size = max(os.path.getsize(path), pj.ReadOptions().block_size)
+    read_options = pj.ReadOptions(block_size=block_size)
+    yield from pj.read_json(path, read_options=read_options).to_batches()
+
+
+def read_pings(sc, sources, read_batches, convert):
+    """Read and convert pings from each source on the executors.
+
+    `sources` are read stream names or file paths, one Spark partition each.
+    `read_batches` yields the record batches of a source and `convert` turns a
+    record batch into a list of pings.
+    """
+
+    def read(source):
+        for batch in read_batches(source):
+            yield from convert(batch)
+
+    return sc.parallelize(sources, max(len(sources), 1)).flatMap(read)
+
+
+def _columns(batch):
+    return {name: batch.column(i).to_pylist() for i, name in enumerate(batch.schema.names)}
+
+
+def _decode_histograms(values, dense):
+    if dense:
+        return [histograms.to_dense(v) for v in values]
+    return [json.loads(v) if isinstance(v, str) else v for v in values]
+
+
+def _decode_keyed_histograms(values, dense):
+    decode = histograms.to_count if dense else json.loads
+    # None marks a column value that convert_bigquery_results skips.
+    return [
+        {i["key"]: decode(i["value"]) for i in v} if len(v) else None for v in values
+    ]
+
+
+def convert_dashboard_batch(batch, dense_histograms=False):
+    """Convert a record batch of dashboard.fetch_results rows.
+
+    Each ping has the shape produced by `dashboard.convert_bigquery_results`,
+    with the properties in DERIVED_PROPERTIES added at the top level.
+    """
+    derived = _derive_os(batch)
+    derived.update(_derive_devices(batch))
+    derived = {key: values.to_pylist() for key, values in derived.items()}
+    has_version = derived.pop("hasVersion")
+    valid = derived.pop("valid")
+    os_properties = [(key, derived.pop(key)) for key in ("OS", "OSName", "OSVersion")]
+    device_properties = list(derived.items())
+
+    columns = _columns(batch)
+    num_rows = batch.num_rows
+    additional_gfx = columns.pop("additional_gfx", [None] * num_rows)
+    additional_properties = columns.pop("additional_properties", [None] * num_rows)
+    plan = dashboard.get_conversion_plan(tuple(columns))
+
+    # Decode histogram columns in one go, before building any ping.
+    decoded = []
+    for column, parents, leaf, kind in plan:
+        values = columns[column]
+        if kind == dashboard.HISTOGRAM:
+            values = _decode_histograms(values, dense_histograms)
+        elif kind == dashboard.KEYED_HISTOGRAM:
+            values = _decode_keyed_histograms(values, dense_histograms)
+        decoded.append((parents, leaf, kind, values))
+
+    pings = []
+    for row in range(num_rows):
+        ping = {}
+        for parents, leaf, kind, values in decoded:
+            v = values[row]
+            if kind == dashboard.KEYED_HISTOGRAM and v is None:
+                continue
+            target = ping
+            for piece in parents:
+                target = target.setdefault(piece, {})
+            if kind == dashboard.HISTOGRAM and dense_histograms:
+                target[leaf] = v
+            else:
+                target[leaf] = v if v else {}
+        gfx = dashboard.decode_additional_gfx(
+            additional_gfx[row], additional_properties[row]
+        )
+        dashboard.merge_additional_gfx(ping, gfx)
+
+        for key, values in os_properties:
+            ping[key] = values[row]
+        # Pings without a version or adapter are not valid, see Validate.
+        if valid[row]:
+            for key, values in device_properties:
+                ping[key] = values[row]
+            # The driver vendor only comes with the additional gfx JSON.
+            adapter = ping["environment"]["system"]["gfx"]["adapters"][0]
+            ping["driverVendor"] = _lookup(adapter, "driverVendor")
+            ping["valid"] = True
+        elif has_version[row]:
+            ping["FxVersion"] = derived["FxVersion"][row]
+        pings.append(ping)
+    return pings
+
+
+def _lookup(mapping, key):
+    # Same resolution as a SnakeCaseDict: the key as given, then snake_cased.
+    if key in mapping:
+        return mapping[key]
+    return mapping.get(snake_case(key))
+
+
+def _column(batch, name, type=pa.string()):
+    # A column the batch lacks, or that JSON inference left untyped, is null.
+    index = batch.schema.get_field_index(name)
+    if index < 0 or pa.types.is_null(batch.schema.field(index).type):
+        return pa.nulls(batch.num_rows, type)
+    return batch.column(index)
+
+
+def _or(values, default):
+    # Like `value or default` on each string value.
+    return pc.if_else(pc.fill_null(pc.equal(values, ""), True), default, values)
+
+
+def _derive_os(batch):
+    name = _or(_column(batch, "environment__system__os__name"), "w")
+    version = _or(_column(batch, "environment__system__os__version"), "0")
+    service_pack = _column(
+        batch, "environment__system__os__service_pack_major", pa.int64()
+    )
+    service_pack = pc.fill_null(pc.cast(service_pack, pa.string()), "0")
+
+    is_linux = pc.equal(name, "Linux")
+    is_windows = pc.equal(name, "Windows_NT")
+    os_name = pc.if_else(is_windows, "Windows", pc.if_else(is_linux, "Linux", name))
+    os_version = pc.if_else(
+        is_windows,
+        pc.binary_join_element_wise(version, service_pack, "."),
+        pc.if_else(is_linux, pa.scalar(None, pa.string()), version),
+    )
+    os = pc.if_else(
+        is_linux, "Linux", pc.binary_join_element_wise(os_name, os_version, "-")
+    )
+    return {"OS": os, "OSName": os_name, "OSVersion": os_version}
+
+
+def _adapter_field(adapter, key):
+    # Resolved like _lookup, on the fields of the adapter struct.
+    names = [field.name for field in adapter.type]
+    for name in (key, snake_case(key)):
+        if name in names:
+            return pc.struct_field(adapter, name)
+    return pa.nulls(len(adapter), pa.string())
+
+
+def _derive_devices(batch):
+    version = _column(batch, "environment__build__version")
+    has_version = pc.invert(pc.fill_null(pc.equal(version, ""), True))
+    fx_version = pc.replace_substring_regex(
+        version, pattern=r"\..*", replacement="", max_replacements=1
+    )
+
+    adapters = _column(batch, "environment__system__gfx__adapters")
+    if pa.types.is_list(adapters.type) and pa.types.is_struct(adapters.type.value_type):
+        # list_element fails on empty lists, so null those first.
+        has_adapters = pc.fill_null(
+            pc.greater(pc.list_value_length(adapters), 0), False
+        )
+        adapters = pc.if_else(has_adapters, adapters, pa.scalar(None, adapters.type))
+        adapter = pc.list_element(adapters, 0)
+        has_adapter = pc.is_valid(adapter)
+    else:
+        adapter = None
+        has_adapter = pa.array([False] * batch.num_rows)
+
+    def T(key):
+        if adapter is None:
+            return pa.array(["Unknown"] * batch.num_rows)
+        return _or(pc.cast(_adapter_field(adapter, key), pa.string()), "Unknown")
+
+    vendor_id = T("vendorID")
+    vendor_id = pc.if_else(
+        pc.equal(vendor_id, "Intel Open Source Technology Center"), "0x8086", vendor_id
+    )
+    device_id = pc.binary_join_element_wise(vendor_id, T("deviceID"), "/")
+    driver_version = T("driverVersion")
+    return {
+        "FxVersion": fx_version,
+        "vendorID": vendor_id,
+        "deviceID": device_id,
+        "driverVersion": pc.binary_join_element_wise(vendor_id, driver_version, "/"),
+        "deviceAndDriver": pc.binary_join_element_wise(device_id, driver_version, "/"),
+        "hasVersion": has_version,
+        "valid": pc.and_(has_version, has_adapter),
+    }
+
+
+def convert_trends_batch(batch):
+    """Convert a record batch of trends.fetch_results rows.
+
+    Each ping has the shape produced by `trends.to_dataset`.
+    """
+    columns = _columns(batch)
+    rows = zip(
+        columns["client_id"],
+        columns["creation_date"],
+        columns["architecture"],
+        columns["build_version"],
+        columns["is_wow64"],
+        columns["cpu"],
+        columns["adapters"],
+        columns["features"],
+        columns["name"],
+        columns["os_version"],
+        columns["service_pack_major"],
+    )
+
+    week_starts = _week_starts(batch).to_pylist()
+
+    pings = []
+    for row, week_start in zip(rows, week_starts):
+        o = {}
+        o["clientId"] = row[0]
+        o["creationDate"] = row[1]
+        o[trends.ArchKey] = row[2]
+        o[trends.FxVersionKey] = row[3]
+        o[trends.Wow64Key] = row[4]
+        o[trends.CpuKey] = row[5] or None
+        o[trends.GfxAdaptersKey] = row[6]
+        o[trends.GfxFeaturesKey] = row[7] or None
+        o[trends.OSNameKey] = row[8]
+        o[trends.OSVersionKey] = row[9]
+        o[trends.OSServicePackMajorKey] = row[10]
+        if week_start is not None:
+            o[trends.WeekStartKey] = week_start
+        pings.append(convert_snake_case_dict(o, lazy=True))
+    return pings
+
+
+def _week_starts(batch):
+    # The week_start column as dates; see trends.to_date for the types it has.
+    week_start = _column(batch, "week_start", pa.date32())
+    if pa.types.is_string(week_start.type):
+        week_start = pc.strptime(
+            pc.utf8_slice_codeunits(week_start, 0, 10),
+            format=trends.FORMAT_DS,
+            unit="s",
+        )
+    return pc.cast(week_start, pa.date32(), safe=False)
@@ -1,38 +1,37 @@
 """For use with graphics-telemetry-dashboard-db.ipynb"""
 
 import collections
+import datetime
+import functools
+import hashlib
 import json
+import re
 
-from google.cloud import bigquery, storage
+from google.cloud import storage
 
-from .snake_case import SnakeCaseDict, convert_snake_case_dict
+from . import aggregate, histograms, sampling
+from .snake_case import SnakeCaseDict, add_known_keys, convert_snake_case_dict
 
 FORMAT_DS = "%Y-%m-%d"
 
 
-def fetch_results(
-    spark,
-    start_date,
-    end_date,
-    channel=None,
-    min_firefox_version="53",
-    project_id="mozdata",
-    dataset_id="tmp",
-    table_id="graphics_telemetry_dashboard_tmp",
-):
-    channel_filter = ""
-    if channel is not None:
-        channel_filter = "normalized_channel = '{}' AND".format(channel)
+# Columns that order a client's pings, kept in daily partitions so that the
+# earliest ping of the window can be picked from them.
+ORDER_COLUMNS = ", document_id, submission_timestamp, submission_date"
 
-    query = """
+QUERY = """
     CREATE TEMP FUNCTION keyed_hist_to_json(h ANY TYPE) AS (
         ARRAY(SELECT AS STRUCT key, mozfun.hist.string_to_json(value) AS value FROM UNNEST(h))
     );
 
     WITH sample AS
     (select client_id,
+        document_id,
+        submission_timestamp,
+        date(submission_timestamp)                                                as submission_date,
         creation_date,
-        additional_properties,
+        -- only environment.system.gfx is kept from the additional_properties blob
+        JSON_EXTRACT(additional_properties, '$.environment.system.gfx')          as additional_gfx,
         environment.build.version                                                 as environment__build__version,
         environment.build.build_id                                                as environment__build__build_id,
         environment.system.memory_mb                                              as environment__system__memory_mb,
@@ -76,150 +75,581 @@ def fetch_results(
         normalized_app_name = 'Firefox' AND
         {channel_filter}
         CAST(SPLIT(application.version, '.')[OFFSET(0)] AS INT64) > {min_firefox_version} AND
-        -- NOTE: fixed fraction corresponding to 0.0003
-        sample_id = 42 AND
-        MOD(CAST(RAND()*10 AS INT64), 10) < 3),
+        {sample_filter}),
 
     distinct_client_ids AS (SELECT distinct(client_id) FROM sample),
 
     -- Retain only the first seen documents for each client ID ,
     base AS (SELECT * FROM sample JOIN distinct_client_ids USING (client_id)),
 
-    numbered_duplicates AS (SELECT *, ROW_NUMBER() OVER (PARTITION BY client_id) AS _n FROM base)
+    numbered_duplicates AS (SELECT *, ROW_NUMBER() OVER (PARTITION BY client_id ORDER BY submission_timestamp, document_id) AS _n FROM base)
     --
     -- Retain only one document for each ID.
     SELECT
-      * EXCEPT(_n)
+      * EXCEPT(_n{except_columns})
     FROM
       numbered_duplicates
     WHERE
       _n = 1
-    """.format(
-        start_date=start_date.strftime(FORMAT_DS),
-        end_date=end_date.strftime(FORMAT_DS),
+"""
+
+# Assembles a window from daily partitions of QUERY, keeping the earliest ping
+# of each client across days.
+WINDOW_QUERY = """
+    SELECT
+      * EXCEPT(_n{order_columns})
+    FROM
+      (SELECT *, ROW_NUMBER() OVER (PARTITION BY client_id ORDER BY submission_timestamp, document_id) AS _n
+       FROM {table}
+       WHERE submission_date >= '{start_date}' AND submission_date <= '{end_date}')
+    WHERE
+      _n = 1
+    """
+
+# Pings keep arriving after their submission day, so a daily partition is only
+# reused if it was written at least this long after the end of its day.
+PARTITION_SETTLE_TIME = datetime.timedelta(hours=4)
+
+# Daily partitions are dropped this many days after their submission date.
+PARTITION_EXPIRATION_DAYS = 30
+
+
+def build_query(
+    start_ds,
+    end_ds,
+    channel=None,
+    min_firefox_version="53",
+    fraction=0.003,
+    daily=False,
+):
+    """Build the dashboard query for submission dates `start_ds` to `end_ds`.
+
+    A deterministic `fraction` of clients is sampled, see sampling.py, and
+    each client's earliest ping is kept. With `daily`, the columns that
+    order pings are kept too, for WINDOW_QUERY.
+    """
+    channel_filter = ""
+    if channel is not None:
+        channel_filter = "normalized_channel = '{}' AND".format(channel)
+
+    return QUERY.format(
+        start_date=start_ds,
+        end_date=end_ds,
         channel_filter=channel_filter,
         min_firefox_version=min_firefox_version,
+        sample_filter=sampling.sample_filter(fraction),
+        except_columns="" if daily else ORDER_COLUMNS,
     )
 
-    bq = bigquery.Client(project=project_id)
-    table_ref = bq.dataset(dataset_id, project=project_id).table(table_id)
-    job_config = bigquery.QueryJobConfig()
-    job_config.destination = table_ref
-    job_config.write_disposition = "WRITE_TRUNCATE"
 
-    query_job = bq.query(query, job_config=job_config)
+def fetch_results(
+    spark,
+    data_source,
+    start_date,
+    end_date,
+    channel=None,
+    min_firefox_version="53",
+    fraction=0.003,
+    table_id="graphics_telemetry_dashboard_tmp",
+    use_arrow=False,
+    dense_histograms=False,
+    incremental=False,
+    daily_table_id="graphics_telemetry_dashboard_daily",
+    use_dataframe=False,
+):
+    """Run the dashboard query and load its results.
+
+    The query is run by `data_source`, a sources.DataSource, which must also
+    be the one passed to aggregate_metrics, as each BigQuerySource writes to
+    tables of its own. With `use_arrow`, the results are read as Arrow record
+    batches and are already converted, so the returned pings must not be
+    passed through convert_bigquery_results again. `dense_histograms` is passed on to that conversion. With
+    `use_dataframe`, the rows are returned as a DataFrame instead, see
+    frames.format_pings.
+
+    With `incremental`, see fetch_daily_partitions, only the days missing
+    from the daily partitions are queried and the window is assembled from
+    those partitions.
+    """
+    if incremental and data_source.supports_partitions:
+        daily_table_id = fetch_daily_partitions(
+            data_source,
+            _to_date(start_date),
+            _to_date(end_date),
+            channel,
+            min_firefox_version,
+            fraction,
+            daily_table_id,
+        )
+        query = WINDOW_QUERY.format(
+            table=data_source.partitioned_table_ref(daily_table_id),
+            start_date=start_date.strftime(FORMAT_DS),
+            end_date=end_date.strftime(FORMAT_DS),
+            order_columns=ORDER_COLUMNS,
+        )
+    else:
+        query = build_query(
+            start_date.strftime(FORMAT_DS),
+            end_date.strftime(FORMAT_DS),
+            channel,
+            min_firefox_version,
+            fraction,
+        )
 
-    # Wait for query execution
-    result = query_job.result()
+    if use_dataframe:
+        return data_source.fetch_frame(spark, query, table_id)
+    if use_arrow:
+        from . import arrow
 
-    return (
-        spark.read.format("bigquery")
-        .option("project", project_id)
-        .option("dataset", query_job.destination.dataset_id)
-        .option("table", query_job.destination.table_id)
-        .load()
-        .rdd
-    )
+        return data_source.fetch(
+            spark,
+            query,
+            table_id,
+            functools.partial(
+                arrow.convert_dashboard_batch, dense_histograms=dense_histograms
+            ),
+        )
+    return data_source.fetch(spark, query, table_id)
+
+
+def _to_date(d):
+    if isinstance(d, datetime.datetime):
+        return d.date()
+    return d
+
+
+def fetch_daily_partitions(
+    data_source,
+    start_date,
+    end_date,
+    channel=None,
+    min_firefox_version="53",
+    fraction=0.003,
+    daily_table_id="graphics_telemetry_dashboard_daily",
+):
+    """Materialize one deduplicated partition per submission date.
+
+    The dashboard query is run for each day from `start_date` to `end_date`
+    whose partition is missing, or was written before the day had settled
+    (see PARTITION_SETTLE_TIME), and written to that day's partition.
+    Partitions of different query parameters, or of an older version of the
+    query, live in different tables; the name of the table is returned.
+    """
+    template = build_query("", "", channel, min_firefox_version, fraction, daily=True)
+    key = hashlib.sha1(template.encode("utf-8")).hexdigest()[:12]
+    daily_table_id = "{}_{}".format(daily_table_id, key)
+
+    written = data_source.partitions(daily_table_id)
+    day = start_date
+    while day <= end_date:
+        day_end = datetime.datetime.combine(
+            day + datetime.timedelta(days=1), datetime.time(), datetime.timezone.utc
+        )
+        if day not in written or written[day] < day_end + PARTITION_SETTLE_TIME:
+            ds = day.strftime(FORMAT_DS)
+            data_source.write_partition(
+                build_query(ds, ds, channel, min_firefox_version, fraction, daily=True),
+                daily_table_id,
+                day,
+                "submission_date",
+                PARTITION_EXPIRATION_DAYS,
+            )
+        day += datetime.timedelta(days=1)
+    return daily_table_id
+
+
+REVERTED_KEYS = {
+    "client_id": "clientId",
+    "creation_date": "creationDate",
+    "keyed_histograms": "keyedHistograms",
+    "build_id": "buildId",
+    "user_prefs": "userPrefs",
+    "service_pack_major": "servicePackMajor",
+    "is_wow64": "isWow64",
+    "memory_mb": "memoryMB",
+}
+add_known_keys(REVERTED_KEYS.values())
 
 
 def revert(key):
-    replacements = {
-        "client_id": "clientId",
-        "creation_date": "creationDate",
-        "keyed_histograms": "keyedHistograms",
-        "build_id": "buildId",
-        "user_prefs": "userPrefs",
-        "service_pack_major": "servicePackMajor",
-        "is_wow64": "isWow64",
-        "memory_mb": "memoryMB",
-    }
-    if key in replacements:
-        return replacements[key]
+    if key in REVERTED_KEYS:
+        return REVERTED_KEYS[key]
 
     return key  # value needs no transformation
 
 
-def convert_bigquery_results(f):
-    "Convert dataframe-row rdd record into a format suitable for get_pings_properties, which does histogram conversion"
+# Decode kinds for a column in a conversion plan.
+PLAIN = 0
+HISTOGRAM = 1
+KEYED_HISTOGRAM = 2
+
+
+def compile_conversion_plan(columns):
+    """Build the conversion plan for a result schema.
+
+    Each column such as `environment__system__os__name` is mapped once to the
+    path of nested keys it is stored under, e.g. ("environment", "system",
+    "os") and "name", along with the way its value has to be decoded. Columns
+    that do not map onto a path are dropped from the plan.
+    """
+    plan = []
+    for column in columns:
+        pieces = list(map(revert, column.split("__")))  # list of values such as clientId, buildId
+
+        if len(pieces) > 5:
+            raise (Exception("too many pieces"))
+        if len(pieces) == 2:
+            continue
+
+        kind = PLAIN
+        if len(pieces) in (3, 5):
+            # histograms live under payload/<kind> or payload/processes/content/<kind>
+            if pieces[-2] == "histograms":
+                kind = HISTOGRAM
+            elif pieces[-2] == "keyedHistograms":
+                kind = KEYED_HISTOGRAM
+        plan.append((column, tuple(pieces[:-1]), pieces[-1], kind))
+    return plan
+
+
+_conversion_plans = {}
+
+
+def get_conversion_plan(columns):
+    """Return the cached conversion plan for a tuple of column names."""
+    plan = _conversion_plans.get(columns)
+    if plan is None:
+        plan = _conversion_plans[columns] = compile_conversion_plan(columns)
+    return plan
+
+
+def apply_conversion_plan(plan, d, dense_histograms=False):
+    """Build the nested ping dictionary for a row dictionary.
+
+    With `dense_histograms`, histograms are decoded into dense int32 arrays
+    and keyed histograms into {key: count} dictionaries, see histograms.py.
+    """
+    newdict = {}
+    for column, parents, leaf, kind in plan:
+        v = d[column]
+        if kind == HISTOGRAM:
+            if dense_histograms:
+                v = histograms.to_dense(v)
+            elif isinstance(v, str):
+                v = json.loads(v)
+        elif kind == KEYED_HISTOGRAM:
+            if len(v) == 0:
+                continue
+            if dense_histograms:
+                v = {i["key"]: histograms.to_count(i["value"]) for i in v}
+            else:
+                v = {i["key"]: json.loads(i["value"]) for i in v}
+
+        target = newdict
+        for piece in parents:
+            target = target.setdefault(piece, {})
+        if kind == HISTOGRAM and dense_histograms:
+            # an empty dense histogram is missing rather than an empty dict
+            target[leaf] = v
+        else:
+            target[leaf] = v if v else {}
+    return newdict
+
+
+def convert_bigquery_results(f, dense_histograms=False):
+    """Convert dataframe-row rdd record into a format suitable for get_pings_properties, which does histogram conversion
+
+    With `dense_histograms`, histograms are already converted and the ping
+    should be flattened with get_ping_properties instead.
+    """
     d = f.asDict(True)
     # generally speaking, we could use additional_properties as the basis and correctly implement recursive merging
     # instead, we explicitly add the properties we know we care about at the end of this routine
-    additional_properties = json.loads(d.pop("additional_properties") or "{}")
-    newdict = {}
+    gfx = decode_additional_gfx(
+        d.pop("additional_gfx", None), d.pop("additional_properties", None)
+    )
+    newdict = apply_conversion_plan(get_conversion_plan(tuple(d)), d, dense_histograms)
 
-    for k, v in d.items():
-        pieces = list(map(revert, k.split("__")))  # list of values such as clientId, buildId
+    merge_additional_gfx(newdict, gfx)
+    return newdict
+
+
+_split_paths = {}
+
+
+def _split_path(path):
+    pieces = _split_paths.get(path)
+    if pieces is None:
+        pieces = _split_paths[path] = path.split("/")
+    return pieces
+
+
+def get_ping_properties(ping, paths):
+    """Flatten a converted ping into a {path: value} dictionary.
+
+    This stands in for moztelemetry's get_pings_properties on pings converted
+    with dense_histograms, whose histograms need no further conversion.
+    Missing properties are None.
+    """
+    result = {}
+    for path in paths:
+        value = ping
+        for piece in _split_path(path):
+            if not isinstance(value, dict):
+                value = None
+                break
+            value = value.get(piece)
+        result[path] = value
+    return result
+
+
+# Path of the only part of additional_properties that convert_bigquery_results keeps.
+ADDITIONAL_GFX_PATH = ("environment", "system", "gfx")
+
+# Object keys, other strings and brackets of a JSON document; enough to track
+# where in the document we are without decoding it.
+JSON_TOKEN_PAT = re.compile(r'"((?:[^"\\]|\\.)*)"(\s*:)?|[{}\[\]]')
+
+_json_decoder = json.JSONDecoder()
+
+
+def extract_json_path(blob, path):
+    """Decode only the value at `path`, a sequence of object keys, in a JSON document.
+
+    The document is scanned up to the value, which is then decoded on its own,
+    so the rest of the document (e.g. simpleMeasurements or extension
+    histograms in additional_properties) is never decoded. Returns None if
+    there is no value at `path`.
+    """
+    path = list(path)
+    keys = []  # the key of each open container, None for the root and array items
+    key = None
+    for match in JSON_TOKEN_PAT.finditer(blob):
+        if match.group(2):
+            key = match.group(1)
+            if key == path[-1] and keys[1:] == path[:-1]:
+                start = match.end()
+                while blob[start] in " \t\r\n":
+                    start += 1
+                return _json_decoder.raw_decode(blob, start)[0]
+        elif match.group(1) is None:
+            if match.group(0) in "{[":
+                keys.append(key)
+            elif keys[1:] == path[:-1]:
+                # keys are unique, so the parent of the value closed without it
+                return None
+            else:
+                keys.pop()
+            key = None
+    return None
 
-        if len(pieces) == 1:
-            newdict[pieces[0]] = v if v else {}
-        elif len(pieces) == 3:
-            first, second, third = pieces
-            if second == "histograms" and isinstance(v, str):
-                v = json.loads(v)
-            if second == "keyedHistograms":
-                if len(v) == 0:
-                    continue
-                else:
-                    z = {}
-                    for i in v:
-                        z[i["key"]] = json.loads(i["value"])
-                    v = z
-            if first not in newdict:
-                newdict[first] = {}
-            if second not in newdict[first]:
-                newdict[first][second] = {}
-            newdict[first][second][third] = v if v else {}
-        elif len(pieces) == 4:
-            first, second, third, fourth = pieces
-            if first not in newdict:
-                newdict[first] = {}
-            if second not in newdict[first]:
-                newdict[first][second] = {}
-            if third not in newdict[first][second]:
-                newdict[first][second][third] = {}
-            if fourth not in newdict[first][second][third]:
-                newdict[first][second][third][fourth] = {}
-
-            newdict[first][second][third][fourth] = v if v else {}
-
-        elif len(pieces) == 5:
-            first, second, third, fourth, fifth = pieces
-            if fourth == "histograms" and isinstance(v, str):
-                v = json.loads(v)
-            if fourth == "keyedHistograms":
-                if len(v) == 0:
-                    continue
-                else:
-                    z = {}
-                    for i in v:
-                        z[i["key"]] = json.loads(i["value"])
-                    v = z
-            if first not in newdict:
-                newdict[first] = {}
-            if second not in newdict[first]:
-                newdict[first][second] = {}
-            if third not in newdict[first][second]:
-                newdict[first][second][third] = {}
-            if fourth not in newdict[first][second][third]:
-                newdict[first][second][third][fourth] = {}
-            newdict[first][second][third][fourth][fifth] = v if v else {}
-        elif len(pieces) > 5:
-            raise (Exception("too many pieces"))
 
+def decode_additional_gfx(additional_gfx=None, additional_properties=None):
+    """Decode environment.system.gfx of additional_properties.
+
+    `additional_gfx` is the part extracted in SQL by fetch_results; failing
+    that, it is extracted from the whole `additional_properties` blob.
+    """
+    if additional_gfx is not None:
+        return json.loads(additional_gfx)
+    if not additional_properties:
+        return None
+    # Scanning costs more per byte than json.loads, so it only pays off when
+    # the environment comes before the bulk of the payload.
+    if additional_properties.find('"environment"') > len(additional_properties) // 8:
+        value = json.loads(additional_properties)
+        for key in ADDITIONAL_GFX_PATH:
+            if not isinstance(value, dict):
+                return None
+            value = value.get(key)
+        return value
+    return extract_json_path(additional_properties, ADDITIONAL_GFX_PATH)
+
+
+def merge_additional_gfx(newdict, gfx):
+    "Add the properties we care about from environment.system.gfx of additional_properties"
     # example additional_properties
     # {"environment":{"system":{"gfx":{"adapters":[{"driverVendor":null}],"ContentBackend":"Skia"}},"addons":{"activeGMPlugins":{"dummy-gmp":{"applyBackgroundUpdates":1}}}},"payload":{"processes":{"extension":{"histograms":{"FXA_CONFIGURED":{"bucket_count":3,"histogram_type":3,"sum":0,"range":[1,2],"values":{"0":1,"1":0}}}}},"simpleMeasurements":{"selectProfile":15637,"XPI_startup_end":27497,"XPI_finalUIStartup":29308,"start":696,"AMI_startup_begin":19076,"startupCrashDetectionBegin":18382,"AMI_startup_end":27766,"afterProfileLocked":15742,"startupInterrupted":0,"maximalNumberOfConcurrentThreads":72,"createTopLevelWindow":29539,"XPI_bootstrap_addons_end":27497,"XPI_bootstrap_addons_begin":27382,"sessionRestoreInitialized":29400,"delayedStartupStarted":38798,"sessionRestoreInit":29358,"debuggerAttached":0,"startupCrashDetectionEnd":75127,"delayedStartupFinished":40246,"XPI_startup_begin":19670}}}'
-    if (
-        "environment" in additional_properties
-        and "system" in additional_properties["environment"]
-        and "gfx" in additional_properties["environment"]["system"]
-    ):
-        gfx = additional_properties["environment"]["system"]["gfx"]
-        if "ContentBackend" in gfx:
-            newdict["environment"]["system"]["gfx"]["ContentBackend"] = gfx[
-                "ContentBackend"
-            ]
-        if "adapters" in gfx:
-            for i, adapter in enumerate(gfx["adapters"]):
-                newdict["environment"]["system"]["gfx"]["adapters"][i].update(adapter)
+    if not isinstance(gfx, dict):
+        return
+    if "ContentBackend" in gfx:
+        newdict["environment"]["system"]["gfx"]["ContentBackend"] = gfx[
+            "ContentBackend"
+        ]
+    if "adapters" in gfx:
+        for i, adapter in enumerate(gfx["adapters"]):
+            newdict["environment"]["system"]["gfx"]["adapters"][i].update(adapter)
 
-    return newdict
+
+# Properties set by Validate in the dashboard notebook, computed in SQL over
+# the fetch_results destination table. Like FormatPings, only valid pings
+# are kept.
+AGGREGATION_SOURCE = """
+    SELECT
+        CASE os_name WHEN 'Linux' THEN 'Linux' WHEN 'Windows_NT' THEN 'Windows' ELSE os_name END AS OSName,
+        CASE os_name WHEN 'Linux' THEN NULL WHEN 'Windows_NT' THEN os_version || '.' || service_pack ELSE os_version END AS OSVersion,
+        CASE os_name WHEN 'Linux' THEN 'Linux' WHEN 'Windows_NT' THEN 'Windows-' || os_version || '.' || service_pack ELSE os_name || '-' || os_version END AS OS,
+        SPLIT(build_version, '.')[OFFSET(0)] AS FxVersion,
+        vendorID,
+        vendorID || '/' || device_id AS deviceID,
+        vendorID || '/' || driver_version AS driverVersion,
+        vendorID || '/' || device_id || '/' || driver_version AS deviceAndDriver,
+        driverVendor
+    FROM (
+        SELECT
+            *,
+            CASE vendor_id WHEN 'Intel Open Source Technology Center' THEN '0x8086' ELSE vendor_id END AS vendorID
+        FROM (
+            SELECT
+                COALESCE(NULLIF(environment__system__os__name, ''), 'w') AS os_name,
+                COALESCE(NULLIF(environment__system__os__version, ''), '0') AS os_version,
+                CAST(IFNULL(environment__system__os__service_pack_major, 0) AS STRING) AS service_pack,
+                environment__build__version AS build_version,
+                COALESCE(NULLIF(environment__system__gfx__adapters[OFFSET(0)].vendor_id, ''), 'Unknown') AS vendor_id,
+                COALESCE(NULLIF(environment__system__gfx__adapters[OFFSET(0)].device_id, ''), 'Unknown') AS device_id,
+                COALESCE(NULLIF(environment__system__gfx__adapters[OFFSET(0)].driver_version, ''), 'Unknown') AS driver_version,
+                JSON_VALUE(additional_gfx, '$.adapters[0].driverVendor') AS driverVendor
+            FROM {table}
+            WHERE
+                IFNULL(environment__build__version, '') != '' AND
+                ARRAY_LENGTH(environment__system__gfx__adapters) > 0
+        )
+    )
+"""
+
+# Ping properties available to metrics computed by AGGREGATION_SOURCE.
+SQL_PROPERTIES = frozenset(
+    [
+        "OSName",
+        "OSVersion",
+        "OS",
+        "FxVersion",
+        "vendorID",
+        "deviceID",
+        "driverVersion",
+        "deviceAndDriver",
+        "driverVendor",
+    ]
+)
+add_known_keys(SQL_PROPERTIES)
+
+
+def can_compile_metric(m, properties=SQL_PROPERTIES):
+    """Whether an aggregate.Metric can be computed in SQL."""
+    if m.property not in properties:
+        return False
+    if m.filter is None:
+        return True
+    return isinstance(m.filter, aggregate.Where) and all(
+        name in properties for name, value in m.filter.values
+    )
+
+
+def compile_aggregation_query(metrics, source):
+    """Compile metrics into a single GROUPING SETS query over `source`.
+
+    Each distinct (key, filter) pair becomes one grouping set, so that every
+    counter map is computed in a single scan. The query returns
+    (grouping set, key, count) rows; filter values are passed as positional
+    parameters. Returns the query, its parameters and the grouping set index
+    of each metric.
+    """
+    columns = []
+    params = []
+    sets = {}
+    metric_sets = []
+    for m in metrics:
+        if (m.property, m.filter) not in sets:
+            i = sets[(m.property, m.filter)] = len(sets)
+            conditions = []
+            for name, value in m.filter.values if m.filter is not None else ():
+                if value is None:
+                    conditions.append("{} IS NULL".format(name))
+                else:
+                    conditions.append("{} = ?".format(name))
+                    params.append(value)
+            columns.append(
+                "{} AS accept_{i}, {} AS key_{i}".format(
+                    " AND ".join(conditions) or "TRUE", m.property, i=i
+                )
+            )
+        metric_sets.append(sets[(m.property, m.filter)])
+
+    indices = range(len(sets))
+    query = """
+    WITH pings AS ({source}),
+
+    selected AS (
+      SELECT
+        {columns}
+      FROM
+        pings)
+
+    SELECT
+      CASE {grouping} END AS grouping_set,
+      COALESCE({keys}) AS key,
+      COUNT(*) AS num_pings
+    FROM
+      selected
+    GROUP BY GROUPING SETS ({grouping_sets})
+    -- a grouping set only counts the pings its filter accepted
+    HAVING COALESCE({accepts})
+    """.format(
+        source=source,
+        columns=",\n        ".join(columns),
+        grouping=" ".join(
+            "WHEN GROUPING(accept_{0}) = 0 THEN {0}".format(i) for i in indices
+        ),
+        keys=", ".join("key_{}".format(i) for i in indices),
+        grouping_sets=", ".join("(accept_{0}, key_{0})".format(i) for i in indices),
+        accepts=", ".join("accept_{}".format(i) for i in indices),
+    )
+    return query, params, metric_sets
+
+
+def aggregate_metrics(
+    pings,
+    metrics,
+    data_source,
+    table_id="graphics_telemetry_dashboard_tmp",
+    source=None,
+    frame=None,
+):
+    """Compute aggregate.Metric counter maps, pushing what can be down into SQL.
+
+    Metrics keyed on a property in SQL_PROPERTIES and filtered with
+    aggregate.where are computed by a single query over the table that
+    fetch_results stored its rows in, provided `data_source`, the source
+    fetch_results was given, runs SQL. The
+    others fall back to aggregate.aggregate over the formatted `pings`.
+    Returns the same {name: {key: count}} dictionary as aggregate.aggregate.
+
+    `source` replaces AGGREGATION_SOURCE, e.g. to run against a local SQL
+    engine in another dialect. Given `frame`, the DataFrame of `pings` from
+    frames.format_pings, those metrics are counted by Spark over it instead.
+    """
+    metrics = list(metrics)
+    if frame is not None or data_source.supports_sql:
+        sql_metrics = [m for m in metrics if can_compile_metric(m)]
+    else:
+        sql_metrics = []
+    python_metrics = [m for m in metrics if m not in sql_metrics]
+
+    counts = {}
+    if python_metrics:
+        counts.update(aggregate.aggregate(pings, python_metrics))
+    if sql_metrics and frame is not None:
+        from . import frames
+
+        counts.update(frames.count_metrics(frame, sql_metrics))
+    elif sql_metrics:
+        if source is None:
+            source = AGGREGATION_SOURCE.format(table=data_source.table_ref(table_id))
+        query, params, metric_sets = compile_aggregation_query(sql_metrics, source)
+
+        by_set = collections.defaultdict(dict)
+        for grouping_set, key, count in data_source.run_query(query, params):
+            by_set[grouping_set][key] = count
+        for m, grouping_set in zip(sql_metrics, metric_sets):
+            counts[m.name] = dict(by_set[grouping_set])
+    return {m.name: counts[m.name] for m in metrics}
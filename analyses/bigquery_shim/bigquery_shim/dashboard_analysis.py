@@ -0,0 +1,1278 @@
+"""Analyses of the graphics telemetry dashboard.
+
+The analyses behind each export of graphics-telemetry-dashboard-db, taking
+the pings, `engine.Engine` and data source they run on as parameters rather
+than reading notebook globals, so that they can be run on Spark, on a single
+machine or in a benchmark. Names are those of the notebook.
+"""
+
+import datetime
+import time
+
+from . import aggregate, dashboard, histograms, snake_case
+from .engine import Prof
+
+# List of keys for properties on session pings that we care about.
+GfxKey = "environment/system/gfx"
+MonitorsKey = "environment/system/gfx/monitors"
+ArchKey = "environment/build/architecture"
+FeaturesKey = "environment/system/gfx/features"
+UserPrefsKey = "environment/settings/userPrefs"
+DeviceResetReasonKey = "payload/histograms/DEVICE_RESET_REASON"
+SANITY_TEST = "payload/histograms/GRAPHICS_SANITY_TEST"
+SANITY_TEST_REASON = "payload/histograms/GRAPHICS_SANITY_TEST_REASON"
+STARTUP_TEST_KEY = "payload/histograms/GRAPHICS_DRIVER_STARTUP_TEST"
+WebGLSuccessKey = "payload/histograms/CANVAS_WEBGL_SUCCESS"
+WebGL2SuccessKey = "payload/histograms/CANVAS_WEBGL2_SUCCESS"
+PluginModelKey = "payload/histograms/PLUGIN_DRAWING_MODEL"
+MediaDecoderKey = "payload/histograms/MEDIA_DECODER_BACKEND_USED"
+LayersD3D11FailureKey = "payload/keyedHistograms/D3D11_COMPOSITING_FAILURE_ID"
+LayersOGLFailureKey = "payload/keyedHistograms/OPENGL_COMPOSITING_FAILURE_ID"
+WebGLAcclFailureKey = "payload/keyedHistograms/CANVAS_WEBGL_ACCL_FAILURE_ID"
+WebGLFailureKey = "payload/keyedHistograms/CANVAS_WEBGL_FAILURE_ID"
+CpuKey = "environment/system/cpu"
+MemoryKey = "environment/system/memoryMB"
+
+# This is the filter list, so we only select the above properties.
+PropertyList = [
+    GfxKey,
+    FeaturesKey,
+    UserPrefsKey,
+    MonitorsKey,
+    ArchKey,
+    DeviceResetReasonKey,
+    SANITY_TEST,
+    SANITY_TEST_REASON,
+    STARTUP_TEST_KEY,
+    WebGLSuccessKey,
+    WebGL2SuccessKey,
+    PluginModelKey,
+    MediaDecoderKey,
+    LayersD3D11FailureKey,
+    LayersOGLFailureKey,
+    WebGLAcclFailureKey,
+    WebGLFailureKey,
+]
+
+# Properties of every formatted ping, besides PropertyList.
+PingProperties = [
+    "clientId",
+    "creationDate",
+    "environment/build/version",
+    "environment/build/buildId",
+    "environment/system/memoryMB",
+    "environment/system/isWow64",
+    "environment/system/cpu",
+    "environment/system/os/name",
+    "environment/system/os/version",
+    "environment/system/os/servicePackMajor",
+    "environment/system/gfx/adapters",
+    "payload/info/revision",
+]
+
+snake_case.add_known_keys(PingProperties + PropertyList)
+
+# Since builds take a bit to disseminate, go back about 4 hours. This is a
+# completely made up number.
+DisseminationTime = datetime.timedelta(0, 60 * 60 * 4)
+
+
+def fmt_date(d):
+    return d.strftime("%Y%m%d")
+
+
+###########################################################
+# Helper function block for fetching and filtering pings. #
+###########################################################
+def union_pipelines(a, b):
+    if a is None:
+        return b
+    return a + b
+
+
+def FetchRawPings(
+    engine,
+    data_source,
+    timeWindow,
+    fraction,
+    channel=None,
+    min_firefox_version=None,
+    use_arrow=False,
+    incremental=False,
+    now=None,
+    use_dataframe=False,
+):
+    if now is None:
+        now = datetime.datetime.now()
+    start = now - datetime.timedelta(timeWindow) - DisseminationTime
+    end = now - DisseminationTime
+
+    # Clients are sampled deterministically, so the same days give the same pings.
+    pings = dashboard.fetch_results(
+        engine.spark,
+        data_source,
+        start,
+        end,
+        channel=channel,
+        min_firefox_version=min_firefox_version,
+        fraction=fraction,
+        use_arrow=use_arrow,
+        dense_histograms=True,
+        incremental=incremental,
+        use_dataframe=use_dataframe,
+    )
+
+    metadata = [
+        {
+            "info": {
+                "channel": "*",
+                "fraction": fraction,
+                "day_range": (end - start).days,
+            },
+        }
+    ]
+    info = {
+        "metadata": metadata,
+        "timestamp": now,
+    }
+
+    return pings, info
+
+
+# Transform each ping to make it easier to work with in later stages.
+def Validate(p):
+    name = p.get("environment/system/os/name") or "w"
+    version = p.get("environment/system/os/version") or "0"
+    if name == "Linux":
+        p["OSVersion"] = None
+        p["OS"] = "Linux"
+        p["OSName"] = "Linux"
+    elif name == "Windows_NT":
+        spmaj = p.get("environment/system/os/servicePackMajor") or "0"
+        p["OSVersion"] = version + "." + str(spmaj)
+        p["OS"] = "Windows-" + version + "." + str(spmaj)
+        p["OSName"] = "Windows"
+    elif name == "Darwin":
+        p["OSVersion"] = version
+        p["OS"] = "Darwin-" + version
+        p["OSName"] = "Darwin"
+    else:
+        p["OSVersion"] = version
+        p["OS"] = "{0}-{1}".format(name, version)
+        p["OSName"] = name
+
+    # Telemetry data isn't guaranteed to be well-formed so unfortunately
+    # we have to do some validation on it. If we get to the end, we set
+    # p['valid'] to True, and this gets filtered over later. In addition
+    # we have a wrapper below to help fetch strings that may be null.
+    if not p.get("environment/build/version", None):
+        return p
+    p["FxVersion"] = p["environment/build/version"].split(".")[0]
+
+    # Verify that we have at least one adapter.
+    try:
+        adapter = p["environment/system/gfx/adapters"][0]
+    except:
+        return p
+    if adapter is None or not hasattr(adapter, "__getitem__"):
+        return p
+
+    def T(obj, key):
+        return obj.get(key, None) or "Unknown"
+
+    # We store the device ID as a vendor/device string, because the device ID
+    # alone is not enough to determine whether the key is unique.
+    #
+    # We also merge 'Intel Open Source Technology Center' with the device ID
+    # that should be reported, 0x8086, for simplicity.
+    vendorID = T(adapter, "vendorID")
+    if vendorID == "Intel Open Source Technology Center":
+        p["vendorID"] = "0x8086"
+    else:
+        p["vendorID"] = vendorID
+    p["deviceID"] = "{0}/{1}".format(p["vendorID"], T(adapter, "deviceID"))
+    p["driverVersion"] = "{0}/{1}".format(p["vendorID"], T(adapter, "driverVersion"))
+    p["deviceAndDriver"] = "{0}/{1}".format(p["deviceID"], T(adapter, "driverVersion"))
+    p["driverVendor"] = adapter.get("driverVendor", None)
+
+    p["valid"] = True
+    return p
+
+
+# Histograms are decoded into dense arrays by the shim, so pings are
+# flattened with its get_ping_properties rather than moztelemetry's.
+def reduce_pings(pings, extra_properties=[]):
+    properties = extra_properties + PingProperties + PropertyList
+    return pings.map(lambda p: dashboard.get_ping_properties(p, properties))
+
+
+def FormatPings(pings, use_arrow=False):
+    if use_arrow:
+        # Arrow pings are already converted, and carry the properties that
+        # Validate would derive.
+        from . import arrow
+
+        pings = reduce_pings(pings, arrow.DERIVED_PROPERTIES)
+        pings = pings.map(lambda p: snake_case.convert_snake_case_dict(p, lazy=True))
+    else:
+        pings = pings.map(
+            lambda p: dashboard.convert_bigquery_results(p, dense_histograms=True)
+        )
+        pings = reduce_pings(pings)
+        pings = pings.map(lambda p: snake_case.convert_snake_case_dict(p, lazy=True))
+        pings = pings.map(Validate)
+    filtered_pings = pings.filter(lambda p: p.get("valid", False) == True)
+    return filtered_pings.cache()
+
+
+def FetchAndFormat(engine, data_source, use_arrow=False, **kwargs):
+    raw_pings, info = FetchRawPings(engine, data_source, use_arrow=use_arrow, **kwargs)
+    return FormatPings(raw_pings, use_arrow), info
+
+
+def FetchAndFormatFrame(engine, data_source, **kwargs):
+    """Return formatted pings, a frames.format_pings DataFrame of them and info.
+
+    Both are formatted from the same query rows, which needs a SparkEngine.
+    Counts given the DataFrame as `frame` run in Spark alone, so rows are only
+    converted to Python pings for the analyses that need them.
+    """
+    from . import frames
+
+    raw_frame, info = FetchRawPings(engine, data_source, use_dataframe=True, **kwargs)
+    frame = frames.format_pings(raw_frame).cache()
+    return FormatPings(raw_frame.rdd), frame, info
+
+
+def SplitPings(engine, pings):
+    """Return the Windows, Mac and Linux subsets of formatted pings."""
+    # Windows gets some preferential breakdown treatment.
+    windows_pings = pings.filter(lambda p: p["OSName"] == "Windows")
+    windows_pings = windows_pings.cache()
+
+    mac_pings = pings.filter(lambda p: p["OSName"] == "Darwin")
+    mac_pings = engine.repartition(mac_pings)
+
+    linux_pings = pings.filter(lambda p: p["OSName"] == "Linux")
+    linux_pings = engine.repartition(linux_pings)
+    return windows_pings, mac_pings, linux_pings
+
+
+##################################################################
+# Helper function block for massaging pings into aggregate data. #
+##################################################################
+
+
+# Take each key in |b| and add it to |a|, accumulating its value into
+# |a| if it already exists.
+def combiner(a, b):
+    result = a
+    for key in b:
+        countA = a.get(key, 0)
+        countB = b[key]
+        result[key] = countA + countB
+    return result
+
+
+# Convert a summed dense histogram into a list of ints for export.
+def histogram_to_list(histogram):
+    if histogram is None:
+        return []
+    return [int(count) for count in histogram]
+
+
+# Helper for reduceByKey => count.
+def map_x_to_count(data, sourceKey):
+    def extract(p):
+        return (p[sourceKey],)
+
+    return data.map(extract).countByKey()
+
+
+# After reduceByKey(combiner), we get a mapping like:
+#  key => { variable => value }
+#
+# This function collapses 'variable' instances below a threshold into
+# a catch-all identifier ('Other').
+def coalesce_to_n_items(agg, max_items):
+    obj = []
+    for superkey, breakdown in agg:
+        if len(breakdown) <= max_items:
+            obj += [(superkey, breakdown)]
+            continue
+        items = sorted(breakdown.items(), key=lambda obj: obj[1], reverse=True)
+        new_breakdown = {k: v for k, v in items[0:max_items]}
+        total = 0
+        for k, v in items[max_items:]:
+            total += v
+        if total:
+            new_breakdown["Other"] = new_breakdown.get("Other", 0) + total
+        obj += [(superkey, new_breakdown)]
+    return obj
+
+
+#############################
+# Helper for writing files. #
+#############################
+
+
+def ApplyPingInfo(obj, **kwargs):
+    if "pings" not in kwargs:
+        return
+
+    pings, info = kwargs.pop("pings")
+
+    # To make the sample source information more transparent, we include
+    # the breakdown of Firefox channel numbers.
+    if "__share" not in info:
+        info["__share"] = map_x_to_count(pings, "FxVersion")
+
+    obj["sessions"] = {
+        "count": pings.count(),
+        "timestamp": time.mktime(info["timestamp"].timetuple()),
+        "shortdate": fmt_date(info["timestamp"]),
+        "metadata": info["metadata"],
+        "share": info["__share"],
+    }
+
+
+def TimedExport(export, filename, callback, **kwargs):
+    """Compute an export with `callback` and write it with `export(filename, obj)`."""
+    start = datetime.datetime.now()
+
+    obj = callback()
+    ApplyPingInfo(obj, **kwargs)
+
+    end = datetime.datetime.now()
+    elapsed = end - start
+    obj["phaseTime"] = elapsed.total_seconds()
+
+    export(filename, obj)
+    export_time = datetime.datetime.now() - end
+
+    print("Computed {0} in {1} seconds.".format(filename, elapsed.total_seconds()))
+    print("Exported {0} in {1} seconds.".format(filename, export_time.total_seconds()))
+
+
+######################
+# General statistics #
+######################
+
+
+def GetGeneralStatisticsMetrics(prefix, **values):
+    return [
+        aggregate.metric(prefix + "/os", "OSName", aggregate.where(**values)),
+        # Results by Windows version.
+        aggregate.metric(
+            prefix + "/windows",
+            "OSVersion",
+            aggregate.where(OSName="Windows", **values),
+        ),
+        # Top-level stats.
+        aggregate.metric(prefix + "/vendors", "vendorID", aggregate.where(**values)),
+    ]
+
+
+def GetShare(pings, info, data_source, frame=None):
+    """Record the breakdown of Firefox versions in `info`, see ApplyPingInfo."""
+    if "__share" not in info:
+        info["__share"] = dashboard.aggregate_metrics(
+            pings,
+            [
+                aggregate.metric("share", "FxVersion"),
+            ],
+            data_source=data_source,
+            frame=frame,
+        )["share"]
+    return info["__share"]
+
+
+def GetGeneralStatistics(pings, info, data_source, frame=None):
+    # Every breakdown is a plain GROUP BY, computed by a single query.
+    metrics = [
+        aggregate.metric("devices", "deviceID"),
+        aggregate.metric("drivers", "driverVersion"),
+    ]
+    metrics += GetGeneralStatisticsMetrics("all")
+    for key in GetShare(pings, info, data_source, frame):
+        metrics += GetGeneralStatisticsMetrics(key, FxVersion=key)
+
+    with Prof("general stats") as px:
+        counts = dashboard.aggregate_metrics(
+            pings, metrics, data_source=data_source, frame=frame
+        )
+
+    byFx = {}
+    for key in ["all"] + list(info["__share"]):
+        byFx[key] = {
+            "os": counts[key + "/os"],
+            "windows": counts[key + "/windows"],
+            "vendors": counts[key + "/vendors"],
+        }
+
+    return {
+        "devices": counts["devices"],
+        "drivers": counts["drivers"],
+        "byFx": byFx,
+    }
+
+
+##########################
+# Daily aggregate state. #
+##########################
+
+
+# Per-day partial aggregates of the general statistics and TDRs. Only the
+# days without a settled partial are fetched, each on its own; the windows
+# are then merged from the partials rather than recomputed from pings.
+def DailyStatisticsMetrics():
+    return [
+        aggregate.metric("share", "FxVersion"),
+        aggregate.metric("devices", "deviceID"),
+        aggregate.metric("drivers", "driverVersion"),
+    ] + GetGeneralStatisticsMetrics("all")
+
+
+def GetDailyPartials(
+    engine,
+    data_source,
+    day,
+    fraction,
+    min_firefox_version=None,
+    use_arrow=False,
+    incremental=False,
+):
+    from . import state
+
+    raw_pings = dashboard.fetch_results(
+        engine.spark,
+        data_source,
+        day,
+        day,
+        min_firefox_version=min_firefox_version,
+        fraction=fraction,
+        use_arrow=use_arrow,
+        dense_histograms=True,
+        table_id="graphics_telemetry_dashboard_day",
+        incremental=incremental,
+    )
+    pings = FormatPings(raw_pings, use_arrow)
+
+    counts = dashboard.aggregate_metrics(
+        pings,
+        DailyStatisticsMetrics(),
+        data_source=data_source,
+        table_id="graphics_telemetry_dashboard_day",
+    )
+    partials = {name: (state.COUNTER, counter) for name, counter in counts.items()}
+
+    windows_pings = pings.filter(lambda p: p["OSName"] == "Windows")
+    partials["tdr"] = (
+        state.HISTOGRAM,
+        histograms.aggregate(windows_pings, DeviceResetReasonKey),
+    )
+
+    pings.unpersist()
+    return partials
+
+
+def GetWindowStatistics(store, start, end):
+    def window(name):
+        return store.window(name, start, end)
+
+    return {
+        "devices": window("devices"),
+        "drivers": window("drivers"),
+        "byFx": {
+            "all": {
+                "os": window("all/os"),
+                "windows": window("all/windows"),
+                "vendors": window("all/vendors"),
+            },
+        },
+        "share": window("share"),
+        "tdr": histogram_to_list(window("tdr")),
+        "firstDay": fmt_date(start),
+        "lastDay": fmt_date(end),
+    }
+
+
+##################################
+# Device/driver search database. #
+##################################
+
+
+def GetDriverStatistics(pings, data_source, frame=None):
+    obj = {}
+    obj["deviceAndDriver"] = dashboard.aggregate_metrics(
+        pings,
+        [
+            aggregate.metric("deviceAndDriver", "deviceAndDriver"),
+        ],
+        data_source=data_source,
+        frame=frame,
+    )["deviceAndDriver"]
+    return obj
+
+
+#############################
+# Perform the TDR analysis. #
+#############################
+def GetTDRStatistics(engine, windows_pings):
+    NumTDRReasons = 8
+
+    def ping_has_tdr_for(p, reason):
+        return p[DeviceResetReasonKey][reason] > 0
+
+    # Specialized version of map_x_to_y, for TDRs. We cast to int because for
+    # some reason the values Spark returns do not serialize with JSON.
+    def map_reason_to_vendor(p, reason, destKey):
+        return (int(reason), {p[destKey]: int(p[DeviceResetReasonKey][reason])})
+
+    def map_vendor_to_reason(p, reason, destKey):
+        return (p[destKey], {int(reason): int(p[DeviceResetReasonKey][reason])})
+
+    # Filter out pings that do not have any TDR data. We expect this to be a huge reduction
+    # in the sample set, and the resulting partition count gets way off. We repartition
+    # immediately for performance.
+    TDRSubset = windows_pings.filter(
+        lambda p: p.get(DeviceResetReasonKey, None) is not None
+    )
+    TDRSubset = TDRSubset.repartition(engine.max_partitions)
+    TDRSubset = TDRSubset.cache()
+
+    # Aggregate the device reset data.
+    TDRResults = histograms.aggregate(TDRSubset, DeviceResetReasonKey)
+
+    # For each TDR reason, get a list tuple of (reason, vendor => resetCount). Then
+    # we combine these into a single series. Lambdas bind the reason as a default
+    # argument since they only run once the results are collected.
+    reason_to_vendor_tuples = None
+    vendor_to_reason_tuples = None
+    for reason in range(1, NumTDRReasons):
+        subset = TDRSubset.filter(lambda p, reason=reason: ping_has_tdr_for(p, reason))
+        subset = subset.cache()
+
+        tuples = subset.map(
+            lambda p, reason=reason: map_reason_to_vendor(p, reason, "vendorID")
+        )
+        reason_to_vendor_tuples = union_pipelines(reason_to_vendor_tuples, tuples)
+
+        tuples = subset.map(
+            lambda p, reason=reason: map_vendor_to_reason(p, reason, "vendorID")
+        )
+        vendor_to_reason_tuples = union_pipelines(vendor_to_reason_tuples, tuples)
+
+    TDRReasonToVendor = reason_to_vendor_tuples.reduceByKey(
+        combiner, engine.max_partitions
+    )
+    TDRVendorToReason = vendor_to_reason_tuples.reduceByKey(
+        combiner, engine.max_partitions
+    )
+
+    return {
+        "tdrPings": TDRSubset.count(),
+        "results": histogram_to_list(TDRResults),
+        "reasonToVendor": TDRReasonToVendor.collect(),
+        "vendorToReason": TDRVendorToReason.collect(),
+    }
+
+
+##########################
+# Get system statistics. #
+##########################
+
+
+def get_memory_bucket(p):
+    x = int(p.get(MemoryKey, 0) / 1000)
+    if x < 1:
+        return "less_1gb"
+    if x <= 4:
+        return x
+    if x <= 8:
+        return "4_to_8"
+    if x <= 16:
+        return "8_to_16"
+    if x <= 32:
+        return "16_to_32"
+    return "more_32"
+
+
+def GetCpuFeatures(engine, pings):
+    cpuid_rdd = pings.map(lambda p: p.get(CpuKey, None))
+    cpuid_rdd = cpuid_rdd.filter(lambda p: p is not None)
+    cpuid_rdd = cpuid_rdd.map(lambda p: p.get("extensions", None))
+
+    # Unfortunately, Firefox 39 had a bug where CPU features could be reported even
+    # if they weren't present. To detect this we filter pings that have ARMv6 support
+    # on x86/64.
+    cpuid_rdd = cpuid_rdd.filter(lambda p: p is not None and "hasARMv6" not in p)
+    cpuid_rdd = engine.repartition(cpuid_rdd)
+
+    # Count before we blow up the list.
+    with Prof("cpu count for x86") as px:
+        total = cpuid_rdd.count()
+
+    cpuid_rdd = cpuid_rdd.flatMap(lambda p: [(ex, 1) for ex in p])
+    with Prof("cpu features for x86") as px:
+        feature_map = cpuid_rdd.countByKey()
+
+    return {
+        "total": total,
+        "features": feature_map,
+    }
+
+
+def GetSystemStatistics(engine, pings):
+    def get_logical_cores(p):
+        cpu = p.get(CpuKey, None)
+        if cpu is None:
+            return "unknown"
+        return cpu.get("count", "unknown")
+
+    def get_os_bits(p):
+        arch = p.get(ArchKey, "unknown")
+        if arch == "x86-64":
+            return "64"
+        if arch == "x86":
+            wow64 = p.get("environment/system/isWow64", False)
+            if wow64:
+                return "32_on_64"
+            return "32"
+        return "unknown"
+
+    with Prof("logical cores, memory buckets and OS bit count") as px:
+        counts = aggregate.aggregate(
+            pings,
+            [
+                aggregate.metric("logical_cores", get_logical_cores),
+                aggregate.metric(
+                    "memory", get_memory_bucket, lambda p: p.get(MemoryKey, 0) > 0
+                ),
+                aggregate.metric(
+                    "wow", get_os_bits, lambda p: p["OSName"] == "Windows"
+                ),
+            ],
+        )
+
+    cpu_features = GetCpuFeatures(engine, pings)
+
+    return {
+        "logical_cores": counts["logical_cores"],
+        "x86": cpu_features,
+        "memory": counts["memory"],
+        "wow": counts["wow"],
+    }
+
+
+###########################
+# Sanity test statistics. #
+###########################
+
+SANITY_TEST_PASSED = 0
+SANITY_TEST_FAILED_RENDER = 1
+SANITY_TEST_FAILED_VIDEO = 2
+SANITY_TEST_CRASHED = 3
+SANITY_TEST_TIMEDOUT = 4
+SANITY_TEST_LAST_VALUE = 5
+SANITY_TEST_REASON_FIRST_RUN = 0
+SANITY_TEST_REASON_FIREFOX_CHANGED = 1
+SANITY_TEST_REASON_DEVICE_CHANGED = 2
+SANITY_TEST_REASON_DRIVER_CHANGED = 3
+SANITY_TEST_REASON_LAST_VALUE = 4
+
+
+# We don't want to fold FAILED_LAYERS and FAILED_VIDEO into the same
+# resultset, so we use this function to split them out.
+def get_sanity_test_result(p):
+    if p.get(SANITY_TEST, None) is None:
+        return None
+    if p[SANITY_TEST][SANITY_TEST_PASSED] > 0:
+        return SANITY_TEST_PASSED
+    if p[SANITY_TEST][SANITY_TEST_CRASHED] > 0:
+        return SANITY_TEST_CRASHED
+    if p[SANITY_TEST][SANITY_TEST_FAILED_RENDER] > 0:
+        return SANITY_TEST_FAILED_RENDER
+    if p[SANITY_TEST][SANITY_TEST_FAILED_VIDEO] > 0:
+        return SANITY_TEST_FAILED_VIDEO
+    if p[SANITY_TEST][SANITY_TEST_TIMEDOUT] > 0:
+        return SANITY_TEST_TIMEDOUT
+    return None
+
+
+def GetSanityTestsForSlice(engine, sanity_test_pings):
+    data = sanity_test_pings.filter(lambda p: get_sanity_test_result(p) is not None)
+
+    # Aggregate the sanity test data.
+    with Prof("initial map") as px:
+        SanityTestResults = data.map(
+            lambda p: (get_sanity_test_result(p),)
+        ).countByKey()
+
+    with Prof("share resolve") as px:
+        os_share = map_x_to_count(data, "OSVersion")
+
+    with Prof("ping_count") as px:
+        sanity_test_count = data.count()
+        ping_count = sanity_test_pings.count()
+
+    sanity_test_by_vendor = None
+    sanity_test_by_os = None
+    sanity_test_by_device = None
+    sanity_test_by_driver = None
+    # As in GetTDRStatistics, lambdas bind the value as a default argument.
+    for value in range(SANITY_TEST_FAILED_RENDER, SANITY_TEST_LAST_VALUE):
+        subset = data.filter(lambda p, value=value: get_sanity_test_result(p) == value)
+
+        tuples = subset.map(
+            lambda p, value=value: (value, {p["vendorID"]: int(p[SANITY_TEST][value])})
+        )
+        sanity_test_by_vendor = union_pipelines(sanity_test_by_vendor, tuples)
+
+        tuples = subset.map(
+            lambda p, value=value: (value, {p["OS"]: int(p[SANITY_TEST][value])})
+        )
+        sanity_test_by_os = union_pipelines(sanity_test_by_os, tuples)
+
+        tuples = subset.map(
+            lambda p, value=value: (value, {p["deviceID"]: int(p[SANITY_TEST][value])})
+        )
+        sanity_test_by_device = union_pipelines(sanity_test_by_device, tuples)
+
+        tuples = subset.map(
+            lambda p, value=value: (
+                value,
+                {p["driverVersion"]: int(p[SANITY_TEST][value])},
+            )
+        )
+        sanity_test_by_driver = union_pipelines(sanity_test_by_driver, tuples)
+
+    sanity_test_by_vendor = engine.repartition(sanity_test_by_vendor)
+    sanity_test_by_os = engine.repartition(sanity_test_by_os)
+    sanity_test_by_device = engine.repartition(sanity_test_by_device)
+    sanity_test_by_driver = engine.repartition(sanity_test_by_driver)
+
+    with Prof("vendor resolve") as px:
+        SanityTestByVendor = sanity_test_by_vendor.reduceByKey(combiner)
+    with Prof("os resolve") as px:
+        SanityTestByOS = sanity_test_by_os.reduceByKey(combiner)
+    with Prof("device resolve") as px:
+        SanityTestByDevice = sanity_test_by_device.reduceByKey(combiner)
+    with Prof("driver resolve") as px:
+        SanityTestByDriver = sanity_test_by_driver.reduceByKey(combiner)
+
+    print(
+        "Partitions: {0},{1},{2},{3}".format(
+            SanityTestByVendor.getNumPartitions(),
+            SanityTestByOS.getNumPartitions(),
+            SanityTestByDevice.getNumPartitions(),
+            SanityTestByDriver.getNumPartitions(),
+        )
+    )
+
+    with Prof("vendor collect") as px:
+        byVendor = SanityTestByVendor.collect()
+    with Prof("os collect") as px:
+        byOS = SanityTestByOS.collect()
+    with Prof("device collect") as px:
+        byDevice = SanityTestByDevice.collect()
+    with Prof("driver collect") as px:
+        byDriver = SanityTestByDriver.collect()
+
+    return {
+        "sanityTestPings": sanity_test_count,
+        "totalPings": ping_count,
+        "results": SanityTestResults,
+        "byVendor": byVendor,
+        "byOS": byOS,
+        "byDevice": coalesce_to_n_items(byDevice, 10),
+        "byDriver": coalesce_to_n_items(byDriver, 10),
+        "windows": os_share,
+    }
+
+
+def GetSanityTests(engine, windows_pings):
+    obj = {}
+    obj["windows"] = GetSanityTestsForSlice(engine, windows_pings)
+    return obj
+
+
+###################################
+# Startup crash guard statistics. #
+###################################
+
+STARTUP_OK = 0
+STARTUP_ENV_CHANGED = 1
+STARTUP_CRASHED = 2
+STARTUP_ACCEL_DISABLED = 3
+
+
+def GetStartupTests(engine, pings):
+    startup_test_pings = pings.filter(
+        lambda p: p.get(STARTUP_TEST_KEY, None) is not None
+    )
+    startup_test_pings = startup_test_pings.repartition(engine.max_partitions)
+    startup_test_pings = startup_test_pings.cache()
+
+    StartupTestResults = histograms.aggregate(startup_test_pings, STARTUP_TEST_KEY)
+
+    os_share = map_x_to_count(startup_test_pings, "OS")
+
+    return {
+        "startupTestPings": startup_test_pings.count(),
+        "results": histogram_to_list(StartupTestResults),
+        "windows": os_share,
+    }
+
+
+#######################
+# Monitor statistics. #
+#######################
+
+
+def get_monitor_count(p):
+    monitors = p.get(MonitorsKey, None)
+    try:
+        return len(monitors)
+    except:
+        return 0
+
+
+def get_monitor_res(p, i):
+    width = p[MonitorsKey][i].get("screenWidth", 0)
+    height = p[MonitorsKey][i].get("screenHeight", 0)
+    if width == 0 or height == 0:
+        return "Unknown"
+    return "{0}x{1}".format(width, height)
+
+
+def GetMonitorStatistics(engine, windows_pings):
+    def get_monitor_rdds_for_index(data, i):
+        def get_refresh_rate(p):
+            refreshRate = p[MonitorsKey][i].get("refreshRate", 0)
+            return refreshRate if refreshRate > 1 else "Unknown"
+
+        def get_resolution(p):
+            return get_monitor_res(p, i)
+
+        monitors_at_index = data.filter(lambda p: get_monitor_count(p) == i + 1)
+        monitors_at_index = engine.repartition(monitors_at_index)
+        refresh_rates = monitors_at_index.map(lambda p: (get_refresh_rate(p),))
+        resolutions = monitors_at_index.map(lambda p: (get_resolution(p),))
+        return refresh_rates, resolutions
+
+    MonitorCounts = windows_pings.map(lambda p: (get_monitor_count(p),)).countByKey()
+    MonitorCounts.pop(0, None)
+
+    refresh_rates = None
+    resolutions = None
+    for monitor_count in MonitorCounts:
+        rate_subset, res_subset = get_monitor_rdds_for_index(
+            windows_pings, monitor_count - 1
+        )
+        refresh_rates = union_pipelines(refresh_rates, rate_subset)
+        resolutions = union_pipelines(resolutions, res_subset)
+
+    MonitorRefreshRates = refresh_rates.countByKey()
+    MonitorResolutions = resolutions.countByKey()
+
+    return {
+        "counts": MonitorCounts,
+        "refreshRates": MonitorRefreshRates,
+        "resolutions": MonitorResolutions,
+    }
+
+
+##########################
+# Mac OS X statistics. #
+##########################
+
+
+def GetMacStatistics(mac_pings, data_source, frame=None):
+    def get_scale(p):
+        monitors = p.get(MonitorsKey, None)
+        if not monitors:
+            return "unknown"
+        try:
+            return monitors[0]["scale"]
+        except:
+            "unknown"
+
+    def get_arch(p):
+        arch = p.get(ArchKey, "unknown")
+        if arch == "x86-64":
+            return "64"
+        if arch == "x86":
+            return "32"
+        return "unknown"
+
+    # Versions are counted in SQL, or over the `frame` of all pings, so they
+    # are restricted to Darwin there.
+    return dashboard.aggregate_metrics(
+        mac_pings,
+        [
+            aggregate.metric("versions", "OSVersion", aggregate.where(OSName="Darwin")),
+            aggregate.metric("retina", get_scale),
+            aggregate.metric("arch", get_arch),
+        ],
+        data_source=data_source,
+        frame=frame,
+    )
+
+
+##############################################
+# Helpers for compositor/acceleration fields. #
+##############################################
+
+
+# Build graphics feature statistics.
+def get_compositor(p):
+    compositor = p[FeaturesKey].get("compositor", "none")
+    if compositor == "none":
+        userPrefs = p.get(UserPrefsKey, None)
+        if userPrefs is not None:
+            omtc = userPrefs.get("layers.offmainthreadcomposition.enabled", True)
+            if omtc != True:
+                return "disabled"
+    elif compositor == "d3d11":
+        if advanced_layers_status(p) == "available":
+            return "advanced_layers"
+    return compositor
+
+
+def get_d3d11_status(p):
+    d3d11 = p[FeaturesKey].get("d3d11", None)
+    if not hasattr(d3d11, "__getitem__"):
+        return "unknown"
+    status = d3d11.get("status", "unknown")
+    if status != "available":
+        return status
+    if d3d11.get("warp", False) == True:
+        return "warp"
+    return d3d11.get("version", "unknown")
+
+
+def get_warp_status(p):
+    if "blacklisted" not in p[FeaturesKey]["d3d11"]:
+        return "unknown"
+    if p[FeaturesKey]["d3d11"]["blacklisted"] == True:
+        return "blacklist"
+    return "device failure"
+
+
+def get_d2d_status(p):
+    d2d = p[FeaturesKey].get("d2d", None)
+    if not hasattr(d2d, "__getitem__"):
+        return ("unknown",)
+    status = d2d.get("status", "unknown")
+    if status != "available":
+        return (status,)
+    return (d2d.get("version", "unknown"),)
+
+
+def has_working_d3d11(p):
+    d3d11 = p[FeaturesKey].get("d3d11", None)
+    if d3d11 is None:
+        return False
+    return d3d11.get("status") == "available"
+
+
+def gpu_process_status(p):
+    gpuProc = p[FeaturesKey].get("gpuProcess", None)
+    if gpuProc is None or not gpuProc.get("status", None):
+        return "none"
+    return gpuProc.get("status")
+
+
+def get_texture_sharing_status(p):
+    return (p[FeaturesKey]["d3d11"].get("textureSharing", "unknown"),)
+
+
+def advanced_layers_status(p):
+    al = p[FeaturesKey].get("advancedLayers", None)
+    if al is None:
+        return "none"
+    return al.get("status", None)
+
+
+###################################################
+# Windows compositor and blacklisting statistics. #
+###################################################
+
+
+# Get pings with graphics features. This landed in roughly the 7-19-2015 nightly.
+def windows_feature_filter(p):
+    return p["OSName"] == "Windows" and p.get(FeaturesKey) is not None
+
+
+def GetWindowsFeaturePings(windows_pings):
+    return windows_pings.filter(lambda p: p.get(FeaturesKey) is not None).cache()
+
+
+# We skip certain windows versions in detail lists since this phase is
+# very expensive to compute.
+ImportantWindowsVersions = (
+    "6.1.0",
+    "6.1.1",
+    "6.2.0",
+    "6.3.0",
+    "10.0.0",
+)
+
+
+def GetWindowsFeatureMetrics(prefix, accept=None):
+    def restrict(f):
+        if accept is None:
+            return f
+        return lambda p: accept(p) and f(p)
+
+    def has_content_backend(p):
+        return p[GfxKey].get("ContentBackend") is not None
+
+    def has_warp(p):
+        return get_d3d11_status(p) == "warp"
+
+    return [
+        aggregate.metric(prefix + "/compositors", get_compositor, accept),
+        aggregate.metric(
+            prefix + "/content_backends",
+            lambda p: p[GfxKey]["ContentBackend"],
+            restrict(has_content_backend),
+        ),
+        aggregate.metric(prefix + "/d3d11", get_d3d11_status, accept),
+        aggregate.metric(prefix + "/d2d", lambda p: get_d2d_status(p)[0], accept),
+        aggregate.metric(prefix + "/warp", get_warp_status, restrict(has_warp)),
+        aggregate.metric(prefix + "/gpu_process", gpu_process_status, accept),
+        aggregate.metric(prefix + "/advanced_layers", advanced_layers_status, accept),
+    ]
+
+
+def GetWindowsFeatures(windows_features):
+    def sum_groups(by_version):
+        total = None
+        for histogram in by_version.values():
+            total = histograms.add(total, histogram)
+        return total
+
+    def d3d11_status_is(status):
+        return lambda p: get_d3d11_status(p) == status
+
+    # All counter maps, for every Windows version, are computed in a single
+    # pass over windows_features.
+    metrics = GetWindowsFeatureMetrics("all") + [
+        aggregate.metric(
+            "all/textureSharing",
+            lambda p: get_texture_sharing_status(p)[0],
+            has_working_d3d11,
+        ),
+        aggregate.metric(
+            "d3d11_blacklist/devices", "deviceID", d3d11_status_is("blacklisted")
+        ),
+        aggregate.metric(
+            "d3d11_blacklist/drivers", "driverVersion", d3d11_status_is("blacklisted")
+        ),
+        aggregate.metric(
+            "d3d11_blacklist/os", "OSVersion", d3d11_status_is("blacklisted")
+        ),
+        aggregate.metric(
+            "d3d11_blocked/vendors", "vendorID", d3d11_status_is("blocked")
+        ),
+        aggregate.metric("byVersion", "OSVersion"),
+    ]
+    for os_version in ImportantWindowsVersions:
+        metrics += GetWindowsFeatureMetrics(
+            os_version, lambda p, v=os_version: p["OSVersion"] == v
+        )
+
+    with Prof("windows feature counts") as px:
+        counts = aggregate.aggregate(windows_features, metrics)
+
+    # Plugin models and media decoder backends, summed per Windows version.
+    with Prof("windows feature histograms") as px:
+        plugin_models = histograms.aggregate(
+            windows_features, PluginModelKey, key=lambda p: p["OSVersion"]
+        )
+        media_decoders = histograms.aggregate(
+            windows_features, MediaDecoderKey, key=lambda p: p["OSVersion"]
+        )
+
+    # Now, build the same data except per version.
+    feature_pings_by_os = counts["byVersion"]
+    WindowsFeaturesByVersion = {}
+    for os_version in feature_pings_by_os:
+        if os_version not in ImportantWindowsVersions:
+            continue
+        results = {
+            "count": feature_pings_by_os[os_version],
+            "compositors": counts[os_version + "/compositors"],
+            "plugin_models": histogram_to_list(plugin_models.get(os_version)),
+            "content_backends": counts[os_version + "/content_backends"],
+            "media_decoders": histogram_to_list(media_decoders.get(os_version)),
+            "gpu_process": counts[os_version + "/gpu_process"],
+            "advanced_layers": counts[os_version + "/advanced_layers"],
+        }
+        try:
+            if int(os_version.split(".")[0]) >= 6:
+                results["d3d11"] = counts[os_version + "/d3d11"]
+                results["d2d"] = counts[os_version + "/d2d"]
+                results["warp"] = counts[os_version + "/warp"]
+        except:
+            pass
+        WindowsFeaturesByVersion[os_version] = results
+
+    return {
+        "all": {
+            "compositors": counts["all/compositors"],
+            "content_backends": counts["all/content_backends"],
+            "d3d11": counts["all/d3d11"],
+            "d2d": counts["all/d2d"],
+            "textureSharing": counts["all/textureSharing"],
+            "warp": counts["all/warp"],
+            "plugin_models": histogram_to_list(sum_groups(plugin_models)),
+            "media_decoders": histogram_to_list(sum_groups(media_decoders)),
+            "gpu_process": counts["all/gpu_process"],
+            "advanced_layers": counts["all/advanced_layers"],
+        },
+        "byVersion": WindowsFeaturesByVersion,
+        "d3d11_blacklist": {
+            "devices": counts["d3d11_blacklist/devices"],
+            "drivers": counts["d3d11_blacklist/drivers"],
+            "os": counts["d3d11_blacklist/os"],
+        },
+        "d3d11_blocked": {
+            "vendors": counts["d3d11_blocked/vendors"],
+        },
+    }
+
+
+#########
+# Linux #
+#########
+
+
+def GetLinuxStatistics(linux_pings):
+    return aggregate.aggregate(
+        linux_pings,
+        [
+            aggregate.metric(
+                "driverVendors", "driverVendor", lambda p: p["driverVendor"] is not None
+            ),
+            aggregate.metric(
+                "compositors", get_compositor, lambda p: p.get(FeaturesKey) is not None
+            ),
+        ],
+    )
+
+
+#####################
+# WebGL statistics. #
+#####################
+
+
+def GetGLStatistics(pings):
+    webgl_status_rdd = pings.filter(lambda p: p.get(WebGLFailureKey, None) is not None)
+    webgl_status_rdd = webgl_status_rdd.map(lambda p: p[WebGLFailureKey])
+    webgl_status_map = webgl_status_rdd.reduce(combiner)
+    webgl_accl_status_rdd = pings.filter(
+        lambda p: p.get(WebGLAcclFailureKey, None) is not None
+    )
+    webgl_accl_status_rdd = webgl_accl_status_rdd.map(lambda p: p[WebGLAcclFailureKey])
+    webgl_accl_status_map = webgl_accl_status_rdd.reduce(combiner)
+    return {
+        "webgl": {
+            "acceleration_status": webgl_accl_status_map,
+            "status": webgl_status_map,
+        }
+    }
+
+
+def WebGLStatisticsMetrics(key):
+    # Note - we're counting sessions where WebGL succeeded or failed,
+    # rather than the raw number of times either succeeded or failed.
+    # Also note that we don't double-count systems where both is true.
+    # Instead we only count a session's successes if it had no failures.
+    def failed(p):
+        return p.get(key) is not None and p[key][0] > 0
+
+    def succeeded(p):
+        return p.get(key) is not None and p[key][0] == 0 and p[key][1] > 0
+
+    def get_compositor_any_os(p):
+        if p["OSName"] != "Windows":
+            # This data is not reliable yet - see bug 1247148.
+            return "unknown"
+        return get_compositor(p)
+
+    return [
+        aggregate.metric(key + "/failures/os", "OS", failed),
+        aggregate.metric(key + "/failures/vendors", "vendorID", failed),
+        aggregate.metric(key + "/failures/devices", "deviceID", failed),
+        aggregate.metric(key + "/failures/drivers", "driverVersion", failed),
+        aggregate.metric(key + "/successes/os", "OS", succeeded),
+        aggregate.metric(
+            key + "/successes/compositors", get_compositor_any_os, succeeded
+        ),
+    ]
+
+
+def WebGLStatisticsForKey(counts, key):
+    def get(name):
+        return counts[key + "/" + name]
+
+    return {
+        "successes": {
+            "count": sum(get("successes/os").values()),
+            "os": get("successes/os"),
+            "compositors": get("successes/compositors"),
+        },
+        "failures": {
+            "count": sum(get("failures/os").values()),
+            "os": get("failures/os"),
+            "vendors": get("failures/vendors"),
+            "devices": get("failures/devices"),
+            "drivers": get("failures/drivers"),
+        },
+    }
+
+
+def GetWebGLStatistics(pings):
+    counts = aggregate.aggregate(
+        pings,
+        WebGLStatisticsMetrics(WebGLSuccessKey)
+        + WebGLStatisticsMetrics(WebGL2SuccessKey),
+    )
+    return {
+        "webgl1": WebGLStatisticsForKey(counts, WebGLSuccessKey),
+        "webgl2": WebGLStatisticsForKey(counts, WebGL2SuccessKey),
+        "general": GetGLStatistics(pings),
+    }
+
+
+###################################
+# Layers failure ID statistics. #
+###################################
+
+
+def GetLayersStatus(pings):
+    d3d11_status_rdd = pings.filter(
+        lambda p: p.get(LayersD3D11FailureKey, None) is not None
+    )
+    d3d11_status_rdd = d3d11_status_rdd.map(lambda p: p[LayersD3D11FailureKey])
+    d3d11_status_map = d3d11_status_rdd.reduce(combiner)
+    ogl_status_rdd = pings.filter(
+        lambda p: p.get(LayersOGLFailureKey, None) is not None
+    )
+    ogl_status_rdd = ogl_status_rdd.map(lambda p: p[LayersOGLFailureKey])
+    ogl_status_map = ogl_status_rdd.reduce(combiner)
+    return {
+        "layers": {
+            "d3d11": d3d11_status_map,
+            "opengl": ogl_status_map,
+        }
+    }
+
+
+def GetLayersStatistics(pings):
+    return {
+        "general": GetLayersStatus(pings),
+    }
@@ -0,0 +1,110 @@
+"""Graphics device generation database.
+
+`www/gfxdevices.json` maps a vendor ID to device IDs, and each device ID to a
+list starting with the device's generation, e.g.
+`{"0x8086": {"0x0166": ["gen7", "ivybridge-gt2"]}}`. It is shipped as package
+data, so the copy the package was built with is used when there is one,
+otherwise a validated copy downloaded and cached locally. The cached copy is refreshed once it is
+older than MAX_AGE, and used stale when the download fails, so that runs
+don't depend on the network.
+"""
+
+import datetime
+import json
+import os
+import pkgutil
+import sys
+import time
+import urllib.request
+
+# Package data resource holding the database, a symlink to www/gfxdevices.json
+# in a source checkout.
+PACKAGE_DATA = "gfxdevices.json"
+
+# Age after which a cached copy of the database is downloaded again.
+MAX_AGE = datetime.timedelta(days=1)
+
+
+def validate(database):
+    """Raise ValueError unless `database` has the shape of gfxdevices.json."""
+    if not isinstance(database, dict) or not database:
+        raise ValueError("device database is not a non-empty object")
+    for vendor, devices in database.items():
+        if not vendor.startswith("0x") or not isinstance(devices, dict):
+            raise ValueError("bad device database vendor: {}".format(vendor))
+        for device, info in devices.items():
+            if (
+                not device.startswith("0x")
+                or not isinstance(info, list)
+                or not info
+                or not isinstance(info[0], str)
+            ):
+                raise ValueError(
+                    "bad device database entry: {}/{}".format(vendor, device)
+                )
+    return database
+
+
+def _read(path):
+    with open(path) as fp:
+        return validate(json.load(fp))
+
+
+def _read_package_data():
+    # get_data also reads from a zipped egg, where the file has no path.
+    try:
+        data = pkgutil.get_data(__package__, PACKAGE_DATA)
+    except OSError:
+        return None
+    return data and validate(json.loads(data.decode("utf-8")))
+
+
+def load_device_database(cache_path=None, url=None, max_age=MAX_AGE):
+    """Load and validate the device database.
+
+    Reads the packaged copy if there is one, else `cache_path` if it is
+    younger than `max_age`. Otherwise the database is downloaded from `url`
+    and, once validated, stored at `cache_path`; should that fail, an older
+    copy at `cache_path` is used instead.
+    """
+    database = _read_package_data()
+    if database is not None:
+        return database
+
+    cached = cache_path is not None and os.path.isfile(cache_path)
+    if cached:
+        age = time.time() - os.path.getmtime(cache_path)
+        if url is None or age < max_age.total_seconds():
+            return _read(cache_path)
+
+    if url is None:
+        raise ValueError("no device database at {}".format(cache_path))
+    try:
+        with urllib.request.urlopen(url) as response:
+            database = validate(json.loads(response.read().decode("utf-8")))
+    except (OSError, ValueError) as e:
+        if not cached:
+            raise
+        print("Using a stale device database, downloading it failed: {}".format(e))
+        return _read(cache_path)
+
+    if cache_path is not None:
+        os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+        # Write to a temporary file first so that a partial copy is never read.
+        tmp_path = "{}.tmp".format(cache_path)
+        with open(tmp_path, "w") as fp:
+            json.dump(database, fp)
+        os.replace(tmp_path, cache_path)
+    return database
+
+
+def compile_generations(database):
+    """Index a device database as {vendor: {device: generation}}.
+
+    Codenames are dropped and generation names interned, so that the index
+    is small enough to broadcast.
+    """
+    return {
+        vendor: {device: sys.intern(info[0]) for device, info in devices.items()}
+        for vendor, devices in database.items()
+    }
@@ -0,0 +1,576 @@
+"""Engines running the dashboard and trends analyses.
+
+The analyses in `dashboard_analysis` and `trends_analysis` only use a small
+part of the RDD API on the datasets of pings they are given: map, filter,
+flatMap, mapPartitions, count, countByKey, reduce, reduceByKey, fold, collect,
+union with `+`, cache and repartition. Anything else they need, such as
+broadcasting a value or the number of partitions to spread a dataset over,
+comes from an `Engine`.
+
+SparkEngine runs the analyses on a SparkContext, as the notebooks do.
+LocalEngine runs them on in-memory datasets in the current process, so that
+the same code can be profiled, benchmarked or run without a cluster, and
+ProcessEngine spreads the partitions of those datasets over worker processes.
+"""
+
+import collections
+import copy
+import datetime
+import functools
+import io
+import itertools
+import marshal
+import multiprocessing
+import multiprocessing.connection
+import os
+import pickle
+import sys
+import threading
+import traceback
+import types
+import weakref
+
+
+class Engine(object):
+    """Creates and shares data with the datasets an analysis runs on."""
+
+    # Number of partitions that filtered or reshaped datasets are spread over.
+    max_partitions = 1
+
+    # Stands in for `spark` in dashboard.fetch_results and trends.fetch_results.
+    spark = None
+
+    def parallelize(self, items, num_partitions=None):
+        """Return a dataset of `items`."""
+        raise NotImplementedError
+
+    def broadcast(self, value):
+        """Share a read-only value with tasks; it is read back from `.value`."""
+        raise NotImplementedError
+
+    def repartition(self, dataset):
+        """Spread a dataset over `max_partitions` partitions and cache it."""
+        return dataset.repartition(self.max_partitions).cache()
+
+
+class SparkEngine(Engine):
+    """Run analyses on the SparkContext of a SparkSession."""
+
+    def __init__(self, spark, partitions_per_core=4):
+        self.spark = spark
+        self.sc = spark.sparkContext
+        self.max_partitions = self.sc.defaultParallelism * partitions_per_core
+
+    def parallelize(self, items, num_partitions=None):
+        return self.sc.parallelize(items, num_partitions)
+
+    def broadcast(self, value):
+        return self.sc.broadcast(value)
+
+
+Broadcast = collections.namedtuple("Broadcast", ["value"])
+
+
+class LocalEngine(Engine):
+    """Run analyses on LocalDatasets in the current process.
+
+    The engine also stands in for `spark` when fetching pings with
+    `use_arrow`, which only needs `spark.sparkContext.parallelize`.
+    """
+
+    def __init__(self, max_partitions=1):
+        self.max_partitions = max_partitions
+        self.spark = self
+
+    @property
+    def sparkContext(self):
+        return self
+
+    def parallelize(self, items, num_partitions=None):
+        return LocalDataset(
+            self, partitions=split(list(items), num_partitions or self.max_partitions)
+        )
+
+    def broadcast(self, value):
+        return Broadcast(value)
+
+    # Whether partitions are computed and cached in other processes, where
+    # moving items between partitions would mean sending them back.
+    partitions_in_workers = False
+
+    def run(self, tasks, cache=False):
+        """Return `list(_pipeline(transforms, iter(partition)))` for each
+        `(transforms, partition)` task.
+
+        With `cache`, the partitions are kept for later tasks, which may then
+        get a reference to them instead of a list.
+        """
+        return [_run_task(transforms, partition) for transforms, partition in tasks]
+
+    def uncache(self, partitions):
+        """Release partitions that `run` cached."""
+
+
+def _run_task(transforms, partition):
+    return list(_pipeline(transforms, iter(partition)))
+
+
+# A partition cached by the ProcessEngine worker at index `worker`.
+WorkerPartition = collections.namedtuple("WorkerPartition", ["worker", "key"])
+
+
+class _TaskPickler(pickle.Pickler):
+    """Pickle lambdas and nested functions by value, as Spark does for tasks.
+
+    The code of such functions is marshaled and their closures pickled, while
+    their globals are those of their module in the worker. Other functions
+    are pickled by name.
+    """
+
+    def persistent_id(self, obj):
+        if not isinstance(obj, types.FunctionType) or _is_global(obj):
+            return None
+        cells = []
+        for cell in obj.__closure__ or ():
+            try:
+                cells.append((cell.cell_contents,))
+            except ValueError:
+                cells.append(())
+        return (
+            marshal.dumps(obj.__code__),
+            obj.__module__,
+            obj.__defaults__,
+            obj.__kwdefaults__,
+            tuple(cells),
+        )
+
+
+class _TaskUnpickler(pickle.Unpickler):
+    def persistent_load(self, pid):
+        code, module, defaults, kwdefaults, cells = pid
+        code = marshal.loads(code)
+        function = types.FunctionType(
+            code,
+            sys.modules[module].__dict__,
+            code.co_name,
+            defaults,
+            tuple(_cell(*cell) for cell in cells) or None,
+        )
+        function.__kwdefaults__ = kwdefaults
+        return function
+
+
+def _is_global(function):
+    obj = sys.modules.get(function.__module__)
+    for name in function.__qualname__.split("."):
+        obj = getattr(obj, name, None)
+    return obj is function
+
+
+# Return a closure cell holding the single `value`, or an empty cell.
+def _cell(*value):
+    if value:
+        contents = value[0]
+        return (lambda: contents).__closure__[0]
+    if False:
+        contents = None
+    return (lambda: contents).__closure__[0]
+
+
+def _dumps_transforms(transforms):
+    out = io.BytesIO()
+    _TaskPickler(out, pickle.HIGHEST_PROTOCOL).dump(transforms)
+    return out.getvalue()
+
+
+def _worker(connection):
+    """Run the tasks a ProcessEngine sends, keeping the partitions to cache."""
+    cached = {}
+    while True:
+        try:
+            message = connection.recv()
+        except EOFError:
+            return
+        if message[0] == "uncache":
+            for key in message[1]:
+                cached.pop(key, None)
+            continue
+        _, transforms, partition, key = message
+        try:
+            transforms = _TaskUnpickler(io.BytesIO(transforms)).load()
+            if isinstance(partition, WorkerPartition):
+                partition = cached[partition.key]
+            result = _run_task(transforms, partition)
+            if key is not None:
+                cached[key] = result
+                result = None
+            reply = ("ok", result)
+        except Exception:
+            reply = ("error", traceback.format_exc())
+        connection.send(reply)
+
+
+class ProcessEngine(LocalEngine):
+    """Run analyses on LocalDatasets, a partition per task in worker processes.
+
+    Workers are forked once and keep the partitions of cached datasets, so
+    that actions only send their partial results, such as counter maps and
+    histogram sums, back to be merged in this process. Tasks on a cached
+    partition run in the worker keeping it; the functions of tasks are
+    pickled by value. Shuffles, reduceByKey and collect, still send their
+    items back, and repartition leaves partitions where they are.
+
+    Datasets read with a LocalSource have a partition per file, so inputs
+    should be split in at least as many files as there are processes.
+    Without fork, or with a single process, partitions run in this process.
+    """
+
+    def __init__(self, processes=None, partitions_per_process=4):
+        processes = processes or os.cpu_count() or 1
+        super(ProcessEngine, self).__init__(processes * partitions_per_process)
+        self.processes = processes
+        self.partitions_in_workers = (
+            processes > 1 and "fork" in multiprocessing.get_all_start_methods()
+        )
+        # Computations started from other threads, such as prefetched weeks
+        # of trends, take turns rather than oversubscribing the workers.
+        self.lock = threading.RLock()
+        self.connections = []
+        self.keys = itertools.count()
+        # Partitions released by finalizers, which may run in the middle of
+        # sending a message, so they are only sent on by the next run.
+        self.released = collections.deque()
+
+    def start(self):
+        context = multiprocessing.get_context("fork")
+        for _ in range(self.processes):
+            connection, worker_connection = context.Pipe()
+            context.Process(
+                target=_worker, args=(worker_connection,), daemon=True
+            ).start()
+            worker_connection.close()
+            self.connections.append(connection)
+
+    def close(self):
+        """Stop the workers, dropping the partitions they cache."""
+        with self.lock:
+            for connection in self.connections:
+                connection.close()
+            self.connections = []
+
+    def uncache(self, partitions):
+        self.released.extend(p for p in partitions if isinstance(p, WorkerPartition))
+
+    def run(self, tasks, cache=False):
+        if not self.partitions_in_workers:
+            return super(ProcessEngine, self).run(tasks, cache)
+        with self.lock:
+            if not self.connections:
+                self.start()
+            self._send_released()
+            return self._run(tasks, cache)
+
+    def _send_released(self):
+        keys = collections.defaultdict(list)
+        while self.released:
+            partition = self.released.popleft()
+            keys[partition.worker].append(partition.key)
+        for worker, worker_keys in keys.items():
+            if worker < len(self.connections):
+                self.connections[worker].send(("uncache", worker_keys))
+
+    def _run(self, tasks, cache):
+        # Tasks on a cached partition wait for the worker keeping it, others
+        # go to the first idle worker.
+        queues = [collections.deque() for _ in self.connections]
+        anywhere = collections.deque()
+        for index, (_, partition) in enumerate(tasks):
+            if isinstance(partition, WorkerPartition):
+                queues[partition.worker].append(index)
+            else:
+                anywhere.append(index)
+
+        results = [None] * len(tasks)
+        running = {}
+        errors = []
+
+        def submit(worker):
+            queue = queues[worker] or anywhere
+            if errors or not queue:
+                return
+            index = queue.popleft()
+            transforms, partition = tasks[index]
+            key = next(self.keys) if cache else None
+            connection = self.connections[worker]
+            connection.send(("run", _dumps_transforms(transforms), partition, key))
+            running[connection] = (worker, index, key)
+
+        for worker in range(len(self.connections)):
+            submit(worker)
+        while running:
+            for connection in multiprocessing.connection.wait(list(running)):
+                worker, index, key = running.pop(connection)
+                status, result = connection.recv()
+                if status == "error":
+                    errors.append(result)
+                elif cache:
+                    results[index] = WorkerPartition(worker, key)
+                else:
+                    results[index] = result
+                submit(worker)
+
+        if errors:
+            if cache:
+                self.uncache(results)
+            raise RuntimeError("Task failed in a worker:\n" + errors[0])
+        return results
+
+
+def split(items, num_partitions):
+    """Split a list into `num_partitions` contiguous partitions."""
+    size, extra = divmod(len(items), max(num_partitions, 1))
+    partitions = []
+    start = 0
+    for i in range(max(num_partitions, 1)):
+        end = start + size + (1 if i < extra else 0)
+        partitions.append(items[start:end])
+        start = end
+    return partitions
+
+
+def _pipeline(transforms, iterator):
+    for transform in transforms:
+        iterator = transform(iterator)
+    return iterator
+
+
+def _flat_map(f, iterator):
+    for item in iterator:
+        yield from f(item)
+
+
+def _count(iterator):
+    yield sum(1 for _ in iterator)
+
+
+def _count_by_key(iterator):
+    yield collections.Counter(item[0] for item in iterator)
+
+
+def _fold(zero, op, iterator):
+    yield functools.reduce(op, iterator, copy.deepcopy(zero))
+
+
+def reduce_values(f, values):
+    """Reduce values with `f`, which may modify its first argument in place.
+
+    Spark hands reduce functions deserialized copies, so functions such as the
+    dashboard's `combiner` update their first argument. The first value is
+    copied before it is passed to `f`, since here it may still be referenced
+    by a cached dataset.
+    """
+    values = iter(values)
+    result = next(values)
+    for i, value in enumerate(values):
+        result = f(copy.copy(result) if i == 0 else result, value)
+    return result
+
+
+def _reduce(f, iterator):
+    iterator = iter(iterator)
+    for first in iterator:
+        yield reduce_values(f, itertools.chain([first], iterator))
+
+
+def _reduce_by_key(f, iterator):
+    results = collections.OrderedDict()
+    copied = set()
+    for key, value in iterator:
+        if key not in results:
+            results[key] = value
+            continue
+        # As in reduce_values, copy the first value before `f` sees it.
+        if key not in copied:
+            results[key] = copy.copy(results[key])
+            copied.add(key)
+        results[key] = f(results[key], value)
+    yield results
+
+
+class LocalDataset(object):
+    """In-memory partitions with the part of the RDD API used by the analyses.
+
+    As with RDDs, transformations are lazy and datasets are only kept once
+    cached. The narrow transformations and unions between a dataset and its
+    nearest materialized ancestors are fused and run a partition at a time
+    through `engine.run`, while actions merge the partial result of each
+    partition.
+    """
+
+    def __init__(
+        self, engine, partitions=None, parents=(), transform=None, compute=None
+    ):
+        self.engine = engine
+        # Set for datasets created from items and cached datasets. Cached
+        # narrow datasets may hold references to partitions kept by the
+        # engine, which `_release` gives back.
+        self._partitions = partitions
+        self._release = None
+        # Narrow transformations apply `transform` to each partition of their
+        # single parent and unions concatenate the partitions of their
+        # parents. Others return all of their partitions from `compute`.
+        self._parents = list(parents)
+        self._transform = transform
+        self._compute = compute
+        self._cache = partitions is not None
+
+    def _materialize(self):
+        if self._partitions is None:
+            if self._compute is not None:
+                self._partitions = self._compute()
+            else:
+                self._partitions = self.engine.run(self._parent_tasks(), cache=True)
+                self._release = weakref.finalize(
+                    self, self.engine.uncache, self._partitions
+                )
+        return self._partitions
+
+    def _tasks(self):
+        """Return the (transforms, partition) tasks computing the dataset."""
+        if self._cache:
+            partitions = self._materialize()
+        elif self._compute is not None:
+            partitions = self._compute()
+        else:
+            return self._parent_tasks()
+        return [((), partition) for partition in partitions]
+
+    def _parent_tasks(self):
+        tasks = [task for parent in self._parents for task in parent._tasks()]
+        if self._transform is not None:
+            tasks = [(t + (self._transform,), p) for t, p in tasks]
+        return tasks
+
+    def partitions(self):
+        """Compute the dataset and return its list of partitions."""
+        tasks = self._tasks()
+        if all(not t and isinstance(p, list) for t, p in tasks):
+            return [p for _, p in tasks]
+        return self.engine.run(tasks)
+
+    def _results(self, transform):
+        return list(
+            itertools.chain.from_iterable(self.mapPartitions(transform).partitions())
+        )
+
+    def cache(self):
+        self._cache = True
+        return self
+
+    persist = cache
+
+    def unpersist(self):
+        if self._parents or self._compute is not None:
+            if self._release is not None:
+                self._release()
+                self._release = None
+            self._cache = False
+            self._partitions = None
+        return self
+
+    def getNumPartitions(self):
+        return len(self._tasks())
+
+    def mapPartitions(self, f):
+        return LocalDataset(self.engine, parents=[self], transform=f)
+
+    def map(self, f):
+        return self.mapPartitions(functools.partial(map, f))
+
+    def filter(self, f):
+        return self.mapPartitions(functools.partial(filter, f))
+
+    def flatMap(self, f):
+        return self.mapPartitions(functools.partial(_flat_map, f))
+
+    def union(self, other):
+        return LocalDataset(self.engine, parents=[self, other])
+
+    __add__ = union
+
+    def repartition(self, num_partitions):
+        if self.engine.partitions_in_workers:
+            # Rather than sending every item back to this process to spread
+            # them again, partitions are left where they are.
+            return LocalDataset(self.engine, parents=[self])
+        return LocalDataset(
+            self.engine, compute=lambda: split(self.collect(), num_partitions)
+        )
+
+    def reduceByKey(self, f, numPartitions=None):
+        def compute():
+            # Values are reduced within each partition first, then across them.
+            partials = self._results(functools.partial(_reduce_by_key, f))
+            merged = _reduce_by_key(
+                f, itertools.chain.from_iterable(p.items() for p in partials)
+            )
+            items = list(next(merged).items())
+            return split(items, numPartitions or len(partials))
+
+        return LocalDataset(self.engine, compute=compute)
+
+    def collect(self):
+        return list(itertools.chain.from_iterable(self.partitions()))
+
+    def count(self):
+        return sum(self._results(_count))
+
+    def countByKey(self):
+        counts = collections.Counter()
+        for partial in self._results(_count_by_key):
+            counts.update(partial)
+        return dict(counts)
+
+    def fold(self, zero, op):
+        partials = self._results(functools.partial(_fold, zero, op))
+        return functools.reduce(op, partials, copy.deepcopy(zero))
+
+    def reduce(self, f):
+        partials = self._results(functools.partial(_reduce, f))
+        if not partials:
+            raise ValueError("Can not reduce() empty dataset")
+        return reduce_values(f, partials)
+
+    def first(self):
+        for partition in self.partitions():
+            if partition:
+                return partition[0]
+        raise ValueError("dataset is empty")
+
+
+class Prof(object):
+    """Print how long the block of a `with` statement takes."""
+
+    level = 0
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.sout("Starting {0}... ".format(self.name))
+        self.start = datetime.datetime.now()
+        Prof.level += 1
+        return None
+
+    def __exit__(self, type, value, traceback):
+        Prof.level -= 1
+        self.end = datetime.datetime.now()
+        self.sout(
+            "... {0}: {1}s".format(self.name, (self.end - self.start).total_seconds())
+        )
+
+    def sout(self, s):
+        sys.stdout.write(("##" * Prof.level) + " ")
+        sys.stdout.write(s)
+        sys.stdout.write("\n")
+        sys.stdout.flush()
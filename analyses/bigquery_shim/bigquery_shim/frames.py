@@ -0,0 +1,148 @@
+"""DataFrame formatting of dashboard pings.
+
+FormatPings turns each row of the dashboard query into nested dicts in Python
+workers, only for Validate to derive the handful of properties that most
+breakdowns are keyed on. Here those properties are derived with column
+expressions over the DataFrame of query rows, the same way AGGREGATION_SOURCE
+derives them in SQL, so that counts keyed on them run as Spark aggregations
+without any row reaching Python.
+
+Requires `pyspark`.
+"""
+
+import collections
+
+from pyspark.sql import functions as F
+
+# Where additional_gfx, or failing that additional_properties, hold the
+# driverVendor that merge_additional_gfx adds to the first adapter.
+DRIVER_VENDOR_PATHS = [
+    ("additional_gfx", "$.adapters[0].driverVendor"),
+    ("additional_properties", "$.environment.system.gfx.adapters[0].driverVendor"),
+]
+
+
+def _or_default(column, default):
+    # Like `value or default` for strings: null and empty both take the default.
+    return F.when(F.length(column) > 0, column).otherwise(F.lit(default))
+
+
+def _driver_vendor(frame):
+    for name, path in DRIVER_VENDOR_PATHS:
+        if name in frame.columns:
+            return F.get_json_object(F.col(name), path)
+    return F.lit(None).cast("string")
+
+
+def format_pings(frame):
+    """Derive the properties Validate sets from a DataFrame of query rows.
+
+    `frame` holds dashboard query rows, as returned by dashboard.fetch_results
+    with `use_dataframe`. As with FormatPings, only valid pings, those with a
+    build version and a first adapter, are kept. The returned DataFrame has a
+    column for each of dashboard.SQL_PROPERTIES.
+    """
+    adapters = F.col("environment__system__gfx__adapters")
+    build_version = F.col("environment__build__version")
+    valid = (
+        (F.length(build_version) > 0)
+        & (F.size(adapters) > 0)
+        & adapters.getItem(0).isNotNull()
+    )
+
+    adapter = adapters.getItem(0)
+    vendor_id = _or_default(adapter.getField("vendor_id"), "Unknown")
+    pings = frame.where(valid).select(
+        _or_default(F.col("environment__system__os__name"), "w").alias("os_name"),
+        _or_default(F.col("environment__system__os__version"), "0").alias("os_version"),
+        F.coalesce(F.col("environment__system__os__service_pack_major"), F.lit(0))
+        .cast("string")
+        .alias("service_pack"),
+        F.substring_index(build_version, ".", 1).alias("FxVersion"),
+        # Intel Open Source Technology Center is merged with 0x8086.
+        F.when(vendor_id == "Intel Open Source Technology Center", F.lit("0x8086"))
+        .otherwise(vendor_id)
+        .alias("vendorID"),
+        _or_default(adapter.getField("device_id"), "Unknown").alias("device_id"),
+        _or_default(adapter.getField("driver_version"), "Unknown").alias(
+            "driver_version"
+        ),
+        _driver_vendor(frame).alias("driverVendor"),
+    )
+
+    os_name = F.col("os_name")
+    os_version = F.col("os_version")
+    windows_version = F.concat(os_version, F.lit("."), F.col("service_pack"))
+    vendor_id = F.col("vendorID")
+    return pings.select(
+        F.when(os_name == "Linux", F.lit("Linux"))
+        .when(os_name == "Windows_NT", F.concat(F.lit("Windows-"), windows_version))
+        .otherwise(F.concat(os_name, F.lit("-"), os_version))
+        .alias("OS"),
+        F.when(os_name == "Linux", F.lit("Linux"))
+        .when(os_name == "Windows_NT", F.lit("Windows"))
+        .otherwise(os_name)
+        .alias("OSName"),
+        F.when(os_name == "Linux", F.lit(None).cast("string"))
+        .when(os_name == "Windows_NT", windows_version)
+        .otherwise(os_version)
+        .alias("OSVersion"),
+        F.col("FxVersion"),
+        vendor_id,
+        F.concat_ws("/", vendor_id, F.col("device_id")).alias("deviceID"),
+        F.concat_ws("/", vendor_id, F.col("driver_version")).alias("driverVersion"),
+        F.concat_ws("/", vendor_id, F.col("device_id"), F.col("driver_version")).alias(
+            "deviceAndDriver"
+        ),
+        F.col("driverVendor"),
+    )
+
+
+def _accepts(filter):
+    condition = F.lit(True)
+    for name, value in filter.values if filter is not None else ():
+        # Null-safe, so that where(OSVersion=None) matches as it does in Python.
+        condition = condition & F.col(name).eqNullSafe(value)
+    return condition
+
+
+def count_metrics(pings, metrics):
+    """Compute aggregate.Metric counter maps over a DataFrame from format_pings.
+
+    Metrics must pass dashboard.can_compile_metric. As in
+    dashboard.compile_aggregation_query, each distinct (key, filter) pair is a
+    grouping set: every ping becomes a (grouping set, key) row for each set
+    whose filter accepts it, and those rows are counted by one aggregation.
+    Returns the same {name: {key: count}} dictionary as aggregate.aggregate.
+    """
+    sets = {}
+    metric_sets = []
+    for m in metrics:
+        if (m.property, m.filter) not in sets:
+            sets[(m.property, m.filter)] = len(sets)
+        metric_sets.append(sets[(m.property, m.filter)])
+    if not sets:
+        return {}
+
+    rows = [
+        F.when(
+            _accepts(filter),
+            F.struct(
+                F.lit(i).alias("grouping_set"),
+                F.col(name).cast("string").alias("key"),
+            ),
+        )
+        for (name, filter), i in sets.items()
+    ]
+    counts = (
+        pings.select(F.explode(F.array(*rows)).alias("row"))
+        .where(F.col("row").isNotNull())
+        .groupBy("row.grouping_set", "row.key")
+        .count()
+        .collect()
+    )
+
+    by_set = collections.defaultdict(dict)
+    for grouping_set, key, count in counts:
+        by_set[grouping_set][key] = count
+    return {m.name: dict(by_set[i]) for m, i in zip(metrics, metric_sets)}
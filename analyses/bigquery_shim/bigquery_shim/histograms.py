@@ -0,0 +1,126 @@
+"""Dense NumPy representation of enumerated histograms.
+
+Enumerated and boolean histograms such as DEVICE_RESET_REASON or
+CANVAS_WEBGL_SUCCESS are decoded from their JSON form straight into
+fixed-width int32 arrays, one element per bucket, so that they can be summed
+with vectorized adds instead of pairwise `reduce(lambda x, y: x + y)`.
+"""
+
+import json
+
+import numpy as np
+
+DTYPE = np.int32
+
+# Number of rows summed at once when aggregating a partition.
+BLOCK_SIZE = 4096
+
+
+def to_dense(h):
+    """Decode a histogram into an int32 array indexed by bucket.
+
+    `h` is the JSON string or dictionary produced by
+    `mozfun.hist.string_to_json`. Missing or empty histograms are None.
+    """
+    if isinstance(h, str):
+        h = json.loads(h)
+    if not h:
+        return None
+    values = h.get("values") or {}
+    buckets = [int(bucket) for bucket in values]
+    width = max([h.get("bucket_count") or 0] + [bucket + 1 for bucket in buckets])
+    dense = np.zeros(width, dtype=DTYPE)
+    for bucket, count in zip(buckets, values.values()):
+        dense[bucket] = count
+    return dense
+
+
+def to_count(h):
+    """Decode a count histogram into the number of recorded events."""
+    if isinstance(h, str):
+        h = json.loads(h)
+    values = (h or {}).get("values") or {}
+    return int(values.get("0", 0))
+
+
+def add(a, b):
+    """Add two dense histograms, padding the narrower one with zeros."""
+    if a is None:
+        return b
+    if b is None:
+        return a
+    if len(a) < len(b):
+        a, b = b, a
+    total = a.astype(np.int64)
+    total[: len(b)] += b
+    return total
+
+
+class HistogramSum(object):
+    """Running sum of dense histograms.
+
+    Histograms are copied into a compact int32 matrix of BLOCK_SIZE rows,
+    which is summed column-wise each time it fills up.
+    """
+
+    def __init__(self, block_size=BLOCK_SIZE):
+        self.block = np.zeros((block_size, 0), dtype=DTYPE)
+        self.rows = 0
+        self.total = None
+
+    def add(self, dense):
+        if len(dense) > self.block.shape[1]:
+            block = np.zeros((self.block.shape[0], len(dense)), dtype=DTYPE)
+            block[:, : self.block.shape[1]] = self.block
+            self.block = block
+        self.block[self.rows, : len(dense)] = dense
+        self.rows += 1
+        if self.rows == self.block.shape[0]:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            self.total = add(
+                self.total, self.block[: self.rows].sum(axis=0, dtype=np.int64)
+            )
+            self.block[: self.rows] = 0
+            self.rows = 0
+
+    def result(self):
+        self.flush()
+        return self.total
+
+
+def merge_sums(a, b):
+    """Merge two {group: dense histogram} dictionaries into `a`."""
+    for group, dense in b.items():
+        a[group] = add(a.get(group), dense)
+    return a
+
+
+def aggregate(pings, path, key=None):
+    """Sum the dense histogram at `path` over an RDD of pings.
+
+    Each partition is reduced locally and the partial sums are merged at the
+    end. Pings without the histogram are skipped. Returns the summed int64
+    array, or None if no ping has the histogram. If `key` is given, the
+    histograms are summed per `key(ping)` and a {key: array} dictionary is
+    returned instead.
+    """
+
+    def sum_partition(iterator):
+        sums = {}
+        for p in iterator:
+            dense = p.get(path)
+            if dense is None:
+                continue
+            group = key(p) if key is not None else None
+            if group not in sums:
+                sums[group] = HistogramSum()
+            sums[group].add(dense)
+        yield {group: s.result() for group, s in sums.items()}
+
+    totals = pings.mapPartitions(sum_partition).fold({}, merge_sums)
+    if key is None:
+        return totals.get(None)
+    return totals
@@ -0,0 +1,147 @@
+"""Run the dashboard or trends analyses on a single machine.
+
+Pings are read from Parquet or JSON lines query results with a
+sources.LocalSource, e.g. those written by bigquery_shim.synthetic, and
+analyzed by an engine.ProcessEngine with a process per core:
+
+    python -m bigquery_shim.local dashboard /tmp/pings /tmp/exports
+    python -m bigquery_shim.local trends /tmp/pings /tmp/trends
+
+The dashboard exports are written as <output>/<name>.json, with the names and
+contents the dashboard notebook exports, and the trends are updated under
+<output> as the trends notebook updates them.
+"""
+
+import argparse
+import datetime
+import json
+import os
+
+from . import dashboard_analysis, engine, sources, trends_analysis
+
+
+def json_exporter(directory):
+    """Return an export function writing <directory>/<filename>.json."""
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    def export(filename, obj):
+        path = os.path.join(directory, "{0}.json".format(filename))
+        print("Writing to {0}".format(path))
+        with open(path, "w") as fp:
+            fp.write(json.dumps(obj))
+
+    return export
+
+
+def export_dashboard(eng, data_source, export, timeWindow=14, fraction=0.003, now=None):
+    """Compute and export the dashboard notebook's statistics."""
+    A = dashboard_analysis
+
+    pings, info = A.FetchAndFormat(
+        eng,
+        data_source,
+        use_arrow=True,
+        timeWindow=timeWindow,
+        fraction=fraction,
+        now=now,
+    )
+    windows_pings, mac_pings, linux_pings = A.SplitPings(eng, pings)
+
+    def timed_export(filename, callback, subset):
+        A.TimedExport(export, filename, callback, pings=(subset, info))
+
+    timed_export(
+        "general-statistics",
+        lambda: A.GetGeneralStatistics(pings, info, data_source),
+        pings,
+    )
+    timed_export(
+        "device-statistics", lambda: A.GetDriverStatistics(pings, data_source), pings
+    )
+    timed_export(
+        "tdr-statistics", lambda: A.GetTDRStatistics(eng, windows_pings), windows_pings
+    )
+    timed_export("system-statistics", lambda: A.GetSystemStatistics(eng, pings), pings)
+    timed_export(
+        "sanity-test-statistics",
+        lambda: A.GetSanityTests(eng, windows_pings),
+        windows_pings,
+    )
+    timed_export(
+        "startup-test-statistics", lambda: A.GetStartupTests(eng, pings), pings
+    )
+    timed_export(
+        "monitor-statistics",
+        lambda: A.GetMonitorStatistics(eng, windows_pings),
+        windows_pings,
+    )
+    timed_export(
+        "mac-statistics",
+        lambda: A.GetMacStatistics(mac_pings, data_source),
+        mac_pings,
+    )
+    windows_features = A.GetWindowsFeaturePings(windows_pings)
+    timed_export(
+        "windows-features",
+        lambda: A.GetWindowsFeatures(windows_features),
+        windows_features,
+    )
+    timed_export(
+        "linux-statistics", lambda: A.GetLinuxStatistics(linux_pings), linux_pings
+    )
+    timed_export("webgl-statistics", lambda: A.GetWebGLStatistics(pings), pings)
+    timed_export(
+        "layers-failureid-statistics", lambda: A.GetLayersStatistics(pings), pings
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("analysis", choices=["dashboard", "trends"])
+    parser.add_argument("input", help="directory of a sources.LocalSource")
+    parser.add_argument("output", help="directory to write the results to")
+    parser.add_argument(
+        "--processes", type=int, help="worker processes, one per core by default"
+    )
+    parser.add_argument(
+        "--days", type=int, default=14, help="time window of the dashboard"
+    )
+    parser.add_argument(
+        "--now",
+        type=lambda s: datetime.datetime.strptime(s, "%Y-%m-%d"),
+        help="date the dashboard is computed on, YYYY-MM-DD, today by default",
+    )
+    parser.add_argument(
+        "--max-history",
+        type=int,
+        default=210,
+        help="number of days of trends to compute",
+    )
+    args = parser.parse_args(argv)
+
+    eng = engine.ProcessEngine(args.processes)
+    data_source = sources.LocalSource(args.input)
+    try:
+        if args.analysis == "dashboard":
+            export_dashboard(
+                eng,
+                data_source,
+                json_exporter(args.output),
+                timeWindow=args.days,
+                now=args.now,
+            )
+        else:
+            options = trends_analysis.Options(
+                args.output,
+                max_history=datetime.timedelta(days=args.max_history),
+                use_arrow=True,
+                local_data_path=args.input,
+            )
+            trends_analysis.DoUpdate(eng, options, trends_analysis.AllTrends())
+    finally:
+        eng.close()
+
+
+if __name__ == "__main__":
+    main()
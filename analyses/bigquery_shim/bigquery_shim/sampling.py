@@ -0,0 +1,41 @@
+"""Deterministic client sampling for the fetch queries.
+
+Clients are selected by `sample_id`, the telemetry pipeline's hash of
+client_id into 100 buckets, and within the last partially included bucket by
+a finer hash of client_id. A given fraction therefore always selects the same
+clients, so that results for the same day are stable between runs. Filtering
+on whole `sample_id` values first also lets BigQuery prune the clustered
+main ping table.
+"""
+
+# The first sample_id included; the sample grows from there.
+FIRST_SAMPLE_ID = 42
+
+# Number of sub-buckets of a sample_id, i.e. the finest sampling resolution
+# is 1 / (100 * SUB_SAMPLES).
+SUB_SAMPLES = 10000
+
+
+def sample_filter(fraction):
+    """SQL condition selecting a deterministic `fraction` of clients."""
+    units = int(round(fraction * 100 * SUB_SAMPLES))
+    if not 0 < units <= 100 * SUB_SAMPLES:
+        raise ValueError("unsupported sample fraction: {}".format(fraction))
+
+    whole, partial = divmod(units, SUB_SAMPLES)
+    sample_ids = [(FIRST_SAMPLE_ID + i) % 100 for i in range(whole + 1)]
+
+    conditions = []
+    if whole:
+        conditions.append(
+            "sample_id IN ({})".format(", ".join(map(str, sample_ids[:whole])))
+        )
+    if partial:
+        conditions.append(
+            "(sample_id = {} AND ABS(MOD(FARM_FINGERPRINT(client_id), {})) < {})".format(
+                sample_ids[whole], SUB_SAMPLES, partial
+            )
+        )
+    if len(conditions) == 1:
+        return conditions[0]
+    return "({})".format(" OR ".join(conditions))
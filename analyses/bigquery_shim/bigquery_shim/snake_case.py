@@ -1,8 +1,8 @@
 #!/usr/bin/env python
 # utility methods for for addressing snake_cased data via moztelemetry
 # https://github.com/acmiyaguchi/test-casing/
-import collections
-import json
+import collections.abc
+import functools
 
 import regex as re
 
@@ -18,7 +18,7 @@ REV_WORD_BOUND_PAT = re.compile(
 )
 
 
-def snake_case(line: str) -> str:
+def _snake_case(line: str) -> str:
     # replace non-alphanumeric characters with spaces in the reversed line
     subbed = re.sub(r"[^\w]|_", " ", line[::-1])
 
@@ -29,6 +29,41 @@ def snake_case(line: str) -> str:
     return "_".join([w.lower() for w in words if w.strip()])[::-1]
 
 
+# Precomputed conversions of the camelCase telemetry fields addressed by the
+# analyses. The modules that address them add their keys and property lists
+# with add_known_keys when they are imported.
+KNOWN_KEYS = {}
+
+# The reverse of KNOWN_KEYS: {snake_case key: [other known spellings]}.
+SPELLINGS = {}
+
+
+def add_known_keys(keys):
+    """Precompute the conversions of `keys` and of the parts of key paths."""
+    for key in keys:
+        for part in [key] + key.split("/"):
+            if part not in KNOWN_KEYS:
+                converted = KNOWN_KEYS[part] = _snake_case(part)
+                if converted != part:
+                    SPELLINGS.setdefault(converted, []).append(part)
+
+
+# Any other key is converted once and kept in a bounded LRU cache, since the
+# vocabulary of field names seen in pings is small.
+CACHE_SIZE = 4096
+
+_cached_snake_case = functools.lru_cache(maxsize=CACHE_SIZE)(_snake_case)
+cache_info = _cached_snake_case.cache_info
+cache_clear = _cached_snake_case.cache_clear
+
+
+def snake_case(line: str) -> str:
+    converted = KNOWN_KEYS.get(line)
+    if converted is None:
+        converted = _cached_snake_case(line)
+    return converted
+
+
 def split_snake_case(line):
     return "/".join(list(map(snake_case, line.split("/"))))
 
@@ -64,48 +99,194 @@ class SnakeCaseDictOld(dict):
         return super(SnakeCaseDict, self).__getitem__(key)
 
 
-class SnakeCaseDict(collections.MutableMapping):
+_missing = object()
+
+
+class SnakeCaseDict(dict):
+    """A dictionary addressable by both the camelCase and snake_case spelling of a key.
+
+    Each value is stored once, under the key it was inserted with. When a key
+    is inserted, its snake_case spelling and the known camelCase spellings of
+    that (see add_known_keys) are indexed, so looking up any of them is a
+    single index lookup. Only other spellings are converted at lookup time.
+    Since this is a plain dict subclass, it serializes directly with json and
+    ujson.
+    """
+
+    __slots__ = ("_index",)
+
     def __init__(self, *args, **kwargs):
-        self.data = dict(*args, **kwargs)
+        super(SnakeCaseDict, self).__init__()
+        self._index = {}
+        self.update(*args, **kwargs)
+
+    def __reduce__(self):
+        return self.__class__, (dict(self),)
+
+    @classmethod
+    def fromkeys(cls, iterable, value=None):
+        return cls(dict.fromkeys(iterable, value))
 
-    def __len__(self):
-        return len(self.data)
+    @staticmethod
+    def _spellings(key):
+        """Return the spellings of `key` to index, other than itself."""
+        normalized = snake_case(key)
+        spellings = [normalized] if normalized != key else []
+        spellings.extend(s for s in SPELLINGS.get(normalized, ()) if s != key)
+        return spellings
 
-    def __iter__(self):
-        return iter(self.data)
+    def _resolve(self, key):
+        """Return the stored key for `key`, or `_missing`."""
+        stored = self._index.get(key, _missing)
+        if stored is not _missing or not isinstance(key, str):
+            return stored
+        # A spelling that was not indexed, still the same key once converted.
+        normalized = snake_case(key)
+        if dict.__contains__(self, normalized):
+            return normalized
+        return self._index.get(normalized, _missing)
 
     def __contains__(self, key):
-        a = key in self.data
-        if a:
-            return a
-        return snake_case(key) in self.data
+        return dict.__contains__(self, key) or self._resolve(key) is not _missing
 
-    def __getitem__(self, key):
+    def __missing__(self, key):
+        stored = self._resolve(key)
+        if stored is _missing:
+            raise KeyError(key)
+        return dict.__getitem__(self, stored)
+
+    def get(self, key, default=None):
         try:
-            return self.data[key]
-        except:
-            return self.data[snake_case(key)]
+            return self[key]
+        except KeyError:
+            return default
 
     def __setitem__(self, key, value):
-        self.data[key] = value
+        if not dict.__contains__(self, key):
+            stored = self._resolve(key)
+            if stored is not _missing:
+                key = stored
+            elif isinstance(key, str):
+                for spelling in self._spellings(key):
+                    self._index[spelling] = key
+        dict.__setitem__(self, key, value)
 
     def __delitem__(self, key):
-        self.data.delete(key)
+        if not dict.__contains__(self, key):
+            stored = self._resolve(key)
+            if stored is _missing:
+                raise KeyError(key)
+            key = stored
+        dict.__delitem__(self, key)
+        self._unindex(key)
+
+    def _unindex(self, key):
+        if isinstance(key, str):
+            for spelling in self._spellings(key):
+                if self._index.get(spelling) == key:
+                    del self._index[spelling]
+
+    def pop(self, key, *default):
+        if key in self:
+            value = self[key]
+            del self[key]
+            return value
+        if default:
+            return default[0]
+        raise KeyError(key)
+
+    def popitem(self):
+        key, value = dict.popitem(self)
+        self._unindex(key)
+        return key, value
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def __or__(self, other):
+        if not isinstance(other, dict):
+            return NotImplemented
+        merged = self.copy()
+        merged.update(other)
+        return merged
+
+    def __ror__(self, other):
+        if not isinstance(other, dict):
+            return NotImplemented
+        merged = self.__class__(other)
+        merged.update(self)
+        return merged
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def clear(self):
+        dict.clear(self)
+        self._index.clear()
+
+    def copy(self):
+        return self.__class__(self)
+
+
+class LazySnakeCaseDict(SnakeCaseDict):
+    """A SnakeCaseDict that converts nested values only when they are accessed.
+
+    Nested mappings and lists are wrapped the first time they are read and
+    the wrapped value is stored back, so untouched parts of a ping are never
+    copied.
+    """
+
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        value = dict.__getitem__(self, key)
+        if isinstance(value, (SnakeCaseDict, LazySnakeCaseList)):
+            return value
+        if isinstance(value, (collections.abc.Mapping, list)):
+            value = wrap_lazy(value)
+            self[key] = value
+        return value
+
+    def values(self):
+        return [self[key] for key in self]
+
+    def items(self):
+        return [(key, self[key]) for key in self]
+
+
+class LazySnakeCaseList(list):
+    """A list whose mappings have been wrapped in LazySnakeCaseDicts."""
+
+    __slots__ = ()
+
 
+def wrap_lazy(value):
+    """Wrap a single level of a value for lazy snake_case access."""
+    if isinstance(value, (SnakeCaseDict, LazySnakeCaseList)):
+        return value
+    if isinstance(value, collections.abc.Mapping):
+        return LazySnakeCaseDict(value)
+    if isinstance(value, list):
+        return LazySnakeCaseList(wrap_lazy(item) for item in value)
+    return value
 
-# FIXME make snake dict a subclass of dict so that a custom json encoder isn't necessary
-class SnakeCaseEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, SnakeCaseDict):
-            # return json.JSONEncoder.default(self, obj.data)
-            return obj.data
-        # Let the base class default method raise the TypeError
-        return json.JSONEncoder.default(self, obj)
 
+def convert_snake_case_dict(mapping, lazy=False):
+    """Convert mappings to SnakeCaseDicts recursively.
 
-def convert_snake_case_dict(mapping):
-    """Convert mappings to SnakeCaseDicts recursively."""
-    if isinstance(mapping, collections.Mapping):
+    With `lazy`, only the outermost mapping is converted up front and nested
+    values are converted as they are accessed.
+    """
+    if lazy:
+        return wrap_lazy(mapping)
+    if isinstance(mapping, collections.abc.Mapping):
         for key, value in mapping.items():
             mapping[key] = convert_snake_case_dict(value)
         return SnakeCaseDict(mapping)
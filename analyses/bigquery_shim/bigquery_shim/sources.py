@@ -0,0 +1,302 @@
+"""Data sources for the rows of the dashboard and trends queries.
+
+`dashboard.fetch_results` and `trends.fetch_results` build a query and hand it
+to a `DataSource`, which returns the resulting rows as an RDD. BigQuerySource
+runs the query in BigQuery. LocalSource reads rows of the same shape from
+Parquet or JSON lines files, so that the pipelines can be run and profiled
+on a single machine without network access.
+"""
+
+import collections
+import datetime
+import os
+import uuid
+from concurrent import futures
+
+from google.cloud import bigquery
+
+
+class DataSource(object):
+    """Source of query result rows.
+
+    `fetch` returns an RDD of Spark Rows with the query's columns. Given
+    `convert_batch`, the rows are instead read as Arrow record batches and
+    the RDD holds the pings returned by `convert_batch(batch)`. `fetch_frame`
+    returns the rows as a DataFrame.
+    """
+
+    # Whether run_query can run BigQuery SQL over fetched tables.
+    supports_sql = False
+
+    # Whether query results can be materialized into date partitions.
+    supports_partitions = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.cleanup()
+
+    def cleanup(self):
+        """Release what fetch created; the fetched RDDs are unusable after this."""
+
+    def fetch(self, spark, query, table_id, convert_batch=None):
+        raise NotImplementedError
+
+    def fetch_frame(self, spark, query, table_id):
+        raise NotImplementedError
+
+    def table_ref(self, table_id):
+        """SQL reference to the table that `fetch` stored `table_id` rows in."""
+        raise NotImplementedError
+
+    def run_query(self, query, params):
+        """Run a query with positional parameters and return its rows."""
+        raise NotImplementedError
+
+    def partitions(self, table_id):
+        """Return {date: last modified datetime} of the partitions of a table."""
+        raise NotImplementedError
+
+    def partitioned_table_ref(self, table_id):
+        """SQL reference to a table written by `write_partition`."""
+        raise NotImplementedError
+
+    def write_partition(self, query, table_id, date, field, expiration_days=None):
+        """Replace the `date` partition of a table, partitioned on `field`, with the query's rows."""
+        raise NotImplementedError
+
+
+# Destination tables of a BigQuerySource are deleted by BigQuery this long
+# after they were written, should cleanup() never run.
+TABLE_EXPIRATION = datetime.timedelta(days=1)
+
+
+class BigQuerySource(DataSource):
+    """Run queries in BigQuery and read their destination tables.
+
+    Query results for `table_id` are written to a table of this run only,
+    `<table_id>_<run_id>`, so that runs never overwrite each other's
+    results. Those tables expire after `table_expiration` and are deleted
+    by cleanup(), which also runs when the source is used as a context
+    manager.
+    """
+
+    supports_sql = True
+    supports_partitions = True
+
+    def __init__(
+        self,
+        project_id="mozdata",
+        dataset_id="tmp",
+        run_id=None,
+        table_expiration=TABLE_EXPIRATION,
+    ):
+        self.project_id = project_id
+        self.dataset_id = dataset_id
+        if run_id is None:
+            run_id = "{:%Y%m%d%H%M%S}_{}".format(
+                datetime.datetime.utcnow(), uuid.uuid4().hex[:8]
+            )
+        self.run_id = run_id
+        self.table_expiration = table_expiration
+        self.tables = set()
+
+    def run_table_id(self, table_id):
+        """Name of the table of this run that `table_id` results are written to."""
+        return "{}_{}".format(table_id, self.run_id)
+
+    def run_to_table(self, query, table_id):
+        """Run a query into the table of this run for `table_id` and return it."""
+        bq = bigquery.Client(project=self.project_id)
+        # We need to explicitly specify destination table since the query result is smaller than 10MB
+        dataset = bq.dataset(self.dataset_id, project=self.project_id)
+        table_ref = dataset.table(self.run_table_id(table_id))
+        job_config = bigquery.QueryJobConfig()
+        job_config.destination = table_ref
+        job_config.write_disposition = "WRITE_TRUNCATE"
+
+        query_job = bq.query(query, job_config=job_config)
+
+        # Wait for query execution
+        query_job.result()
+        self.tables.add(table_ref.table_id)
+
+        table = bq.get_table(table_ref)
+        now = datetime.datetime.now(datetime.timezone.utc)
+        table.expires = now + self.table_expiration
+        bq.update_table(table, ["expires"])
+        return query_job.destination
+
+    def fetch(self, spark, query, table_id, convert_batch=None):
+        if convert_batch is None:
+            return self.fetch_frame(spark, query, table_id).rdd
+
+        from . import arrow
+
+        destination = self.run_to_table(query, table_id)
+        streams = arrow.create_read_streams(
+            self.project_id, destination.dataset_id, destination.table_id
+        )
+        return arrow.read_pings(
+            spark.sparkContext, streams, arrow.read_stream_batches, convert_batch
+        )
+
+    def fetch_frame(self, spark, query, table_id):
+        destination = self.run_to_table(query, table_id)
+        return (
+            spark.read.format("bigquery")
+            .option("project", self.project_id)
+            .option("dataset", destination.dataset_id)
+            .option("table", destination.table_id)
+            .load()
+        )
+
+    def table_ref(self, table_id):
+        return "`{}.{}.{}`".format(
+            self.project_id, self.dataset_id, self.run_table_id(table_id)
+        )
+
+    def cleanup(self):
+        bq = bigquery.Client(project=self.project_id)
+        dataset = bq.dataset(self.dataset_id, project=self.project_id)
+        for table_id in sorted(self.tables):
+            bq.delete_table(dataset.table(table_id), not_found_ok=True)
+        self.tables.clear()
+
+    def run_query(self, query, params):
+        bq = bigquery.Client(project=self.project_id)
+        job_config = bigquery.QueryJobConfig()
+        job_config.query_parameters = [
+            bigquery.ScalarQueryParameter(None, _bigquery_type(value), value)
+            for value in params
+        ]
+        return bq.query(query, job_config=job_config).result()
+
+    def partitioned_table_ref(self, table_id):
+        # Partitioned tables are shared between runs.
+        return "`{}.{}.{}`".format(self.project_id, self.dataset_id, table_id)
+
+    def partitions(self, table_id):
+        query = """
+        SELECT partition_id, last_modified_time
+        FROM `{}.{}.INFORMATION_SCHEMA.PARTITIONS`
+        WHERE table_name = ? AND partition_id NOT IN ('__NULL__', '__UNPARTITIONED__')
+        """.format(
+            self.project_id, self.dataset_id
+        )
+        return {
+            datetime.datetime.strptime(partition_id, "%Y%m%d").date(): last_modified
+            for partition_id, last_modified in self.run_query(query, [table_id])
+        }
+
+    def write_partition(self, query, table_id, date, field, expiration_days=None):
+        bq = bigquery.Client(project=self.project_id)
+        dataset = bq.dataset(self.dataset_id, project=self.project_id)
+        job_config = bigquery.QueryJobConfig()
+        # The partition decorator makes WRITE_TRUNCATE replace only that day.
+        job_config.destination = dataset.table(
+            "{}${}".format(table_id, date.strftime("%Y%m%d"))
+        )
+        job_config.write_disposition = "WRITE_TRUNCATE"
+        job_config.time_partitioning = bigquery.TimePartitioning(field=field)
+        if expiration_days is not None:
+            job_config.time_partitioning.expiration_ms = expiration_days * 86400000
+        bq.query(query, job_config=job_config).result()
+
+
+def _bigquery_type(value):
+    if isinstance(value, bool):
+        return "BOOL"
+    if isinstance(value, int):
+        return "INT64"
+    if isinstance(value, float):
+        return "FLOAT64"
+    return "STRING"
+
+
+PARQUET = ".parquet"
+JSONL = ".jsonl"
+
+
+class LocalSource(DataSource):
+    """Read query result rows from local files instead of running the query.
+
+    The rows for `table_id` are read from `<path>/<table_id>`, either a single
+    .parquet or .jsonl file or a directory of them, one Spark partition per
+    file. The files hold the rows the query would have returned, such as an
+    export of its destination table.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def files(self, table_id):
+        """Return the data files for `table_id` and their format."""
+        base = os.path.join(self.path, table_id)
+        for ext in (PARQUET, JSONL):
+            if os.path.isfile(base + ext):
+                return [base + ext], ext
+
+        names = sorted(os.listdir(base))
+        for ext in (PARQUET, JSONL):
+            files = [os.path.join(base, name) for name in names if name.endswith(ext)]
+            if files:
+                return files, ext
+        raise ValueError("no .parquet or .jsonl files in {}".format(base))
+
+    def fetch(self, spark, query, table_id, convert_batch=None):
+        files, ext = self.files(table_id)
+
+        if convert_batch is not None:
+            from . import arrow
+
+            if ext == PARQUET:
+                read_batches = arrow.read_parquet_batches
+            else:
+                read_batches = arrow.read_jsonl_batches
+            return arrow.read_pings(
+                spark.sparkContext, files, read_batches, convert_batch
+            )
+        return self.fetch_frame(spark, query, table_id).rdd
+
+    def fetch_frame(self, spark, query, table_id):
+        files, ext = self.files(table_id)
+        if ext == PARQUET:
+            return spark.read.parquet(*files)
+        return spark.read.json(files)
+
+
+def prefetch(items, fetch, concurrency=4, release=None):
+    """Yield (item, future of fetch(item)) for each item, in order.
+
+    Up to `concurrency` fetches run ahead in threads, so that queries and
+    loads for later items overlap with the consumer working on earlier ones.
+    Fetches that have not started when the consumer stops are cancelled.
+    Those already running are waited for, and their results passed to
+    `release`, if given, since the consumer never sees them.
+    """
+    items = iter(items)
+    pending = collections.deque()
+    executor = futures.ThreadPoolExecutor(max_workers=concurrency)
+    try:
+        for item in items:
+            pending.append((item, executor.submit(fetch, item)))
+            if len(pending) == concurrency:
+                break
+        while pending:
+            item, future = pending.popleft()
+            for next_item in items:
+                pending.append((next_item, executor.submit(fetch, next_item)))
+                break
+            yield item, future
+    finally:
+        for item, future in pending:
+            if future.cancel() or release is None:
+                continue
+            try:
+                fetched = future.result()
+            except Exception:
+                continue
+            release(fetched)
+        executor.shutdown(wait=False)
@@ -0,0 +1,188 @@
+"""Mergeable per-day partial aggregates.
+
+A `StateStore` keeps, for each metric and submission date, a partial
+aggregate of that day's pings: a counter map, a summed histogram, or a keyed
+counter map such as failure IDs by process. Partials of the same kind merge
+with MERGES, so the aggregate of any window of days is built by merging the
+partials of its days instead of scanning their pings again.
+
+Pings are deduplicated per client and day, see
+`dashboard.fetch_daily_partitions`, so a window merged from daily partials
+counts a client once for each day it was seen rather than once per window.
+"""
+
+import datetime
+import functools
+import json
+import os
+
+import numpy as np
+
+from . import dashboard
+
+COUNTER = "counter"
+HISTOGRAM = "histogram"
+KEYED_COUNTER = "keyed_counter"
+
+# Partials of other versions are ignored; bump this when the layout or the
+# meaning of stored partials changes.
+STATE_VERSION = 1
+
+
+def merge_counters(a, b):
+    """Merge two {key: count} maps into a new one."""
+    merged = dict(a)
+    for key, count in b.items():
+        merged[key] = merged.get(key, 0) + count
+    return merged
+
+
+def merge_histograms(a, b):
+    """Add two dense histograms, either of which may be None or shorter."""
+    if a is None:
+        return b
+    if b is None:
+        return a
+    if len(a) < len(b):
+        a, b = b, a
+    merged = np.array(a, dtype=np.int64)
+    merged[: len(b)] += b
+    return merged
+
+
+def merge_keyed_counters(a, b):
+    """Merge two {key: {subkey: count}} maps into a new one."""
+    merged = dict(a)
+    for key, counter in b.items():
+        merged[key] = merge_counters(merged.get(key, {}), counter)
+    return merged
+
+
+MERGES = {
+    COUNTER: merge_counters,
+    HISTOGRAM: merge_histograms,
+    KEYED_COUNTER: merge_keyed_counters,
+}
+
+EMPTY = {
+    COUNTER: {},
+    HISTOGRAM: None,
+    KEYED_COUNTER: {},
+}
+
+
+def merge(kind, partials):
+    """Merge an iterable of partials of the same kind."""
+    return functools.reduce(MERGES[kind], partials, EMPTY[kind])
+
+
+# Counter keys are stored as [key, count] pairs, since JSON object keys would
+# turn keys such as None or histogram buckets into strings.
+def _encode(kind, value):
+    if kind == COUNTER:
+        return [[key, count] for key, count in value.items()]
+    if kind == HISTOGRAM:
+        return None if value is None else [int(count) for count in value]
+    return [[key, _encode(COUNTER, counter)] for key, counter in value.items()]
+
+
+def _decode(kind, value):
+    if kind == COUNTER:
+        return {key: count for key, count in value}
+    if kind == HISTOGRAM:
+        return None if value is None else np.array(value, dtype=np.int64)
+    return {key: _decode(COUNTER, counter) for key, counter in value}
+
+
+class StateStore(object):
+    """Per-day partial aggregates stored as JSON files under `path`.
+
+    The partials of a day are kept in `<path>/v<version>/<YYYY-MM-DD>.json`,
+    along with when each was written. A partial written before its day had
+    settled, see `dashboard.PARTITION_SETTLE_TIME`, is considered stale.
+    """
+
+    def __init__(self, path, version=STATE_VERSION):
+        self.path = os.path.join(path, "v{}".format(version))
+        self.days = {}
+
+    def day_path(self, day):
+        return os.path.join(
+            self.path, "{}.json".format(day.strftime(dashboard.FORMAT_DS))
+        )
+
+    def load(self, day):
+        """Return {metric: {"kind", "value", "written"}} of a day, still encoded."""
+        if day not in self.days:
+            try:
+                with open(self.day_path(day)) as fp:
+                    self.days[day] = json.load(fp)
+            except IOError:
+                self.days[day] = {}
+        return self.days[day]
+
+    def get(self, metric, day):
+        """Return the (kind, value) partial of a metric on a day, or None."""
+        entry = self.load(day).get(metric)
+        if entry is None:
+            return None
+        return entry["kind"], _decode(entry["kind"], entry["value"])
+
+    def put(self, day, partials, written=None):
+        """Store {metric: (kind, value)} partials of a day."""
+        if written is None:
+            written = datetime.datetime.now(datetime.timezone.utc)
+        entries = dict(self.load(day))
+        for metric, (kind, value) in partials.items():
+            entries[metric] = {
+                "kind": kind,
+                "value": _encode(kind, value),
+                "written": written.timestamp(),
+            }
+
+        os.makedirs(self.path, exist_ok=True)
+        path = self.day_path(day)
+        # Replace the file in one go so that a partial file is never read.
+        with open(path + ".tmp", "w") as fp:
+            json.dump(entries, fp)
+        os.replace(path + ".tmp", path)
+        self.days[day] = entries
+
+    def stale_days(self, metrics, start_date, end_date):
+        """Return the days from `start_date` to `end_date` that need new partials."""
+        days = []
+        day = start_date
+        while day <= end_date:
+            day_end = datetime.datetime.combine(
+                day + datetime.timedelta(days=1), datetime.time(), datetime.timezone.utc
+            )
+            settled = (day_end + dashboard.PARTITION_SETTLE_TIME).timestamp()
+            entries = self.load(day)
+            if any(
+                metric not in entries or entries[metric]["written"] < settled
+                for metric in metrics
+            ):
+                days.append(day)
+            day += datetime.timedelta(days=1)
+        return days
+
+    def window(self, metric, start_date, end_date):
+        """Merge the partials of a metric from `start_date` to `end_date`.
+
+        Raises KeyError if a day has no partial for the metric.
+        """
+        kind = None
+        partials = []
+        day = start_date
+        while day <= end_date:
+            partial = self.get(metric, day)
+            if partial is None:
+                raise KeyError("no {} partial for {}".format(metric, day))
+            kind, value = partial
+            partials.append(value)
+            day += datetime.timedelta(days=1)
+        if kind is None:
+            raise KeyError(
+                "no {} partials from {} to {}".format(metric, start_date, end_date)
+            )
+        return merge(kind, partials)
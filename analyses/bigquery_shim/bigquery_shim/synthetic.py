@@ -0,0 +1,744 @@
+"""Synthetic results of the dashboard and trends queries.
+
+Rows have the columns and nested shapes that `dashboard.fetch_results` and
+`trends.fetch_results` read from the query destination tables: adapters,
+features, monitors and CPU structs, histograms as the JSON strings returned by
+`mozfun.hist.string_to_json`, keyed failure ID histograms and the
+`additional_gfx` (or whole `additional_properties`) blob. Written as Parquet
+or JSON lines files under `<path>/<table_id>/`, they can be read back with
+`sources.LocalSource(path)` to run and benchmark the analyses offline.
+
+The distributions of vendors, devices, operating systems, versions and
+failures are set by a `Profile`. Rows are generated and written in batches,
+so memory stays bounded whatever the number of rows. From the command line:
+
+    python -m bigquery_shim.synthetic dashboard 1000000 /tmp/pings --format parquet
+    python -m bigquery_shim.synthetic trends 100000 /tmp/pings --weeks 4 --by-week
+
+By default the pings end today, or on the last Sunday for trends, so that they
+fall in the windows the notebooks compute.
+"""
+
+import argparse
+import bisect
+import collections
+import datetime
+import itertools
+import json
+import os
+import random
+import uuid
+
+PARQUET = ".parquet"
+JSONL = ".jsonl"
+
+# Weights of each value of a distribution, e.g. {"0x8086": 0.6, "0x10de": 0.4}.
+Profile = collections.namedtuple(
+    "Profile",
+    [
+        "vendors",  # vendor ID
+        "devices",  # vendor ID -> device IDs, picked uniformly
+        "os",  # (name, version, service pack major)
+        "versions",  # Firefox build version
+        "compositors",  # Windows compositor
+        "d3d11",  # D3D11 feature status
+        "d2d",  # D2D feature status
+        "failure_ids",  # compositing and WebGL failure IDs
+        "failure_rate",  # probability of a ping having failure IDs
+        "tdr_rate",  # probability of a ping having device resets
+        "sanity_test_rate",  # probability of a ping having a sanity test
+    ],
+)
+
+DEFAULT_PROFILE = Profile(
+    vendors={
+        "0x8086": 0.6,
+        "0x10de": 0.2,
+        "0x1002": 0.15,
+        "0x1414": 0.03,
+        "0x15ad": 0.02,
+    },
+    devices={
+        "0x8086": ["0x0166", "0x0416", "0x1912", "0x3e92", "0x5917", "0x9bc4"],
+        "0x10de": ["0x1180", "0x1c82", "0x1f08", "0x2184", "0x0fc6"],
+        "0x1002": ["0x6779", "0x67df", "0x15d8", "0x731f"],
+        "0x1414": ["0x008c"],
+        "0x15ad": ["0x0405"],
+    },
+    os={
+        ("Windows_NT", "10.0", 0): 0.7,
+        ("Windows_NT", "6.1", 1): 0.12,
+        ("Windows_NT", "6.3", 0): 0.04,
+        ("Darwin", "19.6.0", None): 0.08,
+        ("Linux", "5.4.0-42-generic", None): 0.06,
+    },
+    versions={"79.0": 0.55, "78.0.2": 0.3, "80.0b3": 0.1, "81.0a1": 0.05},
+    compositors={"d3d11": 0.85, "basic": 0.08, "webrender": 0.07},
+    d3d11={"available": 0.9, "blacklisted": 0.05, "blocked": 0.02, "failed": 0.03},
+    d2d={"available": 0.88, "blacklisted": 0.06, "unavailable": 0.06},
+    failure_ids={
+        "FEATURE_FAILURE_D3D11_NEED_HWCOMP": 0.4,
+        "FEATURE_FAILURE_D3D11_BLOCKED": 0.25,
+        "FEATURE_FAILURE_OPENGL_CREATE_FAILED": 0.2,
+        "FEATURE_FAILURE_WEBGL_EXHAUSTED_DRIVERS": 0.15,
+    },
+    failure_rate=0.02,
+    tdr_rate=0.01,
+    sanity_test_rate=0.05,
+)
+
+# Bucket counts of the enumerated histograms queried by the dashboard.
+HISTOGRAMS = {
+    "DEVICE_RESET_REASON": 11,
+    "GRAPHICS_SANITY_TEST": 21,
+    "GRAPHICS_SANITY_TEST_REASON": 21,
+    "GRAPHICS_DRIVER_STARTUP_TEST": 21,
+    "CANVAS_WEBGL_SUCCESS": 3,
+    "CANVAS_WEBGL2_SUCCESS": 3,
+    "PLUGIN_DRAWING_MODEL": 13,
+    "MEDIA_DECODER_BACKEND_USED": 11,
+}
+
+KEYED_HISTOGRAMS = [
+    "D3D11_COMPOSITING_FAILURE_ID",
+    "OPENGL_COMPOSITING_FAILURE_ID",
+    "CANVAS_WEBGL_ACCL_FAILURE_ID",
+    "CANVAS_WEBGL_FAILURE_ID",
+]
+
+CPU_EXTENSIONS = [
+    "hasMMX",
+    "hasSSE",
+    "hasSSE2",
+    "hasSSE3",
+    "hasSSSE3",
+    "hasSSE4_1",
+    "hasSSE4_2",
+    "hasAVX",
+    "hasAVX2",
+]
+
+RESOLUTIONS = [(1920, 1080), (1366, 768), (2560, 1440), (1536, 864), (3840, 2160)]
+
+
+def load_profile(path):
+    """Read a Profile from a JSON file of the fields to change in DEFAULT_PROFILE.
+
+    Distributions are {value: weight} objects, except `os`, a list of
+    [name, version, service pack major, weight] entries, e.g.
+    {"vendors": {"0x8086": 0.5, "0x10de": 0.5}, "failure_rate": 0.1}.
+    """
+    with open(path) as fp:
+        fields = json.load(fp)
+    unknown = sorted(set(fields) - set(Profile._fields))
+    if unknown:
+        raise ValueError("unknown profile fields: {}".format(", ".join(unknown)))
+    if "os" in fields:
+        fields["os"] = {tuple(entry[:3]): entry[3] for entry in fields["os"]}
+    profile = DEFAULT_PROFILE._replace(**fields)
+    missing = sorted(set(profile.vendors) - set(profile.devices))
+    if missing:
+        raise ValueError("no devices for vendors: {}".format(", ".join(missing)))
+    return profile
+
+
+class Choice(object):
+    """Draws values of a {value: weight} distribution."""
+
+    def __init__(self, weights):
+        self.values = list(weights)
+        self.cumulative = list(itertools.accumulate(weights.values()))
+
+    def __call__(self, rng):
+        x = rng.random() * self.cumulative[-1]
+        return self.values[bisect.bisect_right(self.cumulative, x)]
+
+
+def _histogram(rng, bucket_count, buckets):
+    values = {str(bucket): rng.randint(1, 3) for bucket in buckets}
+    return json.dumps(
+        {
+            "bucket_count": bucket_count,
+            "histogram_type": 5,
+            "sum": sum(int(b) * v for b, v in values.items()),
+            "range": [1, bucket_count - 1],
+            "values": values,
+        }
+    )
+
+
+def _count_histogram(count):
+    return json.dumps(
+        {
+            "bucket_count": 3,
+            "histogram_type": 4,
+            "sum": count,
+            "range": [1, 2],
+            "values": {"0": count},
+        }
+    )
+
+
+class Generator(object):
+    """Draws the parts of a ping shared by the dashboard and trends rows."""
+
+    def __init__(self, profile=DEFAULT_PROFILE, seed=0):
+        self.profile = profile
+        self.rng = random.Random(seed)
+        self.vendor = Choice(profile.vendors)
+        self.os = Choice(profile.os)
+        self.version = Choice(profile.versions)
+        self.compositor = Choice(profile.compositors)
+        self.d3d11 = Choice(profile.d3d11)
+        self.d2d = Choice(profile.d2d)
+        self.failure_id = Choice(profile.failure_ids)
+
+    def client_id(self):
+        return str(uuid.UUID(int=self.rng.getrandbits(128), version=4))
+
+    def creation_date(self, start_date, days):
+        seconds = self.rng.randrange(int(days * 86400))
+        date = start_date + datetime.timedelta(seconds=seconds)
+        return date.strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+    def adapters(self):
+        vendor = self.vendor(self.rng)
+        return [
+            {
+                "description": "Synthetic {} adapter".format(vendor),
+                "vendor_id": vendor,
+                "device_id": self.rng.choice(self.profile.devices[vendor]),
+                "subsys_id": "00000000",
+                "ram": self.rng.choice([1024, 2048, 4096, 8192]),
+                "driver": "synthetic.dll",
+                "driver_version": "{}.{}.{}".format(
+                    self.rng.randint(20, 27),
+                    self.rng.randint(0, 20),
+                    self.rng.randint(1000, 9999),
+                ),
+                "driver_date": "1-1-2020",
+                "gpu_active": True,
+            }
+        ]
+
+    def features(self, os_name):
+        if os_name != "Windows_NT":
+            return {"compositor": self.rng.choice(["opengl", "basic"])}
+        d3d11 = self.d3d11(self.rng)
+        d2d = self.d2d(self.rng)
+        return {
+            "compositor": (
+                self.compositor(self.rng) if d3d11 == "available" else "basic"
+            ),
+            "gpu_process": {"status": self.rng.choice(["available", "disabled"])},
+            "d3d11": {
+                "status": d3d11,
+                "warp": self.rng.random() < 0.02,
+                "texture_sharing": self.rng.random() < 0.97,
+                "version": 45312,
+                "blacklisted": d3d11 == "blacklisted",
+            },
+            "d2d": {"status": d2d, "version": "1.1"},
+            "advanced_layers": {
+                "status": self.rng.choice(["available", "blocked", "disabled"])
+            },
+        }
+
+    def monitors(self):
+        monitors = []
+        for i in range(1 if self.rng.random() < 0.8 else 2):
+            width, height = self.rng.choice(RESOLUTIONS)
+            monitors.append(
+                {
+                    "screen_width": width,
+                    "screen_height": height,
+                    "refresh_rate": self.rng.choice([60, 60, 60, 75, 144]),
+                    "pseudo_display": False,
+                    "scale": self.rng.choice([1.0, 2.0]),
+                }
+            )
+        return monitors
+
+    def cpu(self):
+        count = self.rng.choice([2, 4, 8, 12, 16])
+        return {
+            "count": count,
+            "cores": count // 2,
+            "vendor": self.rng.choice(["GenuineIntel", "AuthenticAMD"]),
+            "family": 6,
+            "model": self.rng.randint(1, 160),
+            "stepping": self.rng.randint(0, 12),
+            "l2cache_kb": 256,
+            "l3cache_kb": self.rng.choice([3072, 6144, 8192]),
+            "speed_m_hz": self.rng.choice([1800, 2400, 3200]),
+            "extensions": CPU_EXTENSIONS[: self.rng.randint(3, len(CPU_EXTENSIONS))],
+        }
+
+    def histograms(self):
+        """Return {histogram: JSON string or None} for HISTOGRAMS."""
+        rng = self.rng
+        profile = self.profile
+        values = dict.fromkeys(HISTOGRAMS)
+        if rng.random() < profile.tdr_rate:
+            values["DEVICE_RESET_REASON"] = _histogram(rng, 11, [rng.randint(1, 7)])
+        if rng.random() < profile.sanity_test_rate:
+            values["GRAPHICS_SANITY_TEST"] = _histogram(
+                rng, 21, [rng.choice([0, 0, 0, 1, 2, 3, 4])]
+            )
+            values["GRAPHICS_SANITY_TEST_REASON"] = _histogram(
+                rng, 21, [rng.randint(0, 3)]
+            )
+        values["GRAPHICS_DRIVER_STARTUP_TEST"] = _histogram(
+            rng, 21, [rng.choice([0, 0, 0, 1, 2])]
+        )
+        if rng.random() < 0.3:
+            values["CANVAS_WEBGL_SUCCESS"] = _histogram(
+                rng, 3, [rng.choice([1, 1, 1, 0])]
+            )
+            values["CANVAS_WEBGL2_SUCCESS"] = _histogram(
+                rng, 3, [rng.choice([1, 1, 0])]
+            )
+        if rng.random() < 0.1:
+            values["PLUGIN_DRAWING_MODEL"] = _histogram(rng, 13, [rng.randint(0, 5)])
+        if rng.random() < 0.2:
+            values["MEDIA_DECODER_BACKEND_USED"] = _histogram(
+                rng, 11, [rng.randint(0, 6)]
+            )
+        return values
+
+    def keyed_histograms(self):
+        """Return {keyed histogram: [{key, value}]} for KEYED_HISTOGRAMS."""
+        values = {name: [] for name in KEYED_HISTOGRAMS}
+        if self.rng.random() < self.profile.failure_rate:
+            name = self.rng.choice(KEYED_HISTOGRAMS)
+            values[name] = [
+                {"key": self.failure_id(self.rng), "value": _count_histogram(1)}
+            ]
+        return values
+
+
+def dashboard_rows(
+    count,
+    profile=DEFAULT_PROFILE,
+    seed=0,
+    start_date=datetime.datetime(2020, 8, 1),
+    days=14,
+    additional_properties=False,
+):
+    """Yield `count` rows of dashboard.fetch_results.
+
+    With `additional_properties`, the rows carry the whole additional
+    properties blob, as the query did before only `additional_gfx` was
+    extracted from it in SQL.
+    """
+    g = Generator(profile, seed)
+    rng = g.rng
+    for _ in range(count):
+        os_name, os_version, service_pack = g.os(rng)
+        adapters = g.adapters()
+        features = g.features(os_name)
+        monitors = g.monitors()
+        gfx = {
+            "d2d_enabled": os_name == "Windows_NT",
+            "d_write_enabled": os_name == "Windows_NT",
+            "adapters": adapters,
+            "monitors": monitors,
+            "features": features,
+        }
+        extra_gfx = {
+            "adapters": [{"driverVendor": "mesa" if os_name == "Linux" else None}],
+            "ContentBackend": "Skia",
+        }
+
+        row = {
+            "client_id": g.client_id(),
+            "creation_date": g.creation_date(start_date, days),
+        }
+        if additional_properties:
+            row["additional_properties"] = json.dumps(
+                {
+                    "environment": {"system": {"gfx": extra_gfx}},
+                    "payload": {
+                        "simpleMeasurements": {"start": rng.randint(100, 2000)}
+                    },
+                }
+            )
+        else:
+            row["additional_gfx"] = json.dumps(extra_gfx)
+        row.update(
+            {
+                "environment__build__version": g.version(rng),
+                "environment__build__build_id": "20200801000000",
+                "environment__system__memory_mb": rng.choice(
+                    [2048, 4096, 8192, 16384, 32768]
+                ),
+                "environment__system__is_wow64": rng.random() < 0.1,
+                "environment__system__cpu": g.cpu(),
+                "environment__system__os__name": os_name,
+                "environment__system__os__version": os_version,
+                "environment__system__os__service_pack_major": service_pack,
+                "environment__system__gfx__adapters": adapters,
+                "payload__info__revision": "https://hg.mozilla.org/releases/mozilla-release/rev/0",
+                "environment__system__gfx": gfx,
+                "environment__system__gfx__monitors": monitors,
+                "environment__build__architecture": rng.choice(
+                    ["x86-64", "x86-64", "x86"]
+                ),
+                "environment__system__gfx__features": features,
+            }
+        )
+        histograms = g.histograms()
+        keyed_histograms = g.keyed_histograms()
+        for prefix in ("payload__", "payload__processes__content__"):
+            for name in HISTOGRAMS:
+                # Content process histograms are rarer than parent ones.
+                value = (
+                    histograms[name]
+                    if prefix == "payload__" or rng.random() < 0.1
+                    else None
+                )
+                row["{}histograms__{}".format(prefix, name)] = value
+        for prefix in ("payload__", "payload__processes__content__"):
+            for name in KEYED_HISTOGRAMS:
+                value = keyed_histograms[name] if prefix == "payload__" else []
+                row["{}keyed_histograms__{}".format(prefix, name)] = value
+        yield row
+
+
+def trends_rows(
+    count,
+    profile=DEFAULT_PROFILE,
+    seed=0,
+    start_date=datetime.datetime(2020, 8, 2),
+    weeks=1,
+    by_week=False,
+):
+    """Yield `count` rows of trends.fetch_results over `weeks` weeks.
+
+    With `by_week`, rows have the `week_start` column of a by_week fetch.
+    """
+    g = Generator(profile, seed)
+    rng = g.rng
+    for _ in range(count):
+        os_name, os_version, service_pack = g.os(rng)
+        row = {
+            "client_id": g.client_id(),
+            "creation_date": g.creation_date(start_date, weeks * 7),
+            "architecture": rng.choice(["x86-64", "x86-64", "x86"]),
+            "build_version": g.version(rng),
+            "is_wow64": rng.random() < 0.1,
+            "cpu": g.cpu(),
+            "adapters": g.adapters(),
+            "features": g.features(os_name),
+            "name": os_name,
+            "os_version": os_version,
+            "service_pack_major": service_pack,
+        }
+        if by_week:
+            week = rng.randrange(weeks)
+            row["week_start"] = (start_date + datetime.timedelta(weeks=week)).date()
+        yield row
+
+
+def _schemas():
+    import pyarrow as pa
+
+    adapter = pa.struct(
+        [
+            ("description", pa.string()),
+            ("vendor_id", pa.string()),
+            ("device_id", pa.string()),
+            ("subsys_id", pa.string()),
+            ("ram", pa.int64()),
+            ("driver", pa.string()),
+            ("driver_version", pa.string()),
+            ("driver_date", pa.string()),
+            ("gpu_active", pa.bool_()),
+        ]
+    )
+    status = pa.struct([("status", pa.string())])
+    features = pa.struct(
+        [
+            ("compositor", pa.string()),
+            ("gpu_process", status),
+            (
+                "d3d11",
+                pa.struct(
+                    [
+                        ("status", pa.string()),
+                        ("warp", pa.bool_()),
+                        ("texture_sharing", pa.bool_()),
+                        ("version", pa.int64()),
+                        ("blacklisted", pa.bool_()),
+                    ]
+                ),
+            ),
+            ("d2d", pa.struct([("status", pa.string()), ("version", pa.string())])),
+            ("advanced_layers", status),
+        ]
+    )
+    monitor = pa.struct(
+        [
+            ("screen_width", pa.int64()),
+            ("screen_height", pa.int64()),
+            ("refresh_rate", pa.int64()),
+            ("pseudo_display", pa.bool_()),
+            ("scale", pa.float64()),
+        ]
+    )
+    cpu = pa.struct(
+        [(name, pa.int64()) for name in ("count", "cores")]
+        + [("vendor", pa.string())]
+        + [
+            (name, pa.int64())
+            for name in (
+                "family",
+                "model",
+                "stepping",
+                "l2cache_kb",
+                "l3cache_kb",
+                "speed_m_hz",
+            )
+        ]
+        + [("extensions", pa.list_(pa.string()))]
+    )
+    return adapter, features, monitor, cpu
+
+
+def dashboard_schema(additional_properties=False):
+    """Return the pyarrow schema of dashboard_rows."""
+    import pyarrow as pa
+
+    adapter, features, monitor, cpu = _schemas()
+    gfx = pa.struct(
+        [
+            ("d2d_enabled", pa.bool_()),
+            ("d_write_enabled", pa.bool_()),
+            ("adapters", pa.list_(adapter)),
+            ("monitors", pa.list_(monitor)),
+            ("features", features),
+        ]
+    )
+    keyed = pa.list_(pa.struct([("key", pa.string()), ("value", pa.string())]))
+    fields = [
+        ("client_id", pa.string()),
+        ("creation_date", pa.string()),
+        (
+            "additional_properties" if additional_properties else "additional_gfx",
+            pa.string(),
+        ),
+        ("environment__build__version", pa.string()),
+        ("environment__build__build_id", pa.string()),
+        ("environment__system__memory_mb", pa.int64()),
+        ("environment__system__is_wow64", pa.bool_()),
+        ("environment__system__cpu", cpu),
+        ("environment__system__os__name", pa.string()),
+        ("environment__system__os__version", pa.string()),
+        ("environment__system__os__service_pack_major", pa.int64()),
+        ("environment__system__gfx__adapters", pa.list_(adapter)),
+        ("payload__info__revision", pa.string()),
+        ("environment__system__gfx", gfx),
+        ("environment__system__gfx__monitors", pa.list_(monitor)),
+        ("environment__build__architecture", pa.string()),
+        ("environment__system__gfx__features", features),
+    ]
+    for prefix in ("payload__", "payload__processes__content__"):
+        fields += [
+            ("{}histograms__{}".format(prefix, name), pa.string())
+            for name in HISTOGRAMS
+        ]
+    for prefix in ("payload__", "payload__processes__content__"):
+        fields += [
+            ("{}keyed_histograms__{}".format(prefix, name), keyed)
+            for name in KEYED_HISTOGRAMS
+        ]
+    return pa.schema(fields)
+
+
+def trends_schema(by_week=False):
+    """Return the pyarrow schema of trends_rows."""
+    import pyarrow as pa
+
+    adapter, features, monitor, cpu = _schemas()
+    fields = [
+        ("client_id", pa.string()),
+        ("creation_date", pa.string()),
+        ("architecture", pa.string()),
+        ("build_version", pa.string()),
+        ("is_wow64", pa.bool_()),
+        ("cpu", cpu),
+        ("adapters", pa.list_(adapter)),
+        ("features", features),
+        ("name", pa.string()),
+        ("os_version", pa.string()),
+        ("service_pack_major", pa.int64()),
+    ]
+    if by_week:
+        fields.append(("week_start", pa.date32()))
+    return pa.schema(fields)
+
+
+def _json_default(value):
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    raise TypeError(repr(value))
+
+
+def write_rows(
+    rows,
+    directory,
+    format=PARQUET,
+    schema=None,
+    rows_per_file=1000000,
+    batch_size=10000,
+):
+    """Write rows to `directory` as part-NNNNN files and return their paths.
+
+    Rows are consumed `batch_size` at a time, so that only one batch is held
+    in memory, and each file holds up to `rows_per_file` rows, one Spark
+    partition when read by sources.LocalSource. Parquet files have the
+    pyarrow `schema`, by default the one inferred from the first batch.
+    """
+    os.makedirs(directory, exist_ok=True)
+    rows = iter(rows)
+    paths = []
+    while True:
+        first = list(itertools.islice(rows, min(batch_size, rows_per_file)))
+        if not first:
+            return paths
+        path = os.path.join(directory, "part-{:05d}{}".format(len(paths), format))
+        batches = _file_batches(first, rows, rows_per_file, batch_size)
+        if format == PARQUET:
+            written = _write_parquet(path, batches, schema)
+        elif format == JSONL:
+            written = _write_jsonl(path, batches)
+        else:
+            raise ValueError("unsupported format: {}".format(format))
+        paths.append(path)
+        if written < rows_per_file:
+            return paths
+
+
+def _file_batches(first, rows, rows_per_file, batch_size):
+    yield first
+    remaining = rows_per_file - len(first)
+    while remaining > 0:
+        batch = list(itertools.islice(rows, min(batch_size, remaining)))
+        if not batch:
+            return
+        remaining -= len(batch)
+        yield batch
+
+
+def _write_parquet(path, batches, schema=None):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    written = 0
+    writer = None
+    try:
+        for batch in batches:
+            table = pa.Table.from_pylist(batch, schema=schema)
+            if writer is None:
+                schema = table.schema
+                writer = pq.ParquetWriter(path, schema)
+            writer.write_table(table)
+            written += len(batch)
+    finally:
+        if writer is not None:
+            writer.close()
+    return written
+
+
+def _write_jsonl(path, batches):
+    written = 0
+    with open(path, "w") as fp:
+        for batch in batches:
+            for row in batch:
+                fp.write(json.dumps(row, default=_json_default))
+                fp.write("\n")
+            written += len(batch)
+    return written
+
+
+def _last_sunday(date):
+    return date - datetime.timedelta(days=(date.weekday() + 1) % 7)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Write synthetic query results for sources.LocalSource."
+    )
+    parser.add_argument("query", choices=["dashboard", "trends"])
+    parser.add_argument("count", type=int)
+    parser.add_argument("path", help="LocalSource directory")
+    parser.add_argument("--format", choices=["parquet", "jsonl"], default="parquet")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--rows-per-file", type=int, default=1000000)
+    parser.add_argument("--table-id")
+    parser.add_argument("--profile", help="JSON file of a Profile, see load_profile")
+    parser.add_argument(
+        "--start-date",
+        type=lambda s: datetime.datetime.strptime(s, "%Y-%m-%d"),
+        help="first day of the pings, YYYY-MM-DD; by default the pings end "
+        "today, or on the last Sunday for trends",
+    )
+    parser.add_argument("--days", type=int, default=14, help="days of dashboard pings")
+    parser.add_argument("--weeks", type=int, default=1, help="weeks of trends pings")
+    parser.add_argument(
+        "--by-week",
+        action="store_true",
+        help="give trends rows the week_start column of a by_week fetch",
+    )
+    parser.add_argument(
+        "--additional-properties",
+        action="store_true",
+        help="give dashboard rows the whole additional_properties blob",
+    )
+    args = parser.parse_args(argv)
+
+    profile = load_profile(args.profile) if args.profile else DEFAULT_PROFILE
+    today = datetime.datetime.combine(datetime.date.today(), datetime.time())
+    if args.query == "dashboard":
+        start_date = args.start_date or today - datetime.timedelta(days=args.days)
+        rows = dashboard_rows(
+            args.count,
+            profile,
+            seed=args.seed,
+            start_date=start_date,
+            days=args.days,
+            additional_properties=args.additional_properties,
+        )
+        schema = dashboard_schema(args.additional_properties)
+        table_id = args.table_id or "graphics_telemetry_dashboard_tmp"
+    else:
+        start_date = args.start_date or _last_sunday(today) - datetime.timedelta(
+            weeks=args.weeks
+        )
+        if args.by_week and start_date.weekday() != 6:
+            parser.error("--start-date must be a Sunday with --by-week")
+        rows = trends_rows(
+            args.count,
+            profile,
+            seed=args.seed,
+            start_date=start_date,
+            weeks=args.weeks,
+            by_week=args.by_week,
+        )
+        schema = trends_schema(args.by_week)
+        table_id = args.table_id or "graphics_telemetry_trends_tmp"
+
+    paths = write_rows(
+        rows,
+        os.path.join(args.path, table_id),
+        format="." + args.format,
+        schema=schema,
+        rows_per_file=args.rows_per_file,
+    )
+    print(
+        "Wrote {} rows to {} files under {}".format(args.count, len(paths), args.path)
+    )
+
+
+if __name__ == "__main__":
+    main()
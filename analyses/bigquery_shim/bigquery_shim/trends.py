@@ -1,5 +1,7 @@
-from .snake_case import convert_snake_case_dict
-from google.cloud import bigquery
+import datetime
+
+from . import sampling
+from .snake_case import add_known_keys, convert_snake_case_dict
 
 ArchKey = "environment/build/architecture"
 FxVersionKey = "environment/build/version"
@@ -10,18 +12,66 @@ GfxFeaturesKey = "environment/system/gfx/features"
 OSNameKey = "environment/system/os/name"
 OSVersionKey = "environment/system/os/version"
 OSServicePackMajorKey = "environment/system/os/servicePackMajor"
+WeekStartKey = "weekStart"
+add_known_keys(
+    [
+        "clientId",
+        "creationDate",
+        ArchKey,
+        FxVersionKey,
+        Wow64Key,
+        CpuKey,
+        GfxAdaptersKey,
+        GfxFeaturesKey,
+        OSNameKey,
+        OSVersionKey,
+        OSServicePackMajorKey,
+        WeekStartKey,
+    ]
+)
 
 FORMAT_DS = "%Y-%m-%d"
 
 
 def fetch_results(
     spark,
+    data_source,
     start_date,
     end_date,
-    project_id="mozdata",
-    dataset_id="tmp",
+    fraction=0.003,
     table_id="graphics_telemetry_trends_tmp",
+    use_arrow=False,
+    by_week=False,
 ):
+    """Run the trends query and load its results as to_dataset pings.
+
+    The query is run by `data_source`, a sources.DataSource. With
+    `use_arrow`, the results are read as Arrow record batches instead of
+    Spark Rows. A deterministic `fraction` of clients is sampled, see sampling.py.
+
+    With `by_week`, all the weeks from `start_date` to `end_date`, which
+    must be Sundays, are fetched in a single scan. Each ping then has the
+    Sunday its week starts on under WeekStartKey. As when fetching one week
+    at a time from Sunday to Sunday, pings submitted on a Sunday belong to
+    both weeks it bounds.
+    """
+    week_filter = ""
+    if by_week:
+        from_clause = """,
+  week_start
+  FROM `moz-fx-data-shared-prod.telemetry_stable.main_v4`
+  CROSS JOIN UNNEST(IF(
+    EXTRACT(DAYOFWEEK FROM DATE(submission_timestamp)) = 1,
+    [DATE(submission_timestamp), DATE_SUB(DATE(submission_timestamp), INTERVAL 7 DAY)],
+    [DATE_TRUNC(DATE(submission_timestamp), WEEK(SUNDAY))])) AS week_start"""
+        week_filter = """ AND
+  week_start >= '{}' AND week_start < '{}'""".format(
+            start_date.strftime(FORMAT_DS), end_date.strftime(FORMAT_DS)
+        )
+    else:
+        from_clause = """
+  FROM `moz-fx-data-shared-prod.telemetry_stable.main_v4`"""
+
     query = """
   SELECT client_id,
   creation_date,
@@ -33,34 +83,23 @@ def fetch_results(
   environment.system.gfx.features,
   environment.system.os.name,
   environment.system.os.version as os_version,
-  environment.system.os.service_pack_major
-  FROM `moz-fx-data-shared-prod.telemetry_stable.main_v4` WHERE
-  sample_id = 42 AND
+  environment.system.os.service_pack_major{} WHERE
+  {} AND
   date(submission_timestamp) >= '{}' AND date(submission_timestamp) <= '{}' AND
-  CAST(SPLIT(application.version, '.')[OFFSET(0)] AS INT64) > 53 AND
-  MOD(CAST(RAND()*10 AS INT64), 10) <3
+  CAST(SPLIT(application.version, '.')[OFFSET(0)] AS INT64) > 53{}
   """.format(
-        start_date.strftime(FORMAT_DS), end_date.strftime(FORMAT_DS)
+        from_clause,
+        sampling.sample_filter(fraction),
+        start_date.strftime(FORMAT_DS),
+        end_date.strftime(FORMAT_DS),
+        week_filter,
     )
 
-    bq = bigquery.Client(project=project_id)
-    # We need to explicitly specify destination table since the query result is smaller than 10MB, otherwise we could omit next 4 lines
-    table_ref = bq.dataset(dataset_id, project=project_id).table(table_id)
-    job_config = bigquery.QueryJobConfig()
-    job_config.destination = table_ref
-    job_config.write_disposition = "WRITE_TRUNCATE"
-
-    query_job = bq.query(query, job_config=job_config)
-    # Wait for query execution
-    result = query_job.result()
-    return (
-        spark.read.format("bigquery")
-        .option("project", project_id)
-        .option("dataset", query_job.destination.dataset_id)
-        .option("table", query_job.destination.table_id)
-        .load()
-        .rdd.map(to_dataset)
-    )
+    if use_arrow:
+        from . import arrow
+
+        return data_source.fetch(spark, query, table_id, arrow.convert_trends_batch)
+    return data_source.fetch(spark, query, table_id).map(to_dataset)
 
 
 def to_dataset(ping):
@@ -78,4 +117,32 @@ def to_dataset(ping):
     # fixme os_version
     o[OSVersionKey] = ping.os_version
     o[OSServicePackMajorKey] = ping.service_pack_major
-    return convert_snake_case_dict(o)
+    if hasattr(ping, "week_start"):
+        o[WeekStartKey] = to_date(ping.week_start)
+    return convert_snake_case_dict(o, lazy=True)
+
+
+def in_week(ping, week_start):
+    """Whether a by_week ping belongs to the week starting on `week_start`.
+
+    Pings without a week start, such as those of local results written
+    without a week_start column, are placed by their creation date, Sundays
+    belonging to both of the weeks they bound as in the query.
+    """
+    if WeekStartKey in ping:
+        return ping[WeekStartKey] == week_start
+    created = to_date(ping["creationDate"])
+    return week_start <= created <= week_start + datetime.timedelta(7)
+
+
+def to_date(value):
+    """Return a week_start value as a datetime.date.
+
+    BigQuery and Parquet give dates, but JSON lines results give ISO strings,
+    or timestamps when pyarrow infers them.
+    """
+    if value is None or type(value) is datetime.date:
+        return value
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    return datetime.datetime.strptime(value[:10], FORMAT_DS).date()
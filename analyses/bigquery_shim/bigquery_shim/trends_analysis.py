@@ -0,0 +1,869 @@
+"""Analyses of the graphics telemetry trends.
+
+The trends of graphics-telemetry-trends-db and the backfill driving their
+updates, taking the `engine.Engine` they run on and their `Options` as
+parameters rather than reading notebook globals. Names are those of the
+notebook.
+
+Trends fingerprint the source of the functions computing their data points,
+see TrendFingerprint, so that changing them recomputes the weeks they
+computed.
+"""
+
+import copy
+import datetime
+import hashlib
+import inspect
+import io
+import json
+import os
+import textwrap
+import time
+import tokenize
+import types
+
+from . import aggregate, devices, sources, trends
+from .engine import Prof
+from .trends import (
+    ArchKey,
+    FxVersionKey,
+    GfxAdaptersKey,
+    GfxFeaturesKey,
+    OSNameKey,
+    OSServicePackMajorKey,
+    OSVersionKey,
+    Wow64Key,
+)
+
+GITHUB_REPO = "https://raw.githubusercontent.com/FirefoxGraphics/moz-gfx-telemetry"
+
+
+class Options(object):
+    """Configuration of a trends update, see the trends notebook."""
+
+    def __init__(
+        self,
+        path,
+        fraction=0.003,
+        max_history=datetime.timedelta(days=210),
+        s3_bucket=None,
+        github_repo=GITHUB_REPO,
+        use_arrow=False,
+        local_data_path=None,
+        brand_new_jobs=(),
+        force_max_backfill=False,
+        weeks_per_scan=4,
+        backfill_concurrency=4,
+        device_database_path=None,
+    ):
+        # Directory the trend indexes and shards are read from and written to.
+        self.path = path
+        self.fraction = fraction
+        # Weeks starting before this date are never queried.
+        self.first_valid_date = datetime.datetime.utcnow() - max_history
+        self.s3_bucket = s3_bucket
+        self.github_repo = github_repo
+        self.use_arrow = use_arrow
+        self.local_data_path = local_data_path
+        self.brand_new_jobs = list(brand_new_jobs)
+        self.force_max_backfill = force_max_backfill
+        self.weeks_per_scan = weeks_per_scan
+        self.backfill_concurrency = backfill_concurrency
+        if device_database_path is None:
+            device_database_path = os.path.join(path, "gfxdevices.json")
+        self.device_database_path = device_database_path
+
+
+def fmt_date(d):
+    return d.strftime("%Y%m%d")
+
+
+def jstime(d):
+    return time.mktime(d.timetuple())
+
+
+# This is the entry-point to grabbing reduced, preformatted pings.
+def FetchAndFormat(engine, options, start_date, end_date, data_source):
+    return FormatPings(GetRawPings(engine, options, start_date, end_date, data_source))
+
+
+# Same as moztelemetry's get_one_ping_per_client, with the RDD operations
+# that engines support.
+def get_one_ping_per_client(pings):
+    pings = pings.filter(lambda p: "clientId" in p)
+    pings = pings.map(lambda p: (p["clientId"], p))
+    return pings.reduceByKey(lambda p1, p2: p1).map(lambda kv: kv[1])
+
+
+def FormatPings(pings):
+    pings = get_one_ping_per_client(pings)
+    pings = pings.map(Validate)
+    pings = pings.filter(lambda p: p.get("valid", False) == True)
+    return pings.cache()
+
+
+# Each source writes its query results to tables of its own, which are
+# deleted when it is closed.
+def NewPingSource(options):
+    if options.local_data_path:
+        return sources.LocalSource(options.local_data_path)
+    return sources.BigQuerySource()
+
+
+def GetRawPings(engine, options, start_date, end_date, data_source, by_week=False):
+    return trends.fetch_results(
+        engine.spark,
+        data_source,
+        start_date,
+        end_date,
+        fraction=options.fraction,
+        use_arrow=options.use_arrow,
+        by_week=by_week,
+    )
+
+
+# Transform each ping to make it easier to work with in later stages.
+def Validate(p):
+    try:
+        name = p.get(OSNameKey) or "w"
+        version = p.get(OSVersionKey) or "0"
+        if name == "Linux":
+            p["OSVersion"] = None
+            p["OS"] = "Linux"
+            p["OSName"] = "Linux"
+        elif name == "Windows_NT":
+            spmaj = p.get(OSServicePackMajorKey) or "0"
+            p["OSVersion"] = version + "." + str(spmaj)
+            p["OS"] = "Windows-" + version + "." + str(spmaj)
+            p["OSName"] = "Windows"
+        elif name == "Darwin":
+            p["OSVersion"] = version
+            p["OS"] = "Darwin-" + version
+            p["OSName"] = "Darwin"
+        else:
+            p["OSVersion"] = version
+            p["OS"] = "{0}-{1}".format(name, version)
+            p["OSName"] = name
+    except:
+        return p
+
+    p["valid"] = True
+    return p
+
+
+# Helpers.
+def fix_vendor(vendorID):
+    if vendorID == "Intel Open Source Technology Center":
+        return "0x8086"
+    return vendorID
+
+
+def get_vendor(ping):
+    try:
+        adapter = ping[GfxAdaptersKey][0]
+        return fix_vendor(adapter["vendorID"])
+    except:
+        return "unknown"
+
+
+# A TrendBase encapsulates the data needed to visualize a trend.
+# It has four functions:
+#    prepare    (download from cache)
+#    willUpdate (check if update is needed)
+#    update     (add analysis data for a week of pings)
+#    finish     (upload back to cache)
+class TrendBase(object):
+    def __init__(self, name):
+        super(TrendBase, self).__init__()
+        self.name = "{0}-v2.json".format(name)
+        self.options = None
+
+    # Called before analysis starts.
+    def prepare(self, engine, options):
+        print("Preparing {0}".format(self.name))
+        self.options = options
+        return True
+
+    # Called before querying pings for the week for the given date. Return
+    # false to indicate that this should no longer receive updates.
+    def willUpdate(self, date):
+        raise Exception("Return true or false")
+
+    def update(self, pings, **kwargs):
+        raise Exception("NYI")
+
+    def finish(self):
+        pass
+
+
+# Given a list of trend objects, query weeks from the last sunday
+# and iterating backwards until no trend object requires an update.
+def DoUpdate(engine, options, trends):
+    root = TrendGroup("root", trends)
+    root.prepare(engine, options)
+
+    # Start each analysis slice on a Sunday.
+    latest = MostRecentSunday()
+    assert latest.weekday() == 6
+
+    # Runs of weeks_per_scan weeks are each fetched by a single query, and
+    # fetched concurrently, but weeks are computed one at a time and in
+    # order, since trends stop updating as they reach their cached data.
+    weeks = PlanWeeks(root, latest)
+    scans = [
+        weeks[i : i + options.weeks_per_scan]
+        for i in range(0, len(weeks), options.weeks_per_scan)
+    ]
+
+    def fetch(scan):
+        return FetchWeeks(engine, options, scan)
+
+    fetched_scans = sources.prefetch(
+        scans, fetch, options.backfill_concurrency, release=ReleaseWeeks
+    )
+    try:
+        for scan, fetched in fetched_scans:
+            try:
+                raw_pings, source = fetched.result()
+            except:
+                if not options.force_max_backfill:
+                    raise
+                print(
+                    "Skipping weeks from {0}, their fetch failed and their "
+                    "previous data is kept".format(scan[-1][0])
+                )
+                continue
+
+            with source:
+                updating = ComputeWeeks(root, scan, raw_pings)
+                raw_pings.unpersist()
+            if not updating:
+                break
+    finally:
+        # Wait for the fetches still running, and release what they fetched.
+        fetched_scans.close()
+
+    root.finish()
+
+
+# Update the trends with each of |weeks|, taking their pings from a by_week
+# fetch, see trends.in_week. Returns false once no trend needs more data.
+def ComputeWeeks(root, weeks, raw_pings):
+    for start, end in weeks:
+        if not root.willUpdate(start):
+            return False
+
+        week = start.date()
+        pings = FormatPings(raw_pings.filter(lambda p: trends.in_week(p, week)))
+        with Prof("compute {0}".format(start)) as _:
+            updated = root.update(pings, start_date=start, end_date=end)
+        pings.unpersist()
+        if not updated:
+            return False
+    return True
+
+
+# Work out the (start, end) of every week that some trend needs, most
+# recent first.
+def PlanWeeks(root, latest):
+    # willUpdate drops trends that need no more data, so plan on a copy.
+    root = copy.deepcopy(root)
+    weeks = []
+    end = latest
+    while True:
+        start = end - datetime.timedelta(7)
+        if not root.willUpdate(start):
+            break
+        weeks.append((start, end))
+        end = start
+    return weeks
+
+
+# Fetch and load the raw pings of consecutive weeks, most recent first, in
+# one query. Returns them along with the source holding the query results,
+# which must be closed once they are used.
+def FetchWeeks(engine, options, weeks):
+    start = weeks[-1][0]
+    end = weeks[0][1]
+    source = NewPingSource(options)
+    try:
+        with Prof("fetch {0} to {1}".format(start, end)) as _:
+            pings = GetRawPings(
+                engine, options, start, end, source, by_week=True
+            ).cache()
+            pings.count()
+    except:
+        source.cleanup()
+        raise
+    return pings, source
+
+
+# Release the pings and source returned by FetchWeeks for weeks that end up
+# not being computed.
+def ReleaseWeeks(fetched):
+    raw_pings, source = fetched
+    raw_pings.unpersist()
+    source.cleanup()
+
+
+def MostRecentSunday():
+    now = datetime.datetime.utcnow()
+    this_morning = datetime.datetime(now.year, now.month, now.day)
+    if this_morning.weekday() == 6:
+        return this_morning
+    diff = datetime.timedelta(0 - this_morning.weekday() - 1)
+    return this_morning + diff
+
+
+# A TrendGroup is a collection of TrendBase objects. It lets us
+# group similar trends together. For example, if five trends all
+# need to filter Windows pings, we can filter for Windows pings
+# once and cache the result, rather than redo the filter each
+# time.
+#
+# Trend groups keep an "active" list of trends that will probably
+# need another update. If any trend stops requesting data, it is
+# removed from the active list.
+class TrendGroup(TrendBase):
+    def __init__(self, name, trends):
+        super(TrendGroup, self).__init__(name)
+        self.trends = trends
+        self.active = []
+
+    def prepare(self, engine, options):
+        self.options = options
+        self.trends = [trend for trend in self.trends if trend.prepare(engine, options)]
+        self.active = self.trends[:]
+        return len(self.trends) > 0
+
+    def willUpdate(self, date):
+        self.active = [trend for trend in self.active if trend.willUpdate(date)]
+        return len(self.active) > 0
+
+    def update(self, pings, **kwargs):
+        pings = pings.cache()
+
+        # Trends with a key function are all computed in a single pass.
+        fused = [
+            trend
+            for trend in self.active
+            if isinstance(trend, Trend) and trend.key is not None
+        ]
+        updated = {
+            trend: True
+            for trend in fused
+            if not trend.needsUpdate(kwargs["start_date"])
+        }
+        fused = [trend for trend in fused if trend not in updated]
+        if fused:
+            with Prof("query {0} ({1} trends)".format(self.name, len(fused))):
+                counts = aggregate.aggregate(
+                    pings,
+                    [
+                        aggregate.metric(str(index), trend.key, trend.accept)
+                        for index, trend in enumerate(fused)
+                    ],
+                )
+            for index, trend in enumerate(fused):
+                updated[trend] = trend.addDataPoint(counts[str(index)], **kwargs)
+
+        self.active = [
+            trend
+            for trend in self.active
+            if (updated[trend] if trend in updated else trend.update(pings, **kwargs))
+        ]
+        return len(self.active) > 0
+
+    def finish(self):
+        for trend in self.trends:
+            trend.finish()
+
+
+# A Trend object takes a new set of pings for a week's worth of data,
+# analyzes it, and adds the result to the trend set. Trend sets are
+# cached in S3 as JSON, one shard per year, <filename>/<YYYY>.json, holding
+# the data points of the weeks starting that year, listed by an index,
+# <filename>-index.json. Updates only read the index and rewrite the shards
+# of the years they queried.
+#
+# If the latest entry in the cache covers less than a full week of
+# data, the entry is removed so that week can be re-queried.
+#
+# Each week also records the fingerprint of the code that computed it, see
+# TrendFingerprint. Weeks computed by a different version of a trend are
+# re-queried, so changing a trend only backfills that trend.
+#
+# A trend either implements query(), returning the counts for a week of
+# pings, or key(), returning the key a ping is counted under. Trends with a
+# key() are computed together with the other such trends of their group in
+# a single pass over the pings, and may restrict the pings they count with
+# accept().
+class Trend(TrendBase):
+    key = None
+    accept = None
+    # Part of the fingerprint; bump it to recompute a trend whose data points
+    # change for reasons its own code doesn't show, e.g. a change to
+    # FormatPings or to the update() of its group.
+    version = 1
+
+    def __init__(self, filename):
+        super(Trend, self).__init__(filename)
+        self.index_name = "{0}-index.json".format(filename)
+        self.shard_dir = filename
+        self.index = None
+        self.lastFullWeek = None
+        self.newDataPoints = []
+        self.unshardedDataPoints = []
+        self.fingerprint = None
+        self.fingerprints = {}
+        self.oldestStaleWeek = None
+
+    def query(self, pings):
+        if self.key is None:
+            raise Exception("NYI")
+        return pings.map(lambda p: (self.key(p),)).countByKey()
+
+    def willUpdate(self, date):
+        if date < self.options.first_valid_date:
+            return False
+        if self.lastFullWeek is None or date > self.lastFullWeek:
+            return True
+        # Keep going while there are older weeks to recompute.
+        return self.oldestStaleWeek is not None and date >= self.oldestStaleWeek
+
+    # Whether the week starting at |date| is missing or was computed by a
+    # different version of the trend.
+    def needsUpdate(self, date):
+        if self.lastFullWeek is None or date > self.lastFullWeek:
+            return True
+        return self.fingerprints.get(jstime(date)) != self.fingerprint
+
+    # Optional hook - other functions and data that the data points depend
+    # on, such as helper functions, to include in the fingerprint.
+    def dependencies(self):
+        return []
+
+    def prepare(self, engine, options):
+        self.options = options
+        self.index = self.read_json(self.index_name)
+        if self.index is None:
+            self.index = self.migrate()
+
+        # Make sure weeks are sorted in ascending order.
+        self.index["weeks"] = sorted(self.index["weeks"], key=lambda o: o["start"])
+
+        # Weeks from before fingerprints were recorded are assumed current.
+        self.fingerprint = TrendFingerprint(self)
+        for entry in self.index["weeks"]:
+            entry.setdefault("fingerprint", self.fingerprint)
+
+        if len(self.index["weeks"]) and not options.force_max_backfill:
+            lastDataPoint = self.index["weeks"][-1]
+            lastDataPointStart = datetime.datetime.utcfromtimestamp(
+                lastDataPoint["start"]
+            )
+            lastDataPointEnd = datetime.datetime.utcfromtimestamp(lastDataPoint["end"])
+            print(lastDataPoint, lastDataPointStart, lastDataPointEnd)
+            if lastDataPointEnd - lastDataPointStart < datetime.timedelta(7):
+                # The last data point had less than a full week, so we stop at the
+                # previous week, and remove the incomplete datapoint.
+                self.lastFullWeek = lastDataPointStart - datetime.timedelta(7)
+                self.index["weeks"].pop()
+            else:
+                # The last data point covered a full week, so that's our stopping
+                # point.
+                self.lastFullWeek = lastDataPointStart
+                print(self.lastFullWeek)
+
+        self.fingerprints = {
+            entry["start"]: entry["fingerprint"] for entry in self.index["weeks"]
+        }
+        stale = [
+            start
+            for start, fingerprint in self.fingerprints.items()
+            if fingerprint != self.fingerprint
+        ]
+        if stale:
+            self.oldestStaleWeek = datetime.datetime.utcfromtimestamp(min(stale))
+            print(
+                "{0}: recomputing {1} weeks from {2}".format(
+                    self.name, len(stale), self.oldestStaleWeek
+                )
+            )
+        return True
+
+    # Optional hook - transform pings before querying.
+    def transformPings(self, pings):
+        if self.accept is not None:
+            return pings.filter(self.accept)
+        return pings
+
+    def update(self, pings, start_date, end_date, **kwargs):
+        if not self.needsUpdate(start_date):
+            return True
+
+        with Prof("count {0}".format(self.name)):
+            pings = self.transformPings(pings)
+            count = pings.count()
+        if count == 0:
+            print("WARNING: no pings in RDD")
+            return False
+
+        with Prof("query {0} (count: {1})".format(self.name, count)):
+            data = self.query(pings)
+
+        return self.addDataPoint(data, start_date, end_date, total=count)
+
+    # Record the counts of a week. Every counted ping has a single key, so
+    # the total defaults to the sum of the counts.
+    def addDataPoint(self, data, start_date, end_date, total=None, **kwargs):
+        if total is None:
+            total = sum(data.values())
+        if total == 0:
+            print("WARNING: no pings for {0}".format(self.name))
+            return False
+
+        self.newDataPoints.append(
+            {
+                "start": jstime(start_date),
+                "end": jstime(end_date),
+                "total": total,
+                "data": data,
+            }
+        )
+        return True
+
+    def finish(self):
+        # Newly queried weeks replace their entries. The others, such as weeks
+        # a maximum backfill skipped because their fetch failed, are kept.
+        weeks = {entry["start"]: entry for entry in self.index["weeks"]}
+
+        # Group the queried weeks by the year shard they belong in.
+        years = {}
+        points = [
+            point for point in self.unshardedDataPoints if point["start"] in weeks
+        ]
+        for point in points + self.newDataPoints:
+            year = datetime.datetime.utcfromtimestamp(point["start"]).year
+            years.setdefault(year, []).append(point)
+
+        # Write the shards before the index, so that the index never lists a
+        # missing shard. Shards keep the points of the weeks not queried.
+        for year, points in sorted(years.items()):
+            shard = "{0}/{1}.json".format(self.shard_dir, year)
+            merged = {
+                point["start"]: point
+                for point in self.read_json(shard) or []
+                if point["start"] in weeks
+            }
+            for point in points:
+                merged[point["start"]] = point
+                weeks[point["start"]] = {
+                    "start": point["start"],
+                    "end": point["end"],
+                    "total": point["total"],
+                    "shard": shard,
+                    "fingerprint": self.fingerprint,
+                }
+            self.write_json(shard, sorted(merged.values(), key=lambda o: o["start"]))
+
+        self.index["weeks"] = sorted(weeks.values(), key=lambda o: o["start"])
+        self.write_json(self.index_name, self.index)
+
+    # Start the index of a trend that has none, from its history in the
+    # single file format (<filename>-v2.json) if there is one. Its data
+    # points are written as shards by finish().
+    def migrate(self):
+        index = {
+            "created": jstime(datetime.datetime.utcnow()),
+            "weeks": [],
+        }
+        cache = self.read_json(self.name)
+        if cache is None:
+            if self.options.s3_bucket and self.name not in self.options.brand_new_jobs:
+                raise Exception("No trend data for {0}".format(self.name))
+            return index
+
+        index["created"] = cache["created"]
+        self.unshardedDataPoints = cache["trend"] or []
+        for point in self.unshardedDataPoints:
+            index["weeks"].append(
+                {
+                    "start": point["start"],
+                    "end": point["end"],
+                    "total": point["total"],
+                }
+            )
+        return index
+
+    # Returns None if the file does not exist.
+    def read_json(self, name):
+        local_path = os.path.join(self.options.path, name)
+        print("Reading file {0}".format(local_path))
+        if self.options.s3_bucket:
+            os.system(
+                "aws s3 cp {0} {1}".format(
+                    os.path.join(self.options.s3_bucket, name), local_path
+                )
+            )
+        try:
+            with open(local_path, "r") as fp:
+                return json.load(fp)
+        except IOError:
+            return None
+
+    def write_json(self, name, obj):
+        local_path = os.path.join(self.options.path, name)
+        if not os.path.isdir(os.path.dirname(local_path)):
+            os.makedirs(os.path.dirname(local_path))
+
+        print("Writing file {0}".format(local_path))
+        with open(local_path, "w") as fp:
+            fp.write(json.dumps(obj))
+
+        if self.options.s3_bucket:
+            try:
+                os.system(
+                    "aws s3 cp {0} {1}".format(
+                        local_path, os.path.join(self.options.s3_bucket, name)
+                    )
+                )
+            except Exception as e:
+                print("Failed s3 upload: {0}".format(e))
+
+
+# Fingerprint of the code computing a trend's data points: its class name and
+# version, its key(), accept(), query() and transformPings() and its
+# dependencies(). Code shared by all trends, such as FormatPings and the
+# update() of groups, is left out so that changing it doesn't recompute every
+# week of every trend; bump the versions of the trends whose output it
+# changes instead. Functions are fingerprinted by their source without
+# comments or blank lines, so that fingerprints don't change with the version
+# of Python.
+def TrendFingerprint(trend):
+    digest = hashlib.sha1(type(trend).__name__.encode("utf-8"))
+    digest.update(repr(trend.version).encode("utf-8"))
+    parts = [trend.key, trend.accept, trend.query, trend.transformPings]
+    for part in parts + trend.dependencies():
+        part = getattr(part, "__func__", part)
+        if isinstance(part, types.FunctionType):
+            digest.update(FunctionSource(part).encode("utf-8"))
+        else:
+            digest.update(json.dumps(part, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def FunctionSource(function):
+    try:
+        source = textwrap.dedent(inspect.getsource(function))
+    except (OSError, TypeError):
+        # Functions without source, e.g. defined in an interactive session.
+        code = function.__code__
+        return repr((code.co_code, code.co_names, code.co_consts))
+    try:
+        tokens = list(tokenize.generate_tokens(io.StringIO(source).readline))
+    except (tokenize.TokenError, IndentationError, SyntaxError):
+        # The source of a lambda is its whole lines, which may not tokenize.
+        return source
+    return " ".join(
+        token.string
+        for token in tokens
+        if token.type not in (tokenize.COMMENT, tokenize.NL)
+    )
+
+
+class FirefoxTrend(Trend):
+    def __init__(self):
+        super(FirefoxTrend, self).__init__("trend-firefox")
+
+    @staticmethod
+    def key(p):
+        v = p.get(FxVersionKey, None)
+        if v is None or not isinstance(v, str):
+            return "unknown"
+        return v.split(".")[0]
+
+
+class WindowsGroup(TrendGroup):
+    def __init__(self, trends):
+        super(WindowsGroup, self).__init__("Windows", trends)
+
+    def update(self, pings, **kwargs):
+        pings = pings.filter(lambda p: p["OSName"] == "Windows")
+        return super(WindowsGroup, self).update(pings, **kwargs)
+
+
+class WinverTrend(Trend):
+    def __init__(self):
+        super(WinverTrend, self).__init__("trend-windows-versions")
+
+    @staticmethod
+    def key(p):
+        return p["OSVersion"]
+
+
+class WinCompositorTrend(Trend):
+    def __init__(self):
+        super(WinCompositorTrend, self).__init__("trend-windows-compositors")
+
+    def willUpdate(self, date):
+        # This metric didn't ship until Firefox 43.
+        if date < datetime.datetime(2015, 11, 15):
+            return False
+        return super(WinCompositorTrend, self).willUpdate(date)
+
+    @staticmethod
+    def key(p):
+        features = p.get(GfxFeaturesKey, None)
+        if features is None:
+            return "none"
+        return features.get("compositor", "none")
+
+
+class WinArchTrend(Trend):
+    def __init__(self):
+        super(WinArchTrend, self).__init__("trend-windows-arch")
+
+    @staticmethod
+    def key(p):
+        arch = p.get(ArchKey, "unknown")
+        if arch == "x86-64":
+            return "64"
+        elif arch == "x86":
+            if p.get(Wow64Key, False):
+                return "32_on_64"
+            return "32"
+        return "unknown"
+
+
+# This group restricts pings to Windows Vista+, and must be inside a
+# group that restricts pings to Windows.
+class WindowsVistaPlusGroup(TrendGroup):
+    def __init__(self, trends):
+        super(WindowsVistaPlusGroup, self).__init__("Windows Vista+", trends)
+
+    def update(self, pings, **kwargs):
+        pings = pings.filter(lambda p: not p["OSVersion"].startswith("5.1"))
+        return super(WindowsVistaPlusGroup, self).update(pings, **kwargs)
+
+
+class Direct2DTrend(Trend):
+    def __init__(self):
+        super(Direct2DTrend, self).__init__("trend-windows-d2d")
+
+    def willUpdate(self, date):
+        # This metric didn't ship until Firefox 43.
+        if date < datetime.datetime(2015, 11, 15):
+            return False
+        return super(Direct2DTrend, self).willUpdate(date)
+
+    @staticmethod
+    def key(p):
+        try:
+            status = p[GfxFeaturesKey]["d2d"]["status"]
+            if status != "available":
+                return status
+            return p[GfxFeaturesKey]["d2d"]["version"]
+        except:
+            return "unknown"
+
+
+class Direct3D11Trend(Trend):
+    def __init__(self):
+        super(Direct3D11Trend, self).__init__("trend-windows-d3d11")
+
+    def willUpdate(self, date):
+        # This metric didn't ship until Firefox 43.
+        if date < datetime.datetime(2015, 11, 15):
+            return False
+        return super(Direct3D11Trend, self).willUpdate(date)
+
+    @staticmethod
+    def key(p):
+        try:
+            d3d11 = p[GfxFeaturesKey]["d3d11"]
+            if d3d11["status"] != "available":
+                return d3d11["status"]
+            if d3d11.get("warp", False):
+                return "warp"
+            return d3d11["version"]
+        except:
+            return "unknown"
+
+
+class WindowsVendorTrend(Trend):
+    def __init__(self):
+        super(WindowsVendorTrend, self).__init__("trend-windows-vendors")
+
+    @staticmethod
+    def key(p):
+        return get_vendor(p)
+
+    def dependencies(self):
+        return [get_vendor]
+
+
+# Device generation trend - a little more complicated, since we need the
+# generation database to produce a mapping. It is loaded and broadcast once,
+# and shared by the trends of every vendor.
+class DeviceGenTrend(Trend):
+    generations = None
+
+    def __init__(self, vendor, vendorName):
+        super(DeviceGenTrend, self).__init__(
+            "trend-windows-device-gen-{0}".format(vendorName)
+        )
+        self.vendorID = vendor
+
+    def prepare(self, engine, options):
+        # Grab the vendor -> device -> gen map.
+        if DeviceGenTrend.generations is None:
+            database = devices.load_device_database(
+                options.device_database_path,
+                "{0}/master/www/gfxdevices.json".format(options.github_repo),
+            )
+            DeviceGenTrend.generations = engine.broadcast(
+                devices.compile_generations(database)
+            )
+
+        # Plain functions rather than methods, so that tasks don't ship the trend.
+        generations = DeviceGenTrend.generations
+        vendorID = self.vendorID
+
+        def accept(p):
+            return get_vendor(p) == vendorID
+
+        def key(p):
+            deviceID = p[GfxAdaptersKey][0].get("deviceID", "unknown")
+            return generations.value[vendorID].get(deviceID, "unknown")
+
+        self.accept = accept
+        self.key = key
+        return super(DeviceGenTrend, self).prepare(engine, options)
+
+    def dependencies(self):
+        return [get_vendor, DeviceGenTrend.generations.value[self.vendorID]]
+
+
+def AllTrends():
+    """Return the trends updated by the trends notebook."""
+    return [
+        FirefoxTrend(),
+        WindowsGroup(
+            [
+                WinverTrend(),
+                WinCompositorTrend(),
+                WinArchTrend(),
+                WindowsVendorTrend(),
+                WindowsVistaPlusGroup(
+                    [
+                        Direct2DTrend(),
+                        Direct3D11Trend(),
+                    ]
+                ),
+                DeviceGenTrend("0x8086", "intel"),
+                DeviceGenTrend("0x10de", "nvidia"),
+                DeviceGenTrend("0x1002", "amd"),
+            ]
+        ),
+    ]
@@ -4,11 +4,17 @@ from setuptools import setup, find_packages
 
 setup(
     name="bigquery_shim",
-    version="0.5.8",
+    version="0.9.0",
     packages=["bigquery_shim"],
+    package_data={"bigquery_shim": ["gfxdevices.json"]},
     install_requires=[
         "google-cloud-bigquery == 1.16.0",
         "google-cloud-storage == 1.22.0",
+        "numpy",
         "regex",
     ],
+    extras_require={
+        "arrow": ["google-cloud-bigquery-storage", "pyarrow"],
+        "test": ["duckdb", "pyarrow", "pytest"],
+    },
 )
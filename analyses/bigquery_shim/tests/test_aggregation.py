@@ -0,0 +1,110 @@
+import datetime
+import os
+
+import pytest
+
+from bigquery_shim import (
+    aggregate,
+    dashboard,
+    dashboard_analysis,
+    engine,
+    sources,
+    synthetic,
+)
+
+duckdb = pytest.importorskip("duckdb")
+
+TABLE_ID = "graphics_telemetry_dashboard_tmp"
+START = datetime.datetime(2020, 8, 1)
+
+# Intel Open Source Technology Center is merged with 0x8086 by both paths.
+OSTC = "Intel Open Source Technology Center"
+PROFILE = synthetic.DEFAULT_PROFILE._replace(
+    vendors=dict(synthetic.DEFAULT_PROFILE.vendors, **{OSTC: 0.1}),
+    devices=dict(synthetic.DEFAULT_PROFILE.devices, **{OSTC: ["0x0166"]}),
+)
+
+
+def to_duckdb(query):
+    """Translate the BigQuery functions of AGGREGATION_SOURCE to DuckDB."""
+    return (
+        query.replace(
+            "SPLIT(build_version, '.')[OFFSET(0)]", "split_part(build_version, '.', 1)"
+        )
+        .replace("[OFFSET(0)]", "[1]")
+        .replace("JSON_VALUE(", "json_extract_string(")
+        .replace("ARRAY_LENGTH(", "len(")
+    )
+
+
+class DuckDBSource(sources.LocalSource):
+    """A LocalSource that runs the aggregation queries in DuckDB."""
+
+    supports_sql = True
+
+    def __init__(self, path):
+        super(DuckDBSource, self).__init__(path)
+        self.connection = duckdb.connect()
+
+    def table_ref(self, table_id):
+        files, ext = self.files(table_id)
+        return "read_parquet([{}])".format(", ".join("'{}'".format(f) for f in files))
+
+    def run_query(self, query, params):
+        return self.connection.execute(query, params).fetchall()
+
+
+def metrics():
+    where = aggregate.where
+    metrics = [
+        aggregate.metric("devices", "deviceID"),
+        aggregate.metric("drivers", "driverVersion"),
+        aggregate.metric("deviceAndDriver", "deviceAndDriver"),
+        aggregate.metric("share", "FxVersion"),
+        aggregate.metric("os", "OS"),
+        aggregate.metric("driverVendor", "driverVendor"),
+        aggregate.metric("noDriverVendor", "OSName", where(driverVendor=None)),
+        aggregate.metric("versions", "OSVersion", where(OSName="Darwin")),
+        # No pings match, so the counter map is empty.
+        aggregate.metric("none", "vendorID", where(OSName="Windows", FxVersion="1")),
+    ]
+    metrics += dashboard_analysis.GetGeneralStatisticsMetrics("all")
+    for fx in ["79", "80"]:
+        metrics += dashboard_analysis.GetGeneralStatisticsMetrics(fx, FxVersion=fx)
+    return metrics
+
+
+@pytest.fixture(scope="module")
+def data_source(tmp_path_factory):
+    path = tmp_path_factory.mktemp("pings")
+    synthetic.write_rows(
+        synthetic.dashboard_rows(3000, PROFILE, start_date=START),
+        os.path.join(str(path), TABLE_ID),
+        schema=synthetic.dashboard_schema(),
+        rows_per_file=1000,
+    )
+    return DuckDBSource(str(path))
+
+
+def test_sql_metrics_match_python(data_source):
+    raw_pings = dashboard.fetch_results(
+        engine.LocalEngine(),
+        data_source,
+        START,
+        START,
+        use_arrow=True,
+        dense_histograms=True,
+    )
+    pings = dashboard_analysis.FormatPings(raw_pings, use_arrow=True)
+    assert all(dashboard.can_compile_metric(m) for m in metrics())
+
+    source = to_duckdb(
+        dashboard.AGGREGATION_SOURCE.format(table=data_source.table_ref(TABLE_ID))
+    )
+    got = dashboard.aggregate_metrics(pings, metrics(), data_source, source=source)
+    want = aggregate.aggregate(pings, metrics())
+
+    assert got == want
+    assert got["none"] == {}
+    assert OSTC not in got["all/vendors"] and "0x8086" in got["all/vendors"]
+    assert sum(got["all/os"].values()) == pings.count()
@@ -0,0 +1,60 @@
+import pyarrow as pa
+import pytest
+
+from bigquery_shim import arrow
+
+
+def row(version, os_name, os_version, service_pack, adapters):
+    return {
+        "environment__build__version": version,
+        "environment__system__os__name": os_name,
+        "environment__system__os__version": os_version,
+        "environment__system__os__service_pack_major": service_pack,
+        "environment__system__gfx__adapters": adapters,
+    }
+
+
+INTEL = "Intel Open Source Technology Center"
+
+
+@pytest.mark.parametrize(
+    "values,expected",
+    [
+        (
+            row("80.0.1", "Windows_NT", "10.0", None, [{"vendor_id": INTEL}]),
+            {
+                "OS": "Windows-10.0.0",
+                "OSName": "Windows",
+                "OSVersion": "10.0.0",
+                "FxVersion": "80",
+                "vendorID": "0x8086",
+                "deviceID": "0x8086/Unknown",
+                "driverVersion": "0x8086/Unknown",
+                "deviceAndDriver": "0x8086/Unknown/Unknown",
+                "driverVendor": None,
+                "valid": True,
+            },
+        ),
+        (
+            row("", None, "", 2, []),
+            {"OS": "w-0", "OSName": "w", "OSVersion": "0"},
+        ),
+        (
+            row("79", "Linux", "5.4", 0, None),
+            {"OS": "Linux", "OSName": "Linux", "OSVersion": None, "FxVersion": "79"},
+        ),
+        (
+            row("79", "Darwin", "19.6", 0, [None]),
+            {
+                "OS": "Darwin-19.6",
+                "OSName": "Darwin",
+                "OSVersion": "19.6",
+                "FxVersion": "79",
+            },
+        ),
+    ],
+)
+def test_derived_properties(values, expected):
+    batch = pa.RecordBatch.from_pylist([values])
+    (ping,) = arrow.convert_dashboard_batch(batch)
+    assert {k: ping[k] for k in arrow.DERIVED_PROPERTIES if k in ping} == expected
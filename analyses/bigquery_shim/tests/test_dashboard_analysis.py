@@ -0,0 +1,50 @@
+import numpy as np
+
+from bigquery_shim import engine
+from bigquery_shim.dashboard_analysis import (
+    DeviceResetReasonKey,
+    GetMonitorStatistics,
+    GetTDRStatistics,
+    MonitorsKey,
+)
+
+
+def resets(counts):
+    return np.array(counts + [0] * (8 - len(counts)), dtype=np.int64)
+
+
+def test_tdr_statistics_break_down_every_reason():
+    eng = engine.LocalEngine()
+    pings = eng.parallelize(
+        [
+            {"vendorID": "0x8086", DeviceResetReasonKey: resets([0, 1, 0, 2])},
+            {"vendorID": "0x10de", DeviceResetReasonKey: resets([0, 0, 3])},
+        ]
+    )
+
+    stats = GetTDRStatistics(eng, pings)
+
+    assert sorted(stats["reasonToVendor"]) == [
+        (1, {"0x8086": 1}),
+        (2, {"0x10de": 3}),
+        (3, {"0x8086": 2}),
+    ]
+    assert sorted(stats["vendorToReason"]) == [
+        ("0x10de", {2: 3}),
+        ("0x8086", {1: 1, 3: 2}),
+    ]
+
+
+def test_monitor_statistics_use_each_monitor_count():
+    eng = engine.LocalEngine()
+    monitor = {"refreshRate": 60, "screenWidth": 1920, "screenHeight": 1080}
+    # Counts in an order where the last one seen is not the largest.
+    pings = eng.parallelize(
+        [{MonitorsKey: [monitor, monitor]}, {MonitorsKey: [monitor]}]
+    )
+
+    stats = GetMonitorStatistics(eng, pings)
+
+    assert dict(stats["counts"]) == {1: 1, 2: 1}
+    assert dict(stats["refreshRates"]) == {60: 2}
+    assert dict(stats["resolutions"]) == {"1920x1080": 2}
@@ -0,0 +1,60 @@
+import json
+import os
+import pathlib
+import time
+
+import pytest
+
+from bigquery_shim import devices
+
+OLD = {"0x8086": {"0x0166": ["gen7", "ivybridge-gt2"]}}
+NEW = {"0x8086": {"0x0166": ["gen7", "ivybridge-gt2"], "0x9bc4": ["gen9.5"]}}
+
+
+@pytest.fixture
+def paths(tmp_path, monkeypatch):
+    monkeypatch.setattr(devices, "PACKAGE_DATA", "missing.json")
+    cache_path = tmp_path / "cache" / "gfxdevices.json"
+    cache_path.parent.mkdir()
+    cache_path.write_text(json.dumps(OLD))
+    remote = tmp_path / "remote.json"
+    remote.write_text(json.dumps(NEW))
+    return str(cache_path), pathlib.Path(remote).as_uri()
+
+
+def age(path, seconds):
+    then = time.time() - seconds
+    os.utime(path, (then, then))
+
+
+def test_fresh_cache_is_used(paths):
+    cache_path, url = paths
+    assert devices.load_device_database(cache_path, url) == OLD
+
+
+def test_old_cache_is_refreshed(paths):
+    cache_path, url = paths
+    age(cache_path, devices.MAX_AGE.total_seconds() + 60)
+    assert devices.load_device_database(cache_path, url) == NEW
+    with open(cache_path) as fp:
+        assert json.load(fp) == NEW
+
+
+def test_old_cache_is_used_when_download_fails(paths, tmp_path):
+    cache_path, url = paths
+    age(cache_path, devices.MAX_AGE.total_seconds() + 60)
+    url = (tmp_path / "unreachable.json").as_uri()
+    assert devices.load_device_database(cache_path, url) == OLD
+
+
+def test_download_without_cache_fails(paths, tmp_path):
+    cache_path, url = paths
+    os.remove(cache_path)
+    with pytest.raises(OSError):
+        devices.load_device_database(cache_path, (tmp_path / "none.json").as_uri())
+
+
+def test_package_data_is_used(tmp_path):
+    # No cached copy and no URL to download from.
+    database = devices.load_device_database(str(tmp_path / "gfxdevices.json"))
+    assert database["0x8086"]
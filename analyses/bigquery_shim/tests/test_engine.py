@@ -0,0 +1,72 @@
+import datetime
+import os
+
+import pytest
+
+from bigquery_shim import engine, local, sources, synthetic
+
+pytest.importorskip("pyarrow")
+
+TABLE_ID = "graphics_telemetry_dashboard_tmp"
+START = datetime.datetime(2020, 8, 1)
+
+
+def strip_phase_time(obj):
+    if isinstance(obj, dict):
+        return {k: strip_phase_time(v) for k, v in obj.items() if k != "phaseTime"}
+    if isinstance(obj, list):
+        return [strip_phase_time(v) for v in obj]
+    return obj
+
+
+def export(eng, data_source):
+    exports = {}
+    local.export_dashboard(
+        eng,
+        data_source,
+        lambda filename, obj: exports.setdefault(filename, strip_phase_time(obj)),
+        now=START,
+    )
+    return exports
+
+
+@pytest.fixture(scope="module")
+def data_source(tmp_path_factory):
+    path = tmp_path_factory.mktemp("pings")
+    synthetic.write_rows(
+        synthetic.dashboard_rows(2000, start_date=START),
+        os.path.join(str(path), TABLE_ID),
+        schema=synthetic.dashboard_schema(),
+        rows_per_file=400,
+    )
+    return sources.LocalSource(str(path))
+
+
+def test_process_engine_exports_match_local_engine(data_source):
+    process_engine = engine.ProcessEngine(processes=2)
+    try:
+        got = export(process_engine, data_source)
+    finally:
+        process_engine.close()
+    want = export(engine.LocalEngine(), data_source)
+
+    assert sorted(got) == sorted(want)
+    for filename in want:
+        assert got[filename] == want[filename], filename
+
+
+def test_process_engine_keeps_cached_partitions_in_workers():
+    eng = engine.ProcessEngine(processes=2)
+    try:
+        offset = 1
+        dataset = eng.parallelize(range(100), 4).map(lambda x: x + offset).cache()
+        assert dataset.count() == 100
+        assert all(isinstance(p, engine.WorkerPartition) for p in dataset._partitions)
+        assert dataset.filter(lambda x: x % 2 == 0).count() == 50
+        assert sorted(dataset.collect()) == list(range(1, 101))
+
+        dataset.unpersist()
+        assert len(eng.released) == 4
+        assert dataset.count() == 100
+    finally:
+        eng.close()
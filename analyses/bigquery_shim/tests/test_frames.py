@@ -0,0 +1,67 @@
+import datetime
+import os
+
+import pytest
+
+from bigquery_shim import aggregate, dashboard, dashboard_analysis, sources, synthetic
+
+pytest.importorskip("pyspark")
+from pyspark.sql import SparkSession
+
+from bigquery_shim import frames
+
+TABLE_ID = "graphics_telemetry_dashboard_tmp"
+START = datetime.datetime(2020, 8, 1)
+
+OSTC = "Intel Open Source Technology Center"
+PROFILE = synthetic.DEFAULT_PROFILE._replace(
+    vendors=dict(synthetic.DEFAULT_PROFILE.vendors, **{OSTC: 0.1}),
+    devices=dict(synthetic.DEFAULT_PROFILE.devices, **{OSTC: ["0x0166"]}),
+)
+
+
+def metrics():
+    where = aggregate.where
+    metrics = [
+        aggregate.metric("devices", "deviceID"),
+        aggregate.metric("drivers", "driverVersion"),
+        aggregate.metric("deviceAndDriver", "deviceAndDriver"),
+        aggregate.metric("share", "FxVersion"),
+        aggregate.metric("os", "OS"),
+        aggregate.metric("driverVendor", "driverVendor"),
+        aggregate.metric("noDriverVendor", "OSName", where(driverVendor=None)),
+        aggregate.metric("versions", "OSVersion", where(OSName="Darwin")),
+        aggregate.metric("linux", "OSVersion", where(OSName="Linux")),
+    ]
+    metrics += dashboard_analysis.GetGeneralStatisticsMetrics("all")
+    return metrics
+
+
+@pytest.fixture(scope="module")
+def spark():
+    session = SparkSession.builder.master("local[2]").getOrCreate()
+    yield session
+    session.stop()
+
+
+def test_frame_counts_match_validate(spark, tmp_path):
+    synthetic.write_rows(
+        synthetic.dashboard_rows(2000, PROFILE, start_date=START),
+        os.path.join(str(tmp_path), TABLE_ID),
+        schema=synthetic.dashboard_schema(),
+        rows_per_file=500,
+    )
+    raw_frame = dashboard.fetch_results(
+        spark,
+        sources.LocalSource(str(tmp_path)),
+        START,
+        START,
+        use_dataframe=True,
+    )
+    assert all(dashboard.can_compile_metric(m) for m in metrics())
+
+    got = frames.count_metrics(frames.format_pings(raw_frame), metrics())
+    want = aggregate.aggregate(dashboard_analysis.FormatPings(raw_frame.rdd), metrics())
+
+    assert got == want
+    assert OSTC not in got["all/vendors"] and "0x8086" in got["all/vendors"]
@@ -0,0 +1,47 @@
+import pytest
+
+from bigquery_shim import snake_case
+from bigquery_shim.snake_case import SnakeCaseDict
+
+
+def test_delete_either_spelling():
+    for key in ["vendorID", "vendor_id"]:
+        d = SnakeCaseDict(vendorID="0x8086")
+        del d[key]
+        assert d == {} and "vendor_id" not in d
+
+
+def test_delete_missing_key():
+    d = SnakeCaseDict(vendorID="0x8086")
+    with pytest.raises(KeyError) as e:
+        del d["nope"]
+    assert e.value.args == ("nope",)
+
+
+def test_indexed_spellings_are_not_converted(monkeypatch):
+    snake_case.add_known_keys(["testDeviceID"])
+    stored_camel = SnakeCaseDict(testDeviceID=1)
+    stored_snake = SnakeCaseDict(test_device_id=2)
+
+    def fail(key):
+        raise AssertionError("converted {}".format(key))
+
+    monkeypatch.setattr(snake_case, "snake_case", fail)
+    assert stored_camel["test_device_id"] == 1 and "test_device_id" in stored_camel
+    assert stored_snake["testDeviceID"] == 2 and "testDeviceID" in stored_snake
+
+
+def test_mutators_keep_the_index():
+    d = SnakeCaseDict.fromkeys(["vendorID"], "0x8086")
+    assert type(d) is SnakeCaseDict and d["vendor_id"] == "0x8086"
+
+    d |= {"deviceID": "0x0166"}
+    assert d["device_id"] == "0x0166"
+
+    merged = d | {"driver_version": "1"}
+    assert type(merged) is SnakeCaseDict and merged["driverVersion"] == "1"
+
+    assert d.popitem() == ("deviceID", "0x0166")
+    assert "device_id" not in d
+    d["device_id"] = "0x0412"
+    assert d == {"vendorID": "0x8086", "device_id": "0x0412"}
@@ -0,0 +1,28 @@
+import threading
+
+from bigquery_shim import sources
+
+
+def test_prefetch_releases_running_fetches():
+    started = [threading.Event() for _ in range(10)]
+    gate = threading.Event()
+    released = []
+
+    def fetch(item):
+        started[item].set()
+        if item > 0:
+            gate.wait()
+        return item
+
+    fetched = sources.prefetch(range(10), fetch, concurrency=2, release=released.append)
+    for item, future in fetched:
+        assert future.result() == 0
+        break
+
+    # Items 1 and 2 are running; the others were never started.
+    started[1].wait()
+    started[2].wait()
+    gate.set()
+    fetched.close()
+    assert sorted(released) == [1, 2]
+    assert not any(event.is_set() for event in started[3:])
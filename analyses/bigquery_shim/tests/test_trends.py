@@ -0,0 +1,56 @@
+import datetime
+
+import pytest
+
+from bigquery_shim import engine, snake_case, sources, synthetic, trends
+
+START = datetime.datetime(2020, 8, 2)
+WEEKS = 3
+
+
+@pytest.mark.parametrize("format", [synthetic.PARQUET, synthetic.JSONL])
+def test_week_start_is_a_date(tmp_path, format):
+    synthetic.write_rows(
+        synthetic.trends_rows(200, start_date=START, weeks=WEEKS, by_week=True),
+        str(tmp_path / "graphics_telemetry_trends_tmp"),
+        format=format,
+        schema=synthetic.trends_schema(by_week=True),
+    )
+
+    pings = trends.fetch_results(
+        engine.LocalEngine(),
+        sources.LocalSource(str(tmp_path)),
+        START,
+        START + datetime.timedelta(weeks=WEEKS),
+        use_arrow=True,
+        by_week=True,
+    ).collect()
+
+    weeks = {(START + datetime.timedelta(weeks=i)).date() for i in range(WEEKS)}
+    assert {p[trends.WeekStartKey] for p in pings} == weeks
+
+
+@pytest.mark.parametrize(
+    "value",
+    [
+        datetime.date(2020, 8, 9),
+        datetime.datetime(2020, 8, 9),
+        "2020-08-09",
+        "2020-08-09T00:00:00",
+    ],
+)
+def test_to_date(value):
+    assert trends.to_date(value) == datetime.date(2020, 8, 9)
+
+
+def test_in_week_without_week_start():
+    sunday = datetime.date(2020, 8, 9)
+    for created, expected in [
+        ("2020-08-08T23:00:00.000Z", False),
+        ("2020-08-09T00:00:00.000Z", True),
+        ("2020-08-12T10:00:00.000Z", True),
+        ("2020-08-16T10:00:00.000Z", True),
+        ("2020-08-17T00:00:00.000Z", False),
+    ]:
+        ping = snake_case.convert_snake_case_dict({"creationDate": created}, lazy=True)
+        assert trends.in_week(ping, sunday) == expected
@@ -0,0 +1,103 @@
+import datetime
+import json
+
+from bigquery_shim import trends_analysis
+
+
+def fingerprint(trend_class):
+    return trends_analysis.TrendFingerprint(trend_class())
+
+
+def test_fingerprint_is_stable():
+    assert fingerprint(trends_analysis.FirefoxTrend) == fingerprint(
+        trends_analysis.FirefoxTrend
+    )
+
+
+def test_fingerprint_changes_with_version():
+    class Bumped(trends_analysis.FirefoxTrend):
+        version = trends_analysis.FirefoxTrend.version + 1
+
+    Bumped.__name__ = "FirefoxTrend"
+    assert fingerprint(Bumped) != fingerprint(trends_analysis.FirefoxTrend)
+
+
+def test_fingerprint_ignores_shared_code(monkeypatch):
+    before = fingerprint(trends_analysis.FirefoxTrend)
+
+    def Validate(p):
+        return True
+
+    monkeypatch.setattr(trends_analysis, "Validate", Validate)
+    assert fingerprint(trends_analysis.FirefoxTrend) == before
+
+
+def test_fingerprint_changes_with_dependencies(monkeypatch):
+    before = fingerprint(trends_analysis.WindowsVendorTrend)
+    monkeypatch.setattr(
+        trends_analysis.WindowsVendorTrend, "dependencies", lambda self: [{}]
+    )
+    assert fingerprint(trends_analysis.WindowsVendorTrend) != before
+
+
+def test_fingerprint_ignores_comments():
+    def key(p):
+        # The major version.
+        return p.split(".")[0]
+
+    def commented_key(p):
+
+        return p.split(".")[0]  # The major version.
+
+    assert trends_analysis.FunctionSource(key).replace(
+        "key", "commented_key", 1
+    ) == trends_analysis.FunctionSource(commented_key)
+
+
+def finish_weeks(path, index, *starts, **options):
+    trend = trends_analysis.FirefoxTrend()
+    trend.options = trends_analysis.Options(str(path), **options)
+    trend.index = index
+    trend.fingerprint = "fingerprint"
+    for start in starts:
+        trend.addDataPoint(
+            {"80": 1}, start, start + datetime.timedelta(days=7), total=1
+        )
+    trend.finish()
+    return trend.index
+
+
+def read_shard(path, year):
+    with open(str(path / "trend-firefox" / "{}.json".format(year))) as fp:
+        return [point["start"] for point in json.load(fp)]
+
+
+def test_finish_writes_a_shard_per_year(tmp_path):
+    weeks = [
+        datetime.datetime(2019, 12, 29) + datetime.timedelta(weeks=i) for i in range(3)
+    ]
+    index = finish_weeks(tmp_path, {"weeks": []}, weeks[0], weeks[1])
+    assert read_shard(tmp_path, 2019) == [trends_analysis.jstime(weeks[0])]
+    assert read_shard(tmp_path, 2020) == [trends_analysis.jstime(weeks[1])]
+
+    # Updating a week keeps the other weeks of its year.
+    index = finish_weeks(tmp_path, index, weeks[2])
+    assert read_shard(tmp_path, 2020) == [trends_analysis.jstime(w) for w in weeks[1:]]
+    assert [entry["shard"] for entry in index["weeks"]] == [
+        "trend-firefox/2019.json",
+        "trend-firefox/2020.json",
+        "trend-firefox/2020.json",
+    ]
+
+
+def test_finish_keeps_weeks_a_backfill_skipped(tmp_path):
+    weeks = [
+        datetime.datetime(2020, 1, 5) + datetime.timedelta(weeks=i) for i in range(4)
+    ]
+    index = finish_weeks(tmp_path, {"weeks": []}, *weeks)
+
+    # The fetch of weeks[1:3] failed, so only the others were recomputed.
+    index = finish_weeks(tmp_path, index, weeks[3], weeks[0], force_max_backfill=True)
+    starts = [trends_analysis.jstime(w) for w in weeks]
+    assert [entry["start"] for entry in index["weeks"]] == starts
+    assert read_shard(tmp_path, 2020) == starts
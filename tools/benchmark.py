@@ -0,0 +1,330 @@
+#!/usr/bin/env python
+"""Benchmarks of the shim and the dashboard and trends notebook hot paths.
+
+Each benchmark runs on synthetic query results, see bigquery_shim.synthetic,
+at several input sizes, and reports its throughput in items per second and
+the peak memory it allocates. Results can be saved as a JSON baseline that
+later runs are compared against:
+
+    python tools/benchmark.py --save
+    python tools/benchmark.py --sizes 1000 10000 --check
+
+The notebook functions benchmarked are those of bigquery_shim.dashboard_analysis,
+which the dashboard notebook runs.
+"""
+
+import argparse
+import copy
+import datetime
+import functools
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+ROOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+BASELINE_PATH = os.path.join(ROOT_PATH, "bench_baseline.json")
+
+# Benchmark the checkout's shim rather than an installed one.
+sys.path.insert(0, os.path.join(ROOT_PATH, "analyses", "bigquery_shim"))
+
+from bigquery_shim import (  # noqa: E402
+    dashboard,
+    dashboard_analysis,
+    snake_case,
+    synthetic,
+    trends,
+)
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+
+# Properties kept by reduce_pings in the dashboard notebook.
+PING_PROPERTIES = dashboard_analysis.PingProperties
+
+# Keys looked up on pings by Validate and the dashboard metrics.
+LOOKUP_KEYS = PING_PROPERTIES + [
+    "OSName",
+    "vendorID",
+    "deviceID",
+    "driverVersion",
+    "missingKey",
+]
+
+
+try:
+    from pyspark.sql import Row
+except ImportError:
+
+    class Row(dict):
+        """Attribute access and asDict of pyspark.sql.Row, for the inputs."""
+
+        def __getattr__(self, name):
+            try:
+                return self[name]
+            except KeyError:
+                raise AttributeError(name)
+
+        def asDict(self, recursive=False):
+            if not recursive:
+                return dict(self)
+            return {key: _as_dict(value) for key, value in self.items()}
+
+    def _as_dict(value):
+        if isinstance(value, Row):
+            return value.asDict(True)
+        if isinstance(value, list):
+            return [_as_dict(item) for item in value]
+        return value
+
+
+def to_row(value):
+    """Turn the structs of a synthetic row into Rows, as Spark returns them."""
+    if isinstance(value, dict):
+        return Row(**{key: to_row(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return [to_row(item) for item in value]
+    return value
+
+
+@functools.lru_cache(maxsize=None)
+def dashboard_rows(size):
+    return [to_row(row) for row in synthetic.dashboard_rows(size, seed=size)]
+
+
+@functools.lru_cache(maxsize=None)
+def trends_rows(size):
+    return [to_row(row) for row in synthetic.trends_rows(size, seed=size)]
+
+
+@functools.lru_cache(maxsize=None)
+def dashboard_pings(size):
+    pings = []
+    for row in dashboard_rows(size):
+        ping = dashboard.convert_bigquery_results(row, dense_histograms=True)
+        pings.append(dashboard.get_ping_properties(ping, PING_PROPERTIES))
+    return pings
+
+
+@functools.lru_cache(maxsize=None)
+def camel_case_pings(size):
+    # Nested camelCase pings, as converted from the trends query results.
+    return [dict(trends.to_dataset(row)) for row in trends_rows(size)]
+
+
+def camel_case_keys(size):
+    keys = []
+    for ping in camel_case_pings(min(size, 1000)):
+        keys += ping.keys()
+        for adapter in ping[trends.GfxAdaptersKey]:
+            keys += adapter.keys()
+    keys += LOOKUP_KEYS
+    return [keys[i % len(keys)] for i in range(size)]
+
+
+def breakdowns(size):
+    # {vendor: count} maps, as reduced with combiner.
+    generator = synthetic.Generator(seed=size)
+    return [
+        {generator.vendor(generator.rng): 1, generator.os(generator.rng)[1]: 2}
+        for _ in range(size)
+    ]
+
+
+def aggregates(size):
+    # (device, {driver: count}) pairs with 1 to 100 drivers per device.
+    generator = synthetic.Generator(seed=size)
+    agg = []
+    while len(agg) * 50 < size:
+        drivers = generator.rng.randint(1, 100)
+        agg.append(
+            (
+                "device{}".format(len(agg)),
+                {
+                    "driver{}".format(i): generator.rng.randint(1, 1000)
+                    for i in range(drivers)
+                },
+            )
+        )
+    return agg
+
+
+def lookup_all(pings):
+    for ping in pings:
+        for key in LOOKUP_KEYS:
+            ping.get(key)
+
+
+def benchmarks():
+    """Return [(name, make_input, run)]; `run` processes `size` items."""
+    Validate = dashboard_analysis.Validate
+    combiner = dashboard_analysis.combiner
+    coalesce_to_n_items = dashboard_analysis.coalesce_to_n_items
+
+    def convert_all(convert):
+        return lambda items: [convert(item) for item in items]
+
+    return [
+        ("snake_case", camel_case_keys, convert_all(snake_case.snake_case)),
+        (
+            "convert_snake_case_dict",
+            lambda size: copy.deepcopy(camel_case_pings(size)),
+            convert_all(snake_case.convert_snake_case_dict),
+        ),
+        (
+            "convert_snake_case_dict/lazy",
+            lambda size: copy.deepcopy(camel_case_pings(size)),
+            convert_all(
+                functools.partial(snake_case.convert_snake_case_dict, lazy=True)
+            ),
+        ),
+        (
+            "SnakeCaseDict lookups",
+            lambda size: [
+                snake_case.convert_snake_case_dict(dict(ping), lazy=True)
+                for ping in dashboard_pings(size)
+            ],
+            lookup_all,
+        ),
+        (
+            "convert_bigquery_results",
+            dashboard_rows,
+            convert_all(
+                functools.partial(
+                    dashboard.convert_bigquery_results, dense_histograms=True
+                )
+            ),
+        ),
+        ("trends.to_dataset", trends_rows, convert_all(trends.to_dataset)),
+        (
+            "Validate",
+            lambda size: [
+                snake_case.convert_snake_case_dict(dict(ping), lazy=True)
+                for ping in dashboard_pings(size)
+            ],
+            convert_all(Validate),
+        ),
+        (
+            "combiner",
+            breakdowns,
+            lambda items: functools.reduce(combiner, items, {}),
+        ),
+        (
+            "coalesce_to_n_items",
+            aggregates,
+            lambda agg: coalesce_to_n_items(agg, 10),
+        ),
+    ]
+
+
+def measure(make_input, run, size, repeat):
+    """Return the best items per second and the peak KB allocated by `run`."""
+    best = None
+    for _ in range(repeat):
+        items = make_input(size)
+        start = time.perf_counter()
+        run(items)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    # Memory is traced in a separate run, since tracing slows it down.
+    items = make_input(size)
+    tracemalloc.start()
+    try:
+        run(items)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return size / best, peak / 1024
+
+
+def compare(result, baseline, tolerance):
+    """Return the throughput ratio to the baseline and whether it regressed."""
+    if not baseline:
+        return None, False
+    ratio = result["throughput"] / baseline["throughput"]
+    return ratio, ratio < 1 - tolerance
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--filter", help="only run benchmarks containing this")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument(
+        "--save", action="store_true", help="save the results as the baseline"
+    )
+    parser.add_argument(
+        "--check", action="store_true", help="fail if a benchmark regressed"
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="throughput drop from the baseline counted as a regression",
+    )
+    args = parser.parse_args(argv)
+
+    baseline = {}
+    if os.path.isfile(args.baseline):
+        with open(args.baseline) as fp:
+            baseline = json.load(fp)["results"]
+    # Benchmarks and sizes that are not run keep their baseline when saving.
+    results = copy.deepcopy(baseline)
+
+    regressions = []
+    print(
+        "{:<30} {:>8} {:>14} {:>12} {:>12}".format(
+            "benchmark", "size", "items/s", "peak KB", "vs baseline"
+        )
+    )
+    for name, make_input, run in benchmarks():
+        if args.filter and args.filter not in name:
+            continue
+        for size in args.sizes:
+            throughput, peak_kb = measure(make_input, run, size, args.repeat)
+            result = {"throughput": throughput, "peak_kb": peak_kb}
+            results.setdefault(name, {})[str(size)] = result
+
+            ratio, regressed = compare(
+                result, baseline.get(name, {}).get(str(size)), args.tolerance
+            )
+            if regressed:
+                regressions.append((name, size))
+            print(
+                "{:<30} {:>8} {:>14,.0f} {:>12,.0f} {:>12}{}".format(
+                    name,
+                    size,
+                    throughput,
+                    peak_kb,
+                    "" if ratio is None else "{:.2f}x".format(ratio),
+                    " REGRESSED" if regressed else "",
+                )
+            )
+            sys.stdout.flush()
+
+    if args.save:
+        with open(args.baseline, "w") as fp:
+            json.dump(
+                {
+                    "date": datetime.datetime.now().isoformat(),
+                    "python": platform.python_version(),
+                    "machine": platform.machine(),
+                    "results": results,
+                },
+                fp,
+                indent=2,
+                sort_keys=True,
+            )
+        print("Saved the baseline to {}".format(args.baseline))
+
+    if args.check and regressions:
+        print("{} benchmarks regressed".format(len(regressions)))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -258,9 +258,10 @@ ChartDisplay.prototype.prefetch = function (keys)
   }
 }
 
-ChartDisplay.prototype.onFetch = function (key, callback)
+// |errback|, if given, is called instead of |callback| when the fetch fails.
+ChartDisplay.prototype.onFetch = function (key, callback, errback)
 {
-  var obj = this.ensureData(key, callback);
+  var obj = this.ensureData(key, callback, errback);
   if (obj !== null)
     callback(obj);
 }
@@ -273,19 +274,27 @@ ChartDisplay.prototype.makeDataURL = function (name, useS3)
   return prefix + name;
 }
 
-ChartDisplay.prototype.ensureDataImpl = function (key, callback, useS3)
+ChartDisplay.prototype.ensureDataImpl = function (key, callback, useS3, errback)
 {
+  errback = errback || function () {};
   if (key in this.data) {
     if (this.data[key].obj)
       return this.data[key].obj;
+    if (this.data[key].failed) {
+      errback();
+      return null;
+    }
 
     this.data[key].callbacks.push(callback);
+    this.data[key].errbacks.push(errback);
     return null;
   }
 
   var state = {
       callbacks: [callback],
+      errbacks: [errback],
       obj: null,
+      failed: false,
   };
   this.data[key] = state;
 
@@ -296,6 +305,7 @@ ChartDisplay.prototype.ensureDataImpl = function (key, callback, useS3)
 
     var callbacks = state.callbacks;
     state.callbacks = null;
+    state.errbacks = null;
 
     for (var i = 0; i < callbacks.length; i++)
       callbacks[i](state.obj);
@@ -303,6 +313,14 @@ ChartDisplay.prototype.ensureDataImpl = function (key, callback, useS3)
   var onError = function (xhr, textStatus, errorThrown) {
     console.log(textStatus);
     console.log(errorThrown);
+
+    var errbacks = state.errbacks;
+    state.failed = true;
+    state.callbacks = null;
+    state.errbacks = null;
+
+    for (var i = 0; i < errbacks.length; i++)
+      errbacks[i]();
   }
   var maybeRetry = (function (xhr, textStatus, errorThrown) {
     if (useS3 && RETRY_IF_NOT_IN_S3[key]) {
@@ -327,11 +345,11 @@ ChartDisplay.prototype.ensureDataImpl = function (key, callback, useS3)
   .error(maybeRetry);
 }
 
-ChartDisplay.prototype.ensureData = function (key, callback)
+ChartDisplay.prototype.ensureData = function (key, callback, errback)
 {
   var useS3 = USE_S3_FOR_CHART_DATA;
 
-  return this.ensureDataImpl(key, callback, useS3);
+  return this.ensureDataImpl(key, callback, useS3, errback);
 }
 
 // Format a fraction as a percentage, sans-percent sign.
@@ -96,26 +96,71 @@ ChartDisplay.prototype.plotPercentageTrend = function (elt, points, options)
   $.plot(elt, series, options);
 }
 
+// Trend histories are stored as an index, <name>-index.json, listing the
+// shard of each week, one per year. The shards of every week are fetched,
+// and the callback receives the points of the weeks in the index as
+// {trend: [points]}. Shards that fail to load leave a gap in the trend.
+ChartDisplay.prototype.onFetchTrend = function (name, callback)
+{
+  var onIndex = (function (index) {
+    var weeks = {};
+    var shards = [];
+    for (var i = 0; i < index.weeks.length; i++) {
+      var week = index.weeks[i];
+      weeks[week.start] = true;
+      if (shards.indexOf(week.shard) == -1)
+        shards.push(week.shard);
+    }
+
+    var points = [];
+    var remaining = shards.length;
+    var done = function () {
+      if (--remaining > 0)
+        return;
+      points.sort(function (a, b) { return a.start - b.start; });
+      callback({ trend: points });
+    };
+    if (remaining == 0) {
+      callback({ trend: points });
+      return;
+    }
+
+    for (var i = 0; i < shards.length; i++) {
+      this.onFetch(shards[i], function (shard) {
+        for (var j = 0; j < shard.length; j++) {
+          if (shard[j].start in weeks)
+            points.push(shard[j]);
+        }
+        done();
+      }, done);
+    }
+  }).bind(this);
+
+  this.onFetch(name + '-index.json', onIndex, function () {
+    callback({ trend: [] });
+  });
+}
+
 ChartDisplay.prototype.drawTrends = function ()
 {
   this.prefetch([
-    'trend-firefox-v2.json',
-    'trend-windows-versions-v2.json',
-    'trend-windows-compositors-v2.json',
-    'trend-windows-arch-v2.json',
-    'trend-windows-d3d11-v2.json',
-    'trend-windows-d2d-v2.json',
-    'trend-windows-vendors-v2.json',
-    'trend-windows-device-gen-amd-v2.json',
-    'trend-windows-device-gen-intel-v2.json',
-    'trend-windows-device-gen-nvidia-v2.json',
+    'trend-firefox-index.json',
+    'trend-windows-versions-index.json',
+    'trend-windows-compositors-index.json',
+    'trend-windows-arch-index.json',
+    'trend-windows-d3d11-index.json',
+    'trend-windows-d2d-index.json',
+    'trend-windows-vendors-index.json',
+    'trend-windows-device-gen-amd-index.json',
+    'trend-windows-device-gen-intel-index.json',
+    'trend-windows-device-gen-nvidia-index.json',
   ]);
 
   var fxversion_elt = this.prepareChartDiv(
     'firefox-versions-trend',
     'Firefox Versions',
     800, 300, 150);
-  this.onFetch('trend-firefox-v2.json', (function (obj) {
+  this.onFetchTrend('trend-firefox', (function (obj) {
     this.plotPercentageTrend(fxversion_elt, obj.trend, {
       gfxLabelFn: function (key) {
         return 'Firefox ' + key;
@@ -127,7 +172,7 @@ ChartDisplay.prototype.drawTrends = function ()
     'windows-versions-trend',
     'Windows Versions',
     800, 300, 150);
-  this.onFetch('trend-windows-versions-v2.json', (function (obj) {
+  this.onFetchTrend('trend-windows-versions', (function (obj) {
     this.plotPercentageTrend(winver_elt, obj.trend, {
       gfxLabelFn: WindowsVersionName,
       gfxPreprocess: function (point, data) {
@@ -140,7 +185,7 @@ ChartDisplay.prototype.drawTrends = function ()
     'windows-compositors-trend',
     'Windows Compositors',
     800, 300, 150);
-  this.onFetch('trend-windows-compositors-v2.json', (function (obj) {
+  this.onFetchTrend('trend-windows-compositors', (function (obj) {
     this.plotPercentageTrend(wincc_elt, obj.trend, {
       gfxLabelFn: function (key) {
         switch (key) {
@@ -160,7 +205,7 @@ ChartDisplay.prototype.drawTrends = function ()
     'windows-arch-trend',
     'Firefox CPU Architecture',
     800, 300, 150);
-  this.onFetch('trend-windows-arch-v2.json', (function (obj) {
+  this.onFetchTrend('trend-windows-arch', (function (obj) {
     this.plotPercentageTrend(winarch_elt, obj.trend, {
       gfxLabelFn: function (key) {
         switch (key) {
@@ -177,7 +222,7 @@ ChartDisplay.prototype.drawTrends = function ()
     'd3d11-trend',
     'Direct3D 11 Trends',
     750, 300, 200);
-  this.onFetch('trend-windows-d3d11-v2.json', (function (obj) {
+  this.onFetchTrend('trend-windows-d3d11', (function (obj) {
     this.plotPercentageTrend(d3d11_elt, obj.trend, {
       gfxLabelFn: function (key) {
         if (key in D3D11StatusCode)
@@ -208,7 +253,7 @@ ChartDisplay.prototype.drawTrends = function ()
     'd2d-trend',
     'Direct2D Trends',
     800, 300, 150);
-  this.onFetch('trend-windows-d2d-v2.json', (function (obj) {
+  this.onFetchTrend('trend-windows-d2d', (function (obj) {
     this.plotPercentageTrend(d2d_elt, obj.trend, {
       gfxLabelFn: function (key) {
         switch (key) {
@@ -234,7 +279,7 @@ ChartDisplay.prototype.drawTrends = function ()
     'windows-vendor-trend',
     'Graphics Vendors, Windows',
     800, 300, 150)
-  this.onFetch('trend-windows-vendors-v2.json', (function (obj) {
+  this.onFetchTrend('trend-windows-vendors', (function (obj) {
     this.plotPercentageTrend(winvendor_elt, obj.trend, {
       gfxLabelFn: function (key) {
         if (key == 'other')
@@ -261,7 +306,7 @@ ChartDisplay.prototype.drawTrends = function ()
         'windows-vendor-gen-trend-' + vendor.nick,
         vendor.name + ' Device Generations, Windows',
         800, 300, 150)
-      this.onFetch('trend-windows-device-gen-' + vendor.nick + '-v2.json', (function (obj) {
+      this.onFetchTrend('trend-windows-device-gen-' + vendor.nick, (function (obj) {
         this.plotPercentageTrend(elt, obj.trend, {});
       }).bind(this));
     }).bind(this))(vendors[i]);